@@ -0,0 +1,289 @@
+import numpy as np
+import scipy.optimize
+import scipy.signal
+
+##############################################################
+# Lightweight AR(1)-GARCH(1,1) estimator
+# Purpose-built replacement for arch.univariate.ARX + GARCH(p=1,q=1) as used by the AutoRegressiveStrategy.
+# Model (Gaussian errors):
+#     r_t       = mu + phi * r_{t-1} + eps_t
+#     sigma2_t  = omega + alpha * eps_{t-1}^2 + beta * sigma2_{t-1}
+# Follows the same conventions as arch so forecasts agree within optimizer tolerance:
+#     - data is rescaled by a power of 10 so the residual variance is in [0.1, 10000)
+#     - the variance recursion is started from arch's exponentially weighted backcast
+#     - omega, alpha, beta are bounded as in arch and alpha + beta < 1
+##############################################################
+
+N_PARAMS            = 5
+BACKCAST_WINDOW     = 75
+BACKCAST_DECAY      = 0.94
+MAX_PERSISTENCE     = 1.0 - 1e-6
+MIN_VARIANCE        = 1e-12
+
+# Grid of (persistence, share of persistence in alpha) used to pick starting values
+STARTING_PERSISTENCE = [0.5, 0.8, 0.9, 0.95, 0.98, 0.99]
+STARTING_ALPHA_SHARE = [0.01, 0.05, 0.1, 0.2]
+
+
+def compute_scale(resids):
+    """
+    Power of 10 that brings the residual variance into [0.1, 10000), as arch's rescale=True does.
+    """
+    variance = float(np.var(resids))
+    rescale  = 1.0
+    scale    = variance
+    while not 0.1 <= scale < 10000.0 and scale > 0:
+        if scale < 1.0:
+            rescale *= 10
+        else:
+            rescale /= 10
+        scale = variance * rescale**2
+    return rescale
+
+
+def compute_backcast(resids):
+    """
+    Exponentially weighted average of the first squared residuals, used as sigma2 before the sample starts.
+    Works row-wise on a (n_windows, n_obs) array.
+    """
+    tau     = min(BACKCAST_WINDOW, resids.shape[-1])
+    weights = BACKCAST_DECAY ** np.arange(tau)
+    weights = weights / weights.sum()
+    return (resids[...,:tau]**2) @ weights
+
+
+def ols_ar_1(y):
+    """
+    Row-wise OLS estimate of y_t = mu + phi * y_{t-1}. Returns (mu, phi) arrays of shape (n_windows,).
+    """
+    y_lag       = y[:,:-1]
+    y_now       = y[:,1:]
+    lag_mean    = y_lag.mean(axis=1,keepdims=True)
+    now_mean    = y_now.mean(axis=1,keepdims=True)
+    lag_demean  = y_lag - lag_mean
+    denominator = (lag_demean**2).sum(axis=1)
+    phi         = np.divide((lag_demean * (y_now - now_mean)).sum(axis=1),denominator,
+                            out=np.zeros(y.shape[0]),where=denominator > 0)
+    mu          = now_mean[:,0] - phi * lag_mean[:,0]
+    return mu, phi
+
+
+def _variance_filter(x, beta):
+    """
+    Runs s_t = x_t + beta * s_{t-1} (with s_{-1} = 0) along the last axis of x, with one beta per row.
+    A single long window goes through scipy's C filter; many windows step through time with vector operations.
+    """
+    if x.shape[0] * 8 < x.shape[1]:
+        return np.stack([scipy.signal.lfilter([1.0],[1.0,-beta[i]],x[i]) for i in range(x.shape[0])])
+
+    out       = np.empty_like(x)
+    out[:,0]  = x[:,0]
+    for t in range(1,x.shape[1]):
+        out[:,t] = x[:,t] + beta * out[:,t-1]
+    return out
+
+
+def _conditional_variance(params, eps, backcast):
+    omega,alpha,beta = params[:,2],params[:,3],params[:,4]
+
+    x       = np.empty_like(eps)
+    x[:,0]  = omega + (alpha + beta) * backcast
+    x[:,1:] = omega[:,None] + alpha[:,None] * eps[:,:-1]**2
+    return np.maximum(_variance_filter(x,beta),MIN_VARIANCE)
+
+
+def ar_garch_log_likelihood(params, y, backcast, return_gradient=False):
+    """
+    Gaussian log-likelihood of AR(1)-GARCH(1,1) for a batch of windows.
+    params is (n_windows, 5) with columns (mu, phi, omega, alpha, beta), y is (n_windows, n_obs) and
+    backcast is (n_windows,). Returns the per-window log-likelihood and, if requested,
+    its analytic gradient with respect to params (computed with a backward pass through the variance recursion).
+    """
+    params   = np.atleast_2d(params)
+    y        = np.atleast_2d(y)
+    backcast = np.atleast_1d(backcast)
+
+    mu,phi,alpha,beta = params[:,0],params[:,1],params[:,3],params[:,4]
+
+    y_lag   = y[:,:-1]
+    eps     = y[:,1:] - mu[:,None] - phi[:,None] * y_lag
+    sigma2  = _conditional_variance(params,eps,backcast)
+
+    log_likelihood = -0.5 * (np.log(2*np.pi) + np.log(sigma2) + eps**2 / sigma2).sum(axis=1)
+
+    if not return_gradient:
+        return log_likelihood
+
+    # Adjoint of the variance recursion: lam_t = dNLL/dsigma2_t including its effect on later periods
+    # (NLL is the negative log-likelihood)
+    d_sigma2 = 0.5 * (1.0 / sigma2 - eps**2 / sigma2**2)
+    lam      = _variance_filter(d_sigma2[:,::-1],beta)[:,::-1]
+
+    # Residuals enter directly and through the next period's variance
+    d_eps        = eps / sigma2
+    d_eps[:,:-1] += 2.0 * alpha[:,None] * eps[:,:-1] * lam[:,1:]
+
+    nll_gradient      = np.empty_like(params)
+    nll_gradient[:,0] = -d_eps.sum(axis=1)
+    nll_gradient[:,1] = -(d_eps * y_lag).sum(axis=1)
+    nll_gradient[:,2] = lam.sum(axis=1)
+    nll_gradient[:,3] = lam[:,0] * backcast + (lam[:,1:] * eps[:,:-1]**2).sum(axis=1)
+    nll_gradient[:,4] = lam[:,0] * backcast + (lam[:,1:] * sigma2[:,:-1]).sum(axis=1)
+
+    return log_likelihood, -nll_gradient
+
+
+########################################################
+# Parameter transformation
+# The optimizer works on (mu, phi, omega, persistence, alpha_share) with box bounds,
+# where alpha = persistence * alpha_share and beta = persistence * (1 - alpha_share),
+# so the stationarity constraint alpha + beta < 1 becomes a simple bound.
+########################################################
+
+def _to_model_params(theta):
+    params      = theta.copy()
+    params[:,3] = theta[:,3] * theta[:,4]
+    params[:,4] = theta[:,3] * (1.0 - theta[:,4])
+    return params
+
+
+def _to_theta_gradient(theta, gradient):
+    theta_gradient      = gradient.copy()
+    theta_gradient[:,3] = gradient[:,3] * theta[:,4] + gradient[:,4] * (1.0 - theta[:,4])
+    theta_gradient[:,4] = theta[:,3] * (gradient[:,3] - gradient[:,4])
+    return theta_gradient
+
+
+def _starting_values(y, backcast, mean_sq_resids):
+    """
+    OLS mean parameters plus the best variance parameters over a small grid, evaluated for all windows at once.
+    """
+    n_windows = y.shape[0]
+    mu,phi    = ols_ar_1(y)
+
+    grid   = [(p,s) for p in STARTING_PERSISTENCE for s in STARTING_ALPHA_SHARE]
+    thetas = np.empty((len(grid),n_windows,N_PARAMS))
+    for i,(persistence,alpha_share) in enumerate(grid):
+        thetas[i,:,0] = mu
+        thetas[i,:,1] = phi
+        thetas[i,:,2] = mean_sq_resids * (1.0 - persistence)
+        thetas[i,:,3] = persistence
+        thetas[i,:,4] = alpha_share
+
+    stacked_theta  = thetas.reshape(-1,N_PARAMS)
+    log_likelihood = ar_garch_log_likelihood(_to_model_params(stacked_theta),np.tile(y,(len(grid),1)),np.tile(backcast,len(grid)))
+    best           = np.nan_to_num(log_likelihood.reshape(len(grid),n_windows),nan=-np.inf).argmax(axis=0)
+    return thetas[best,np.arange(n_windows)]
+
+
+def fit_ar_garch_batch(returns, rescale=True, max_iterations=1000):
+    """
+    Fits AR(1)-GARCH(1,1) to many equal-length windows of returns at once.
+    returns is a (n_windows, n_obs) array (a 1-d array is treated as a single window).
+    Rescaling, backcasts and the starting value search are vectorized across all windows,
+    then each window is refined with L-BFGS-B using the analytic gradient.
+    Returns a dict of arrays with one entry per window.
+    """
+    y = np.atleast_2d(np.asarray(returns,dtype=float))
+
+    if y.shape[1] < 3:
+        raise ValueError('At least 3 returns are required to fit an AR(1)-GARCH(1,1) model')
+    if not np.isfinite(y).all():
+        raise ValueError('Returns contain NaN or infinite values')
+
+    n_windows,n_obs = y.shape
+
+    # Rescale each window like arch does, based on the OLS residuals
+    mu,phi   = ols_ar_1(y)
+    scale    = np.array([compute_scale(y[i,1:] - mu[i] - phi[i] * y[i,:-1]) if rescale else 1.0 for i in range(n_windows)])
+    y_scaled = y * scale[:,None]
+
+    mu,phi         = ols_ar_1(y_scaled)
+    ols_resids     = y_scaled[:,1:] - mu[:,None] - phi[:,None] * y_scaled[:,:-1]
+    backcast       = compute_backcast(ols_resids)
+    mean_sq_resids = (ols_resids**2).mean(axis=1)
+
+    theta_start = _starting_values(y_scaled,backcast,mean_sq_resids)
+    theta_hat   = np.empty_like(theta_start)
+    converged   = np.zeros(n_windows,dtype=bool)
+    n_resids    = n_obs - 1
+
+    # Each window is its own small bounded problem; keeping them apart lets L-BFGS-B build a good
+    # curvature estimate per window, which converges much faster than one stacked problem.
+    for i in range(n_windows):
+        y_window = y_scaled[i:i+1]
+        bounds   = [(None,None),(None,None),(1e-8*mean_sq_resids[i],10.0*mean_sq_resids[i]),(0.0,MAX_PERSISTENCE),(0.0,1.0)]
+
+        def objective(theta_flat):
+            theta                         = theta_flat[None,:]
+            log_likelihood,ll_gradient    = ar_garch_log_likelihood(_to_model_params(theta),y_window,backcast[i:i+1],return_gradient=True)
+            if not np.isfinite(log_likelihood[0]):
+                return np.inf,np.zeros_like(theta_flat)
+            return -log_likelihood[0] / n_resids, -_to_theta_gradient(theta,ll_gradient)[0] / n_resids
+
+        result       = scipy.optimize.minimize(objective,theta_start[i],jac=True,method='L-BFGS-B',bounds=bounds,
+                                               options={'maxiter':max_iterations,'ftol':1e-12,'gtol':1e-7})
+        theta_hat[i] = result.x
+        converged[i] = result.success
+
+    params = _to_model_params(theta_hat)
+    eps    = y_scaled[:,1:] - params[:,0,None] - params[:,1,None] * y_scaled[:,:-1]
+    sigma2 = _conditional_variance(params,eps,backcast)
+
+    return {'params'         : params,
+            'scale'          : scale,
+            'log_likelihood' : ar_garch_log_likelihood(params,y_scaled,backcast),
+            'last_return'    : y_scaled[:,-1],
+            'last_resid'     : eps[:,-1],
+            'last_variance'  : sigma2[:,-1],
+            'converged'      : converged}
+
+
+def forecast_ar_garch_batch(fit):
+    """
+    One step ahead mean and standard deviation forecasts (in the original, unscaled units) for every fitted window.
+    """
+    params          = fit['params']
+    mean_forecast   = params[:,0] + params[:,1] * fit['last_return']
+    var_forecast    = params[:,2] + params[:,3] * fit['last_resid']**2 + params[:,4] * fit['last_variance']
+
+    return {'return_forecast': mean_forecast / fit['scale'],
+            'sd_forecast'    : var_forecast**0.5 / fit['scale']}
+
+
+def forecast_ar_garch(returns, rescale=True):
+    """
+    Fits a single window of returns and returns the one step ahead forecast as
+    {'return_forecast': float, 'sd_forecast': float}, matching arch's ARX(lags=1) + GARCH(1,1) forecast.
+    """
+    forecast = forecast_ar_garch_batch(fit_ar_garch_batch(returns,rescale=rescale))
+    return {'return_forecast': float(forecast['return_forecast'][0]),
+            'sd_forecast'    : float(forecast['sd_forecast'][0])}
+
+
+def forecast_with_arch(returns):
+    """
+    Reference forecast computed with the arch package, used to cross-check the in-house estimator.
+    """
+    import arch
+
+    ar_model             = arch.univariate.ARX(np.asarray(returns,dtype=float),lags=1,rescale=True)
+    ar_model.volatility  = arch.univariate.GARCH(p=1,q=1)
+    res                  = ar_model.fit(update_freq=0,disp="off")
+    forecasts            = res.forecast(horizon=1,reindex=False)
+
+    return {'return_forecast': forecasts.mean.to_numpy()[0][-1] / res.scale,
+            'sd_forecast'    : (forecasts.variance.to_numpy()[0][-1] / np.power(res.scale,2))**0.5}
+
+
+def compare_with_arch(returns, rtol=1e-2):
+    """
+    Fits returns with both estimators and reports the forecasts and whether they agree within rtol.
+    """
+    internal  = forecast_ar_garch(returns)
+    reference = forecast_with_arch(returns)
+    sd_close  = np.isclose(internal['sd_forecast'],reference['sd_forecast'],rtol=rtol)
+    # Return forecasts are close to zero, so compare them against the forecast volatility
+    ret_close = np.abs(internal['return_forecast'] - reference['return_forecast']) <= rtol * reference['sd_forecast']
+
+    return {'internal': internal, 'arch': reference, 'agree': bool(sd_close and ret_close)}
@@ -2,6 +2,10 @@ import pandas as pd
 import numpy as np
 import math
 import UNI_v3_funcs
+import SwapDataset
+import ResolutionPyramid
+import SimulationCache
+import PositionBook
 import copy
 
 class StrategyObservation:
@@ -65,19 +69,26 @@ class StrategyObservation:
             self.liquidity_ranges         = copy.deepcopy(liquidity_ranges)
 
             # Update amounts in each position according to current pool price
-            for i in range(len(self.liquidity_ranges)):
-                self.liquidity_ranges[i]['time'] = self.time
-
+            if isinstance(self.liquidity_ranges,PositionBook.PositionBook):
+                if 'time' in self.liquidity_ranges:
+                    self.liquidity_ranges['time'][:] = self.time
                 if self.simulate_strat:
-                    amount_0, amount_1 = UNI_v3_funcs.get_amounts(self.price_tick_current,
-                                                                 self.liquidity_ranges[i]['lower_bin_tick'],
-                                                                 self.liquidity_ranges[i]['upper_bin_tick'],
-                                                                 self.liquidity_ranges[i]['position_liquidity'],
-                                                                 self.decimals_0,
-                                                                 self.decimals_1)
+                    self.liquidity_ranges.update_amounts(self.price_tick_current,self.decimals_0,self.decimals_1)
+
+            else:
+                for i in range(len(self.liquidity_ranges)):
+                    self.liquidity_ranges[i]['time'] = self.time
 
-                    self.liquidity_ranges[i]['token_0'] = amount_0
-                    self.liquidity_ranges[i]['token_1'] = amount_1
+                    if self.simulate_strat:
+                        amount_0, amount_1 = UNI_v3_funcs.get_amounts(self.price_tick_current,
+                                                                     self.liquidity_ranges[i]['lower_bin_tick'],
+                                                                     self.liquidity_ranges[i]['upper_bin_tick'],
+                                                                     self.liquidity_ranges[i]['position_liquidity'],
+                                                                     self.decimals_0,
+                                                                     self.decimals_1)
+
+                        self.liquidity_ranges[i]['token_0'] = amount_0
+                        self.liquidity_ranges[i]['token_1'] = amount_1
 
             # If backtesting swaps, accrue the fees in the provided period
             if swaps is not None:
@@ -97,14 +108,24 @@ class StrategyObservation:
         fees_earned_token_1 = 0.0
 
         if len(relevant_swaps) > 0:
-            for i in range(len(self.liquidity_ranges)):
-                in_range   = (self.liquidity_ranges[i]['lower_bin_tick'] <= relevant_swaps['tick_swap']) & (self.liquidity_ranges[i]['upper_bin_tick'] >= relevant_swaps['tick_swap']).astype(int)
-                token_0_in = (relevant_swaps['token_in'] == 'token0').astype(int)
+            # relevant_swaps is a swap DataFrame or SwapDataset.SwapArrays
+            tick_swap,token_0_in,virtual_liquidity,traded_in = SwapDataset.fee_columns(relevant_swaps)
+            token_0_in = token_0_in.astype(int)
+
+            if isinstance(self.liquidity_ranges,PositionBook.PositionBook):
+                fees_0,fees_1        = self.liquidity_ranges.range_fees(tick_swap,token_0_in,virtual_liquidity,traded_in,self.fee_tier)
+                fees_earned_token_0  = fees_0.sum()
+                fees_earned_token_1  = fees_1.sum()
 
-                fraction_fees_earned_position = self.liquidity_ranges[i]['position_liquidity']/(self.liquidity_ranges[i]['position_liquidity'] + relevant_swaps['virtual_liquidity'])
+            else:
+                for i in range(len(self.liquidity_ranges)):
+                    in_range   = ((self.liquidity_ranges[i]['lower_bin_tick'] <= tick_swap) & (self.liquidity_ranges[i]['upper_bin_tick'] >= tick_swap)).astype(int)
 
-                fees_earned_token_0 += (in_range * token_0_in     * self.fee_tier * fraction_fees_earned_position * relevant_swaps['traded_in']).sum()
-                fees_earned_token_1 += (in_range * (1-token_0_in) * self.fee_tier * fraction_fees_earned_position * relevant_swaps['traded_in']).sum()
+                    fraction_fees_earned_position = self.liquidity_ranges[i]['position_liquidity']/(self.liquidity_ranges[i]['position_liquidity'] + virtual_liquidity)
+
+                    # nansum, like pandas, skips swaps without a liquidity value
+                    fees_earned_token_0 += np.nansum(in_range * token_0_in     * self.fee_tier * fraction_fees_earned_position * traded_in)
+                    fees_earned_token_1 += np.nansum(in_range * (1-token_0_in) * self.fee_tier * fraction_fees_earned_position * traded_in)
 
         
         self.token_0_fees_uncollected += fees_earned_token_0
@@ -122,17 +143,21 @@ class StrategyObservation:
         removed_amount_1    = 0.0
 
         # For every bin, get the amounts you currently have and withdraw
-        for i in range(len(self.liquidity_ranges)):
+        if isinstance(self.liquidity_ranges,PositionBook.PositionBook):
+            removed_amount_0,removed_amount_1 = self.liquidity_ranges.remove(self.price_tick_current,self.decimals_0,self.decimals_1)
+
+        else:
+            for i in range(len(self.liquidity_ranges)):
 
-            position_liquidity = self.liquidity_ranges[i]['position_liquidity']
+                position_liquidity = self.liquidity_ranges[i]['position_liquidity']
 
-            TICK_A             = self.liquidity_ranges[i]['lower_bin_tick']
-            TICK_B             = self.liquidity_ranges[i]['upper_bin_tick']
+                TICK_A             = self.liquidity_ranges[i]['lower_bin_tick']
+                TICK_B             = self.liquidity_ranges[i]['upper_bin_tick']
 
-            token_amounts      = UNI_v3_funcs.get_amounts(self.price_tick_current,TICK_A,TICK_B,
-                                                     position_liquidity,self.decimals_0,self.decimals_1)
-            removed_amount_0   += token_amounts[0]
-            removed_amount_1   += token_amounts[1]
+                token_amounts      = UNI_v3_funcs.get_amounts(self.price_tick_current,TICK_A,TICK_B,
+                                                         position_liquidity,self.decimals_0,self.decimals_1)
+                removed_amount_0   += token_amounts[0]
+                removed_amount_1   += token_amounts[1]
 
         self.liquidity_in_0 = removed_amount_0 + self.token_0_left_over + self.token_0_fees_uncollected
         self.liquidity_in_1 = removed_amount_1 + self.token_1_left_over + self.token_1_fees_uncollected
@@ -144,13 +169,56 @@ class StrategyObservation:
         self.token_1_fees_uncollected = 0.0
 
 
+########################################################
+# Check simulation inputs before running a backtest
+# Shared by simulate_strategy and the strategy specific fast backtesters
+########################################################
+
+SWAP_COLUMNS_REQUIRED = ['tick_swap','token_in','virtual_liquidity','traded_in']
+
+def validate_simulation_inputs(price_data,swap_data,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1):
+
+    if len(price_data) == 0:
+        raise ValueError('price_data is empty')
+    if not price_data.index.is_monotonic_increasing:
+        raise ValueError('price_data must be sorted by time')
+    price_values = np.asarray(price_data,dtype=float)
+    if not np.all(np.isfinite(price_values)) or np.any(price_values <= 0):
+        raise ValueError('price_data must contain finite positive prices')
+
+    if isinstance(swap_data,SwapDataset.SwapArrays):
+        if np.any(np.diff(swap_data.time) < 0):
+            raise ValueError('swap_data must be sorted by time')
+    else:
+        missing_columns = [x for x in SWAP_COLUMNS_REQUIRED if x not in swap_data.columns]
+        if len(missing_columns) > 0:
+            raise ValueError('swap_data is missing columns: '+', '.join(missing_columns))
+        if not swap_data.index.is_monotonic_increasing:
+            raise ValueError('swap_data must be sorted by time')
+
+    if liquidity_in_0 < 0 or liquidity_in_1 < 0:
+        raise ValueError('Initial token amounts must be non-negative')
+    if fee_tier <= 0:
+        raise ValueError('fee_tier must be positive')
+    if int(decimals_0) != decimals_0 or int(decimals_1) != decimals_1:
+        raise ValueError('Token decimals must be integers')
+
 ########################################################
 # Simulate strategy using a pandas Series called price_data, which has as an index
 # the time point, and contains the pool price (token 1 per token 0)
+# swap_data is a DataFrame of swaps or a SwapDataset.SwapArrays (eg. memory-mapped with SwapDataset.open_swap_dataset)
+# With cache (True for SimulationCache.default_cache(), or a SimulationCache.SimulationCache) results are memoized by a hash
+# of all the inputs and returned as the DataFrame of dict_components rows, which generate_simulation_series accepts
 ########################################################
 
 def simulate_strategy(price_data,swap_data,strategy_in,
-                       liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1):
+                       liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,cache=False):
+
+    if cache:
+        return SimulationCache.cached_simulation(simulate_strategy,price_data,swap_data,strategy_in,
+                                                 liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,cache=cache)
+
+    validate_simulation_inputs(price_data,swap_data,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1)
 
     strategy_results = []
 
@@ -166,7 +234,10 @@ def simulate_strategy(price_data,swap_data,strategy_in,
         # After initialization
         else:
 
-            relevant_swaps = swap_data[price_data.index[i-1]:price_data.index[i]]
+            if isinstance(swap_data,SwapDataset.SwapArrays):
+                relevant_swaps = swap_data.between(price_data.index[i-1],price_data.index[i])
+            else:
+                relevant_swaps = swap_data[price_data.index[i-1]:price_data.index[i]]
             strategy_results.append(StrategyObservation(price_data.index[i],
                                               price_data[i],
                                               strategy_in,
@@ -193,18 +264,28 @@ def generate_simulation_series(simulations,strategy_in,token_0_usd_data = None):
 
     # token_0_usd_data has in quotePrice
     # token_0 / usd value for each index
-
-    data_strategy                    = pd.DataFrame([strategy_in.dict_components(i) for i in simulations])
+    
+    # simulations is either the list of StrategyObservation from simulate_strategy, or a DataFrame
+    # with one row of strategy_in.dict_components per observation (from a fast backtester)
+    if isinstance(simulations,pd.DataFrame):
+        data_strategy                = simulations.copy()
+        token_0_initial              = data_strategy['token_0_allocated'].iloc[0] + data_strategy['token_0_left_over'].iloc[0]
+        token_1_initial              = data_strategy['token_1_allocated'].iloc[0] + data_strategy['token_1_left_over'].iloc[0]
+    else:
+        data_strategy                = pd.DataFrame([strategy_in.dict_components(i) for i in simulations])
+        allocated_0,allocated_1      = PositionBook.range_totals(simulations[0].liquidity_ranges)
+        token_0_initial              = allocated_0 + simulations[0].token_0_left_over
+        token_1_initial              = allocated_1 + simulations[0].token_1_left_over
+        
     data_strategy                    = data_strategy.set_index('time',drop=False)
     data_strategy                    = data_strategy.sort_index()
 
-    token_0_initial                  = simulations[0].liquidity_ranges[0]['token_0'] + simulations[0].liquidity_ranges[1]['token_0'] + simulations[0].token_0_left_over
-    token_1_initial                  = simulations[0].liquidity_ranges[0]['token_1'] + simulations[0].liquidity_ranges[1]['token_1'] + simulations[0].token_1_left_over
-
     if token_0_usd_data is None:
         data_strategy['value_position_usd']       = data_strategy['value_position_in_token_0']
-        data_strategy['base_position_value_usd']  = data_strategy['base_position_value_in_token_0']
-        data_strategy['limit_position_value_usd'] = data_strategy['limit_position_value_in_token_0']
+        # Base and limit position values, for the strategies with those two ranges
+        for position in ['base','limit']:
+            if position+'_position_value_in_token_0' in data_strategy.columns:
+                data_strategy[position+'_position_value_usd'] = data_strategy[position+'_position_value_in_token_0']
         data_strategy['cum_fees_usd']             = data_strategy['token_0_fees'].cumsum() + (data_strategy['token_1_fees'] / data_strategy['price']).cumsum()
         data_strategy['token_0_hold_usd']         = token_0_initial
         data_strategy['token_1_hold_usd']         = token_1_initial / data_strategy['price']
@@ -222,8 +303,9 @@ def generate_simulation_series(simulations,strategy_in,token_0_usd_data = None):
 
         # Generate usd position values
         data_return['value_position_usd']       = data_return['value_position_in_token_0']*data_return['price_0_usd']
-        data_return['base_position_value_usd']  = data_return['base_position_value_in_token_0']*data_return['price_0_usd']
-        data_return['limit_position_value_usd'] = data_return['limit_position_value_in_token_0']*data_return['price_0_usd']
+        for position in ['base','limit']:
+            if position+'_position_value_in_token_0' in data_return.columns:
+                data_return[position+'_position_value_usd'] = data_return[position+'_position_value_in_token_0']*data_return['price_0_usd']
         data_return['cum_fees_0']               = data_return['token_0_fees'].cumsum() + (data_return['token_1_fees'] / data_return['price']).cumsum()
         data_return['cum_fees_usd']             = data_return['cum_fees_0']*data_return['price_0_usd']
         data_return['token_0_hold_usd']         = token_0_initial * data_return['price_0_usd']
@@ -237,13 +319,106 @@ def generate_simulation_series(simulations,strategy_in,token_0_usd_data = None):
 # Calculates % returns over a minutes frequency
 ########################################################
 
-def fill_time(data):
-    price_range               = pd.DataFrame({'time_pd': pd.date_range(data.index.min(),data.index.max(),freq='1 min',tz='UTC')})
-    price_range               = price_range.set_index('time_pd')
-    new_data                  = price_range.merge(data,left_index=True,right_index=True,how='left').ffill()
-    return new_data
+MINUTE_NS = 60*10**9
+
+class FilledMinutes:
+    """
+    Lazy forward-filled 1-minute view of time indexed data, between its first and last time.
+    Only the selected columns are kept (as the input's arrays, without copies when every time falls on the grid) together with
+    the minute of each row; the dense grid is never built. Minute i of the grid takes, for each column, the last non missing
+    value at or before it (rows off the minute grid are ignored, and duplicated minutes keep their last row).
+    Read it with column(), to_frame() or resample_last().
+    """
+    def __init__(self,data,columns=None):
+
+        columns    = list(data.columns) if columns is None else list(columns)
+        times      = SwapDataset.time_ns(data.index)
+        if len(times) > 0 and np.any(np.diff(times) < 0):
+            order  = np.argsort(times,kind='stable')
+            times  = times[order]
+            data   = data.iloc[order]
+        self.start     = int(times[0]) if len(times) > 0 else 0
+        self.n_minutes = int((times[-1] - self.start)//MINUTE_NS + 1) if len(times) > 0 else 0
+        self.index     = pd.date_range(pd.Timestamp(self.start,tz='UTC'),periods=self.n_minutes,freq='1min',name='time_pd')
+
+        on_grid        = (times - self.start) % MINUTE_NS == 0
+        self.minutes   = (times - self.start)//MINUTE_NS
+        self.values    = {x: data[x].to_numpy() for x in columns}
+        if not on_grid.all():
+            self.minutes = self.minutes[on_grid]
+            self.values  = {x: values[on_grid] for x,values in self.values.items()}
+        self.positions_cache = {}
+
+    def __len__(self):
+        return self.n_minutes
+
+    def positions(self,column):
+        """
+        Row of column's values that fills each minute of the grid (-1 before its first non missing value).
+        """
+        if column not in self.positions_cache:
+            rows      = np.flatnonzero(pd.notna(self.values[column]))
+            # Last row at or before each minute, the last one of duplicated minutes
+            positions = np.searchsorted(self.minutes[rows],np.arange(self.n_minutes),side='right') - 1
+            self.positions_cache[column] = np.where(positions >= 0,rows[np.maximum(positions,0)],-1)
+        return self.positions_cache[column]
+
+    def take(self,column,minutes=None):
+        """
+        Forward-filled values of column at the given minutes of the grid (all of them by default), as a NumPy array.
+        """
+        positions = self.positions(column) if minutes is None else self.positions(column)[minutes]
+        values    = self.values[column]
+        filled    = values[np.maximum(positions,0)] if len(values) > 0 else np.full(len(positions),np.nan)
+        if np.any(positions < 0):
+            filled = filled.astype(float) if filled.dtype.kind in 'iub' else filled.copy()
+            filled[positions < 0] = np.nan if filled.dtype.kind in 'fc' else None
+        return filled
+
+    def column(self,column):
+        """
+        Dense forward-filled Series of one column on the minute grid.
+        """
+        return pd.Series(self.take(column),index=self.index,name=column)
+
+    def to_frame(self,columns=None):
+        """
+        Dense forward-filled DataFrame of the selected columns (all the view's columns by default) on the minute grid.
+        """
+        columns = list(self.values) if columns is None else columns
+        return pd.DataFrame({x: self.take(x) for x in columns},index=self.index)
+
+    def resample_last(self,rule,columns=None,**kwargs):
+        """
+        Same as to_frame(columns).resample(rule,**kwargs).last(), reading only the last minute of each bin.
+        """
+        columns = list(self.values) if columns is None else columns
+        bins    = pd.Series(np.arange(self.n_minutes),index=self.index).resample(rule,**kwargs).last()
+        last    = bins.to_numpy()
+        valid   = ~np.isnan(last)
+        frame   = pd.DataFrame(index=bins.index)
+        for x in columns:
+            values       = self.take(x,last[valid].astype(np.int64))
+            column       = np.full(len(bins),np.nan,dtype=values.dtype if values.dtype.kind in 'fcO' else float)
+            column[valid] = values
+            frame[x]     = column
+        return frame
+
+def fill_time(data,columns=None):
+    """
+    Forward-fills data (or only its columns) on a 1-minute grid between its first and last time, as a dense DataFrame.
+    Use FilledMinutes directly to avoid building the dense grid.
+    """
+    return FilledMinutes(data,columns).to_frame()
 
 def aggregate_price_data(data,frequency):
+    """
+    Aggregates prices to frequency ('M', 'H' or 'D'). data can also be a price ResolutionPyramid.Pyramid, which is read instead of resampled.
+    """
+    if isinstance(data,ResolutionPyramid.Pyramid):
+        if data.kind != 'price':
+            raise ValueError('aggregate_price_data needs a price pyramid')
+        return data.read(frequency)
 
     if   frequency == 'M':
             resample_option      = '1 min'
@@ -263,6 +438,13 @@ def aggregate_price_data(data,frequency):
     return price_data_aggregated
 
 def aggregate_swap_data(data, frequency):
+    """
+    Aggregates swaps to frequency ('M', 'H' or 'D'). data can also be a swap ResolutionPyramid.Pyramid, which is read instead of resampled.
+    """
+    if isinstance(data,ResolutionPyramid.Pyramid):
+        if data.kind != 'swap':
+            raise ValueError('aggregate_swap_data needs a swap pyramid')
+        return data.read(frequency)
 
     if   frequency == 'M':
             resample_option      = '1 min'
@@ -315,11 +497,155 @@ def analyze_strategy(data_usd,frequency = 'M'):
 
     return summary_strat
 
+########################################################
+# Batched analytics over many simulations
+# Results of many simulations are stacked in one table (one row per simulation and time, see stack_simulations)
+# and every metric is computed for all of them with a few grouped passes.
+########################################################
+
+ANNUALIZATION_FACTORS = {'M':365*24*60,'H':365*24,'D':365}
+
+def stack_simulations(simulations,id_column='simulation'):
+    """
+    Stacks the results of generate_simulation_series for many simulations ({id: data_usd} or a list) into one table with an id_column.
+    """
+    if not isinstance(simulations,dict):
+        simulations = dict(enumerate(simulations))
+    return pd.concat([data_usd.assign(**{id_column:simulation_id}) for simulation_id,data_usd in simulations.items()],ignore_index=True)
+
+def analyze_strategies(results,frequency='M',id_column='simulation'):
+    """
+    analyze_strategy for every simulation of a stacked results table, in grouped passes over the whole table.
+    Rows of each simulation must be in time order. Returns one row of metrics per simulation, indexed by id_column.
+    compounds is NaN for strategies without a compound_point column, and the base position metrics for strategies without
+    base and limit positions (eg. a PositionBook of many ranges).
+    """
+    annualization_factor = ANNUALIZATION_FACTORS[frequency]
+    groups               = results.groupby(id_column,sort=False)
+    first                = groups.head(1).set_index(id_column)
+    last                 = groups.tail(1).set_index(id_column)
+
+    days_strategy        = (groups['time'].max() - groups['time'].min()).dt.days
+    initial_value        = first['value_hold_usd']
+    net_return           = last['value_position_usd']/initial_value - 1
+    net_apr              = net_return * 365 / days_strategy
+    value_returns        = results['value_position_usd'] / groups['value_position_usd'].shift(1) - 1
+    volatility           = value_returns.groupby(results[id_column],sort=False).var()**0.5 * annualization_factor**0.5
+    value_max            = groups['value_position_usd'].max()
+    if 'base_position_value_in_token_0' in results.columns and 'limit_position_value_in_token_0' in results.columns:
+        base_share       = results['base_position_value_in_token_0'] / (results['base_position_value_in_token_0'] +
+                           results['limit_position_value_in_token_0'] + results['value_left_over_in_token_0'])
+    else:
+        base_share       = pd.Series(np.nan,index=results.index)
+    if 'base_range_upper' in results.columns and 'base_range_lower' in results.columns:
+        base_width       = (results['base_range_upper'] - results['base_range_lower']) / results['price_at_reset']
+    else:
+        base_width       = pd.Series(np.nan,index=results.index)
+    base_share_groups    = base_share.groupby(results[id_column],sort=False)
+    base_width_groups    = base_width.groupby(results[id_column],sort=False)
+
+    summary = pd.DataFrame({
+                        'days_strategy'        : days_strategy,
+                        'gross_fee_apr'        : last['cum_fees_usd']/initial_value * 365 / days_strategy,
+                        'gross_fee_return'     : last['cum_fees_usd']/initial_value,
+                        'net_apr'              : net_apr,
+                        'net_return'           : net_return,
+                        'rebalances'           : groups['reset_point'].sum(),
+                        'compounds'            : groups['compound_point'].sum() if 'compound_point' in results.columns else np.nan,
+                        'max_drawdown'         : (value_max - groups['value_position_usd'].min()) / value_max,
+                        'volatility'           : volatility,
+                        'sharpe_ratio'         : net_apr / volatility,
+                        'impermanent_loss'     : (last['value_position_usd'] - last['value_hold_usd']) / last['value_hold_usd'],
+                        'mean_base_position'   : base_share_groups.mean(),
+                        'median_base_position' : base_share_groups.median(),
+                        'mean_base_width'      : base_width_groups.mean(),
+                        'median_base_width'    : base_width_groups.median(),
+                        'final_value'          : last['value_position_usd']
+                    })
+    summary.index.name = id_column
+    return summary
+
+def rolling_strategy_metrics(results,window='30D',id_column='simulation'):
+    """
+    Rolling window metrics of every simulation of a stacked results table, at each of its rows:
+    net and gross fee APR over the trailing window (NaN until a full window is available), drawdown from the highest
+    position value within the window, and impermanent loss. Rows of each simulation must be in time order.
+    """
+    window      = pd.Timedelta(window)
+    window_days = window / pd.Timedelta(days=1)
+    data        = results[[id_column,'time','value_position_usd','value_hold_usd','cum_fees_usd']].reset_index(drop=True)
+    data['time'] = pd.to_datetime(data['time'],utc=True)
+    data['row']  = np.arange(len(data))
+
+    # Position value and fees at the start of the trailing window (the last row at or before time - window)
+    start        = pd.merge_asof(data.assign(time=data['time'] - window).sort_values('time',kind='stable'),
+                                 data[[id_column,'time','value_position_usd','cum_fees_usd']].sort_values('time',kind='stable'),
+                                 on='time',by=id_column,direction='backward',suffixes=('','_start')).sort_values('row')
+    value_start  = start['value_position_usd_start'].to_numpy()
+    fees_start   = start['cum_fees_usd_start'].to_numpy()
+    # Highest position value in the trailing window, computed with the rows grouped by simulation and put back in row order
+    codes        = pd.factorize(data[id_column])[0]
+    order        = np.argsort(codes,kind='stable')
+    window_max   = np.empty(len(data))
+    window_max[order] = data.iloc[order].groupby(codes[order]).rolling(window,on='time')['value_position_usd'].max().to_numpy()
+
+    return pd.DataFrame({id_column:             data[id_column],
+                         'time':                data['time'],
+                         'rolling_net_apr':     (data['value_position_usd'].to_numpy()/value_start - 1) * 365 / window_days,
+                         'rolling_fee_apr':     (data['cum_fees_usd'].to_numpy() - fees_start)/value_start * 365 / window_days,
+                         'rolling_drawdown':    1 - data['value_position_usd'].to_numpy()/window_max,
+                         'impermanent_loss':    (data['value_position_usd'] - data['value_hold_usd']) / data['value_hold_usd']})
+
+########################################################
+# Plots
+# Long series are downsampled before they are handed to Plotly: the x axis is cut in buckets of consecutive rows
+# and each bucket keeps its first and last row and the rows with the minimum and maximum of every plotted column,
+# so extremes survive, together with any rows flagged to keep (eg. reset points).
+########################################################
+
+PLOT_POINT_BUDGET = 4000   # points per trace, None draws every row
+
+def downsample_plot_data(data,columns,max_points=PLOT_POINT_BUDGET,keep=None):
+    """
+    Rows of data needed to draw its columns with at most about max_points points per trace (min-max per bucket of rows),
+    plus the rows where keep is True. Returns data itself if it is small enough or max_points is None.
+    columns must hold the series as they are drawn: derived series (ratios, differences, stacked sums) are added as columns first.
+    """
+    n_rows = len(data)
+    if max_points is None or n_rows <= max_points:
+        return data
+    n_buckets = max(1,max_points // (2*len(columns) + 2))
+    bucket    = np.arange(n_rows) * n_buckets // n_rows
+    starts    = np.searchsorted(bucket,np.arange(n_buckets))
+    rows      = [starts,np.append(starts[1:] - 1,n_rows - 1)]
+    for column in columns:
+        values = pd.Series(np.asarray(data[column],dtype=float)).groupby(bucket)
+        rows.extend([values.idxmin().dropna().to_numpy(dtype=np.int64),values.idxmax().dropna().to_numpy(dtype=np.int64)])
+    if keep is not None:
+        rows.append(np.flatnonzero(np.asarray(keep,dtype=bool)))
+    return data.iloc[np.unique(np.concatenate(rows))]
+
+def output_figure(fig,show=True,export_path=None):
+    """
+    Renders fig as a png (if show) and writes it to export_path (.html, or an image format supported by Plotly) if given.
+    """
+    if export_path is not None:
+        if export_path.endswith('.html'):
+            fig.write_html(export_path)
+        else:
+            fig.write_image(export_path)
+    if show:
+        fig.show(renderer="png")
+    return fig
+
 
-def plot_strategy(data_strategy,y_axis_label,base_color = '#ff0000',flip_price_axis=False):
+def plot_strategy(data_strategy,y_axis_label,base_color = '#ff0000',flip_price_axis=False,max_points=PLOT_POINT_BUDGET,show=True,export_path=None):
     import plotly.graph_objects as go
     CHART_SIZE = 300
 
+    range_columns = ['base_range_lower','base_range_upper','limit_range_lower','limit_range_upper','reset_range_lower','reset_range_upper','price']
+    data_strategy = downsample_plot_data(data_strategy,range_columns,max_points,data_strategy['reset_point'] if 'reset_point' in data_strategy.columns else None)
+
     if flip_price_axis:
         data_strategy_here = data_strategy.copy()
         data_strategy_here.base_range_lower  = 1/data_strategy_here.base_range_lower
@@ -389,15 +715,15 @@ def plot_strategy(data_strategy,y_axis_label,base_color = '#ff0000',flip_price_a
         yaxis_title=y_axis_label,
     )
 
-    fig_strategy.show(renderer="png")
+    return output_figure(fig_strategy,show,export_path)
 
-    return fig_strategy
 
-
-def plot_position_value(data_strategy):
+def plot_position_value(data_strategy,max_points=PLOT_POINT_BUDGET,show=True,export_path=None):
     import plotly.graph_objects as go
     CHART_SIZE = 300
 
+    data_strategy = downsample_plot_data(data_strategy,['value_position_usd','value_hold_usd'],max_points)
+
     fig_strategy = go.Figure()
     fig_strategy.add_trace(go.Scatter(
         x=data_strategy['time'],
@@ -419,14 +745,17 @@ def plot_position_value(data_strategy):
         yaxis_title='Position Value',
     )
 
-    fig_strategy.show(renderer="png")
-
-    return fig_strategy
+    return output_figure(fig_strategy,show,export_path)
 
 
-def plot_asset_composition(data_strategy,token_0_name,token_1_name):
+def plot_asset_composition(data_strategy,token_0_name,token_1_name,max_points=PLOT_POINT_BUDGET,show=True,export_path=None):
     import plotly.graph_objects as go
     CHART_SIZE = 300
+
+    # Downsample the plotted series: token 1 in units of token 0, and the share of token 0 that groupnorm='percent' draws
+    data_strategy = data_strategy.assign(token_1_in_token_0=data_strategy['token_1_total']/data_strategy['price'])
+    data_strategy = data_strategy.assign(token_0_share=data_strategy['token_0_total']/(data_strategy['token_0_total'] + data_strategy['token_1_in_token_0']))
+    data_strategy = downsample_plot_data(data_strategy,['token_0_total','token_1_in_token_0','token_0_share'],max_points)
     # 3 - Asset Composition
     fig_composition = go.Figure()
     fig_composition.add_trace(go.Scatter(
@@ -438,7 +767,7 @@ def plot_asset_composition(data_strategy,token_0_name,token_1_name):
         groupnorm='percent'
     ))
     fig_composition.add_trace(go.Scatter(
-        x=data_strategy['time'], y=data_strategy['token_1_total']/data_strategy['price'],
+        x=data_strategy['time'], y=data_strategy['token_1_in_token_0'],
         mode='lines',
         name=token_1_name,
         line=dict(width=0.5, color='#f4f4f4'),
@@ -462,15 +791,17 @@ def plot_asset_composition(data_strategy,token_0_name,token_1_name):
         legend_title='Token'
     )
 
-    fig_composition.show(renderer="png")
-
-    return fig_composition
+    return output_figure(fig_composition,show,export_path)
 
-def plot_position_return_decomposition(data_strategy):
+def plot_position_return_decomposition(data_strategy,max_points=PLOT_POINT_BUDGET,show=True,export_path=None):
     import plotly.graph_objects as go
     INITIAL_POSITION_VALUE = data_strategy.iloc[0]['value_position_usd']
     CHART_SIZE = 300
 
+    # The other traces are the columns scaled by INITIAL_POSITION_VALUE, which keeps their extremes
+    data_strategy = data_strategy.assign(value_hold_minus_position_usd=data_strategy['value_hold_usd'] - data_strategy['value_position_usd'])
+    data_strategy = downsample_plot_data(data_strategy,['cum_fees_usd','value_hold_minus_position_usd','value_hold_usd','value_position_usd'],max_points)
+
     fig_income = go.Figure()
     fig_income.add_trace(go.Scatter(
         x=data_strategy['time'],
@@ -483,7 +814,7 @@ def plot_position_return_decomposition(data_strategy):
 
     fig_income.add_trace(go.Scatter(
         x=data_strategy['time'],
-        y=(data_strategy['value_hold_usd']-data_strategy['value_position_usd'])/INITIAL_POSITION_VALUE,
+        y=data_strategy['value_hold_minus_position_usd']/INITIAL_POSITION_VALUE,
         fill=None,
         mode='lines',
         line_color='black',
@@ -518,14 +849,16 @@ def plot_position_return_decomposition(data_strategy):
         yaxis=dict(tickformat = "%"),
     )
 
-    fig_income.show(renderer="png")
+    return output_figure(fig_income,show,export_path)
 
-    return fig_income
 
-
-def plot_position_composition(data_strategy):
+def plot_position_composition(data_strategy,max_points=PLOT_POINT_BUDGET,show=True,export_path=None):
     import plotly.graph_objects as go
     CHART_SIZE = 300
+
+    # The stacked chart draws the limit position on top of the base one
+    data_strategy = data_strategy.assign(total_position_value_usd=data_strategy['base_position_value_usd'] + data_strategy['limit_position_value_usd'])
+    data_strategy = downsample_plot_data(data_strategy,['base_position_value_usd','limit_position_value_usd','total_position_value_usd'],max_points)
     fig_position_composition = go.Figure()
     fig_position_composition.add_trace(go.Scatter(
         x=data_strategy['time'], y=data_strategy['base_position_value_usd'],
@@ -552,6 +885,4 @@ def plot_position_composition(data_strategy):
         legend_title='Value'
     )
 
-    fig_position_composition.show(renderer="png")
-
-    return fig_position_composition
+    return output_figure(fig_position_composition,show,export_path)
@@ -1,14 +1,45 @@
 import pandas as pd
 import numpy as np
 import math
-import arch
 import UNI_v3_funcs
 import ActiveStrategyFramework
+import ARGarchModel
 import scipy
 import copy
 
+# Rolling window (in minutes) of the median absolute deviation filter applied to the model data
+MAD_WINDOW_SIZE = 60*24*30
+
+def clean_data_for_garch(data_in,z_score_cutoff=5,window_size=MAD_WINDOW_SIZE):
+    """
+    Fills the prices on a 1-minute grid and drops the outliers further than z_score_cutoff rolling median absolute deviations
+    from the rolling median. The filter only looks back, so cleaning a long range once and slicing it only differs from cleaning
+    each slice at the start of the slice, where the rolling windows are already filled.
+    """
+    data_filled                  = ActiveStrategyFramework.fill_time(data_in,columns=['quotePrice'])
+
+    # Filter according to Median Absolute Deviation
+    # 1. Generate rolling median
+    data_filled_rolling              = data_filled.quotePrice.rolling(window=window_size) 
+    data_filled['roll_median']       = data_filled_rolling.median()
+    
+    # 2. Compute rolling absolute deviation of current price from median under Gaussian
+    roll_dev                         = np.abs(data_filled.quotePrice - data_filled.roll_median)
+    data_filled['median_abs_dev']    = 1.4826*roll_dev.rolling(window=window_size).median()
+    
+    # 3. Identify outliers using MAD
+    outlier_indices                = np.abs(data_filled.quotePrice - data_filled.roll_median) >= z_score_cutoff*data_filled['median_abs_dev']
+
+    # impute
+    #data_filled['quotePrice']      = np.where(outlier_indices.values == 0,  data_filled['quotePrice'].values,data_filled['roll_median'].values)
+
+    # drop
+    data_filled = data_filled[~outlier_indices]
+    return data_filled
+
+
 class AutoRegressiveStrategy:
-    def __init__(self,model_data,alpha_param,tau_param,volatility_reset_ratio,tokens_outside_reset = .05,data_frequency='D',default_width = .5,days_ar_model = 180,return_forecast_cutoff=0.15,z_score_cutoff=5):
+    def __init__(self,model_data,alpha_param,tau_param,volatility_reset_ratio,tokens_outside_reset = .05,data_frequency='D',default_width = .5,days_ar_model = 180,return_forecast_cutoff=0.15,z_score_cutoff=5,garch_estimator='arch',clean_model_data=True):
         
         
         # Allow for different input data frequencies, always get 1 day ahead forecast
@@ -27,6 +58,9 @@ class AutoRegressiveStrategy:
             self.resample_option      = '1 min'
             self.window_size          = 60
             
+        # AR(1)-GARCH(1,1) estimator: 'arch' uses the arch package, 'internal' the lightweight ARGarchModel
+        if garch_estimator not in ('arch','internal'):
+            raise ValueError('Unsupported GARCH estimator:'+str(garch_estimator))
         
         self.alpha_param            = alpha_param
         self.tau_param              = tau_param
@@ -37,35 +71,18 @@ class AutoRegressiveStrategy:
         self.return_forecast_cutoff = return_forecast_cutoff
         self.days_ar_model          = days_ar_model
         self.z_score_cutoff         = z_score_cutoff
-        self.window_size            = 60*24*30
-        self.model_data             = self.clean_data_for_garch(model_data)
+        self.garch_estimator        = garch_estimator
+        self.window_size            = MAD_WINDOW_SIZE
+        # model_data can be cleaned once beforehand (clean_data_for_garch over a longer range) and shared by many strategies
+        self.model_data             = self.clean_data_for_garch(model_data) if clean_model_data else model_data
 
         
     #####################################
     # Estimate AR model at current timepoint
     #####################################
     
-    def clean_data_for_garch(self,data_in):        
-            data_filled                  = ActiveStrategyFramework.fill_time(data_in)
-
-            # Filter according to Median Absolute Deviation
-            # 1. Generate rolling median
-            data_filled_rolling              = data_filled.quotePrice.rolling(window=self.window_size) 
-            data_filled['roll_median']       = data_filled_rolling.median()
-            
-            # 2. Compute rolling absolute deviation of current price from median under Gaussian
-            roll_dev                         = np.abs(data_filled.quotePrice - data_filled.roll_median)
-            data_filled['median_abs_dev']    = 1.4826*roll_dev.rolling(window=self.window_size).median()
-            
-            # 3. Identify outliers using MAD
-            outlier_indices                = np.abs(data_filled.quotePrice - data_filled.roll_median) >= self.z_score_cutoff*data_filled['median_abs_dev']
-
-            # impute
-            #data_filled['quotePrice']      = np.where(outlier_indices.values == 0,  data_filled['quotePrice'].values,data_filled['roll_median'].values)
-
-            # drop
-            data_filled = data_filled[~outlier_indices]
-            return data_filled
+    def clean_data_for_garch(self,data_in):
+            return clean_data_for_garch(data_in,self.z_score_cutoff,self.window_size)
         
     def generate_model_forecast(self,timepoint):
         
@@ -74,74 +91,97 @@ class AutoRegressiveStrategy:
             current_data['price_return']   = current_data['quotePrice'].pct_change()
             current_data         = current_data.dropna(axis=0,subset=['price_return'])
             
-            ar_model             = arch.univariate.ARX(current_data.price_return[(current_data.index >= (timepoint - pd.Timedelta(str(self.days_ar_model)+' days')))].to_numpy(), lags=1,rescale=True)
-            ar_model.volatility  = arch.univariate.GARCH(p=1,q=1)
+            model_returns        = current_data.price_return[(current_data.index >= (timepoint - pd.Timedelta(str(self.days_ar_model)+' days')))].to_numpy()
             
-            res                  = ar_model.fit(update_freq=0, disp="off")
-            scale                = res.scale
-
-            forecasts            = res.forecast(horizon=1, reindex=False)
+            if self.garch_estimator == 'internal':
+                forecast         = ARGarchModel.forecast_ar_garch(model_returns)
+            else:
+                forecast         = ARGarchModel.forecast_with_arch(model_returns)
 
-            return_forecast      = forecasts.mean.to_numpy()[0][-1] / scale
-            sd_forecast          = (forecasts.variance.to_numpy()[0][-1] / np.power(res.scale,2))**0.5 * self.annualization_factor
+            return_forecast      = forecast['return_forecast']
+            sd_forecast          = forecast['sd_forecast'] * self.annualization_factor
             
             result_dict          = {'return_forecast': return_forecast,
                                     'sd_forecast'    : sd_forecast}            
             return result_dict
 
         
-    def check_compound_possible(self,current_strat_obs):
-        baseLower  = current_strat_obs.liquidity_ranges[0]['lower_bin_tick']
-        baseUpper  = current_strat_obs.liquidity_ranges[0]['upper_bin_tick']
-        limitLower = current_strat_obs.liquidity_ranges[1]['lower_bin_tick']
-        limitUpper = current_strat_obs.liquidity_ranges[1]['upper_bin_tick']
-        
-        base_assets_token_1  = current_strat_obs.liquidity_ranges[0]['token_0'] * current_strat_obs.price + current_strat_obs.liquidity_ranges[0]['token_1']
-        limit_assets_token_1 = current_strat_obs.liquidity_ranges[0]['token_0'] * current_strat_obs.price + current_strat_obs.liquidity_ranges[0]['token_1']
-        
+    def place_unused_tokens(self,current_strat_obs):
+        """
+        Amounts of the unused tokens (left over and uncollected fees) that can be added to each range at the current price:
+        as many as possible to the first (base) range, and what remains single sided, in the token of highest value, to each
+        following (limit) range in turn. Returns two lists with the token 0 and token 1 placed in each range.
+        """
         unused_token_0  = current_strat_obs.token_0_left_over + current_strat_obs.token_0_fees_uncollected
         unused_token_1  = current_strat_obs.token_1_left_over + current_strat_obs.token_1_fees_uncollected
-        #####################################
-        # Add all possible assets to base
-        #####################################
-        liquidity_placed_base   = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick_current,baseLower,baseUpper,unused_token_0, \
-                                                                       unused_token_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
+        amounts_0       = []
+        amounts_1       = []
+        
+        for i in range(len(current_strat_obs.liquidity_ranges)):
+            lower_tick      = current_strat_obs.liquidity_ranges[i]['lower_bin_tick']
+            upper_tick      = current_strat_obs.liquidity_ranges[i]['upper_bin_tick']
+            amount_0        = unused_token_0
+            amount_1        = unused_token_1
+            
+            if i > 0:
+                # Place single sided highest value
+                if amount_0*current_strat_obs.price > amount_1:
+                    amount_1 = 0.0
+                else:
+                    amount_0 = 0.0
+            
+            liquidity_placed          = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick_current,lower_tick,upper_tick,amount_0, \
+                                                                       amount_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
+            amount_0_placed,amount_1_placed = UNI_v3_funcs.get_amounts(current_strat_obs.price_tick_current,lower_tick,upper_tick,liquidity_placed,\
+                                                                       current_strat_obs.decimals_0,current_strat_obs.decimals_1)
+            amounts_0.append(amount_0_placed)
+            amounts_1.append(amount_1_placed)
+            unused_token_0 -= amount_0_placed
+            unused_token_1 -= amount_1_placed
         
-        base_amount_0_placed,base_amount_1_placed   = UNI_v3_funcs.get_amounts(current_strat_obs.price_tick_current,baseLower,baseUpper,liquidity_placed_base\
-                                                                 ,current_strat_obs.decimals_0,current_strat_obs.decimals_1)
+        return amounts_0,amounts_1
         
-
-        #####################################
-        # Add remaining assets to limit
-        #####################################
+    def check_compound_possible(self,current_strat_obs):
         
-        limit_amount_0 = unused_token_0 - base_amount_0_placed
-        limit_amount_1 = unused_token_1 - base_amount_1_placed
+        # The base range's assets are counted for every range
+        base_assets_token_1                = current_strat_obs.liquidity_ranges[0]['token_0'] * current_strat_obs.price + current_strat_obs.liquidity_ranges[0]['token_1']
+        assets_token_1                     = len(current_strat_obs.liquidity_ranges) * base_assets_token_1
+        amounts_0,amounts_1                = self.place_unused_tokens(current_strat_obs)
+        assets_after_compound_token_1      = sum(amounts_0[i] * current_strat_obs.price + amounts_1[i] for i in range(len(amounts_0))) + assets_token_1
         
-        token_0_limit  = limit_amount_0*current_strat_obs.price > limit_amount_1
-        # Place single sided highest value
-        if token_0_limit:        
-            # Place Token 0
-            limit_amount_1 = 0.0
-        else:
-            # Place Token 1
-            limit_amount_0 = 0.0
-
-        liquidity_placed_limit                      = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick_current,limitLower,limitUpper, \
-                                                                       limit_amount_0,limit_amount_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
-        limit_amount_0_placed,limit_amount_1_placed =     UNI_v3_funcs.get_amounts(current_strat_obs.price_tick_current,limitLower,limitUpper,\
-                                                                     liquidity_placed_limit,current_strat_obs.decimals_0,current_strat_obs.decimals_1)  
-                                                                     
-        
-        base_assets_after_compound_token_1  = base_amount_0_placed  * current_strat_obs.price + base_amount_1_placed + base_assets_token_1                            
-        limit_assets_after_compound_token_1 = limit_amount_0_placed * current_strat_obs.price + limit_amount_1_placed + limit_assets_token_1                           
-
         # if assets changed more than 1%
-        if ((base_assets_after_compound_token_1+limit_assets_after_compound_token_1)/(base_assets_token_1 + limit_assets_token_1) - 1) > .01:
+        if (assets_after_compound_token_1/assets_token_1 - 1) > .01:
             return True
         else:
             return False     
         
+    #####################################
+    # Triggers of check_strategy for StrategyRules.simulate_rules, evaluated over blocks of observations
+    #####################################
+
+    def triggers(self):
+        return {'exited_range':         self.exited_range,
+                'vol_check':            self.vol_check,
+                'initial_reset':        self.initial_reset,
+                'tokens_outside_large': self.tokens_outside_large}
+
+    def exited_range(self,block):
+        return (block.price < block.strategy_info['reset_range_lower']) | (block.price > block.strategy_info['reset_range_upper'])
+
+    def vol_check(self,block):
+        # The model forecast is checked every 60 minutes, from the first observation after the position is set
+        if not 'last_vol_check' in block.strategy_info:
+            return block.constant(True)
+        return (block.time - block.strategy_info['last_vol_check']) >= pd.Timedelta(60,'min')
+
+    def initial_reset(self,block):
+        return block.constant(block.strategy_info.get('force_initial_reset',False))
+
+    def tokens_outside_large(self,block):
+        left_over_balance = (block.token_0_left_over + block.token_0_fees_uncollected) * block.price \
+                            + (block.token_1_left_over + block.token_1_fees_uncollected)
+        return block.greater(left_over_balance,self.tokens_outside_reset * (block.range_value_in_token_1(1) + block.range_value_in_token_1(0)))
+
     #####################################
     # Check if a rebalance is necessary. 
     # If it is, remove the liquidity and set new ranges
@@ -459,58 +499,25 @@ class AutoRegressiveStrategy:
     
     def compound(self,current_strat_obs):
         
-        unused_token_0 = current_strat_obs.token_0_left_over + current_strat_obs.token_0_fees_uncollected
-        unused_token_1 = current_strat_obs.token_1_left_over + current_strat_obs.token_1_fees_uncollected
-        
-        baseLower  = current_strat_obs.liquidity_ranges[0]['lower_bin_tick']
-        baseUpper  = current_strat_obs.liquidity_ranges[0]['upper_bin_tick']
-        limitLower = current_strat_obs.liquidity_ranges[1]['lower_bin_tick']
-        limitUpper = current_strat_obs.liquidity_ranges[1]['upper_bin_tick']
-        
-        #####################################
-        # Add all possible assets to base
-        #####################################
-        liquidity_placed_base   = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick_current,baseLower,baseUpper,unused_token_0, \
-                                                                       unused_token_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
-        
-        base_amount_0_placed,base_amount_1_placed   = UNI_v3_funcs.get_amounts(current_strat_obs.price_tick_current,baseLower,baseUpper,liquidity_placed_base\
-                                                                 ,current_strat_obs.decimals_0,current_strat_obs.decimals_1)
+        amounts_0,amounts_1 = self.place_unused_tokens(current_strat_obs)
         
+        for i in range(len(current_strat_obs.liquidity_ranges)):
+            current_strat_obs.liquidity_ranges[i]['token_0'] += amounts_0[i]
+            current_strat_obs.liquidity_ranges[i]['token_1'] += amounts_1[i]
         
-        current_strat_obs.liquidity_ranges[0]['token_0'] += base_amount_0_placed
-        current_strat_obs.liquidity_ranges[0]['token_1'] += base_amount_1_placed 
-
-        #####################################
-        # Add remaining assets to limit
-        #####################################
-        
-        limit_amount_0 = unused_token_0 - base_amount_0_placed
-        limit_amount_1 = unused_token_1 - base_amount_1_placed
-        
-        token_0_limit  = limit_amount_0*current_strat_obs.price > limit_amount_1
-        # Place single sided highest value
-        if token_0_limit:        
-            # Place Token 0
-            limit_amount_1 = 0.0
-        else:
-            # Place Token 1
-            limit_amount_0 = 0.0
-
-        liquidity_placed_limit                      = int(UNI_v3_funcs.get_liquidity(current_strat_obs.price_tick_current,limitLower,limitUpper, \
-                                                                       limit_amount_0,limit_amount_1,current_strat_obs.decimals_0,current_strat_obs.decimals_1))
-        limit_amount_0_placed,limit_amount_1_placed =     UNI_v3_funcs.get_amounts(current_strat_obs.price_tick_current,limitLower,limitUpper,\
-                                                                     liquidity_placed_limit,current_strat_obs.decimals_0,current_strat_obs.decimals_1)  
-        
-        current_strat_obs.liquidity_ranges[1]['token_0'] += limit_amount_0_placed
-        current_strat_obs.liquidity_ranges[1]['token_1'] += limit_amount_1_placed
+        unused_token_0 = current_strat_obs.token_0_left_over + current_strat_obs.token_0_fees_uncollected
+        unused_token_1 = current_strat_obs.token_1_left_over + current_strat_obs.token_1_fees_uncollected
+        for i in range(len(amounts_0)):
+            unused_token_0 -= amounts_0[i]
+            unused_token_1 -= amounts_1[i]
         
         # Clean up prior accrued fees and tokens outside        
         current_strat_obs.token_0_fees_uncollected  = 0.0
         current_strat_obs.token_1_fees_uncollected  = 0.0
         
         # Due to price and asset deposit ratio sometimes can't deposit 100% of assets
-        current_strat_obs.token_0_left_over         = max([0.0,unused_token_0 - base_amount_0_placed - limit_amount_0_placed])
-        current_strat_obs.token_1_left_over         = max([0.0,unused_token_1 - base_amount_1_placed - limit_amount_1_placed])
+        current_strat_obs.token_0_left_over         = max([0.0,unused_token_0])
+        current_strat_obs.token_1_left_over         = max([0.0,unused_token_1])
         
     
     ########################################################
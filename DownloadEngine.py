@@ -0,0 +1,398 @@
+import requests
+import pandas as pd
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+##############################################################
+# Concurrent download engine for GetPoolData
+# A date range is split into time shards which are paginated independently and fetched concurrently
+# over a shared requests.Session (pooled keep-alive connections). Results are merged back in shard order
+# without duplicates, so shards that overlap at their boundaries are harmless.
+# Every request goes through a RequestClient: a token bucket per endpoint that adapts its rate to the
+# provider (halved when throttled, raised slowly while requests succeed but kept below the throttled rate), jittered
+# exponential backoff on 429/5xx/non-JSON bodies/timeouts and GraphQL errors, and per endpoint throughput metrics (see throughput_report).
+# Block ranges (JSON-RPC log scans) are split into fixed size shards, and a shard the node refuses as too large
+# is split again in halves (fetch_adaptive_range).
+##############################################################
+
+MAX_WORKERS         = 4
+MAX_RATE            = 10.0   # requests per second per endpoint
+LIMITED_RATE        = 0.2    # starting rate when downloads are rate limited (one request every 5 seconds)
+MIN_RATE            = 0.05
+RATE_INCREASE       = 0.05   # requests per second added after each successful request
+RECOVERY_CAP        = 0.8    # after a throttle the rate only recovers up to this fraction of the rate that was throttled
+MAX_RETRIES         = 6
+MAX_GRAPHQL_RETRIES = 2
+BACKOFF_BASE        = 1.0    # seconds
+BACKOFF_MAX         = 60.0
+TIMEOUT             = 60.0
+RETRY_STATUS        = (429,500,502,503,504)
+
+
+class GraphQLError(Exception):
+    """
+    The response had an errors payload instead of data.
+    """
+    def __init__(self,errors):
+        self.errors = errors
+        super().__init__('; '.join(str(x.get('message',x)) if isinstance(x,dict) else str(x) for x in errors))
+
+
+class JSONRPCError(Exception):
+    """
+    A JSON-RPC node answered with an error object instead of a result.
+    """
+    def __init__(self,error):
+        error        = error if isinstance(error,dict) else {'message':str(error)}
+        self.code    = error.get('code')
+        self.message = str(error.get('message',''))
+        self.data    = error.get('data')
+        super().__init__(str(self.code)+': '+self.message)
+
+
+class RequestFailed(Exception):
+    """
+    A request failed with a non retryable status code, or kept failing after all retries.
+    """
+    def __init__(self,message,status_code=None):
+        self.status_code = status_code
+        super().__init__(message)
+
+
+class PaginationError(Exception):
+    """
+    A page kept failing. cursor is the last good cursor (id or offset) to resume from and rows the rows collected before it.
+    """
+    def __init__(self,cursor,rows,cause):
+        self.cursor = cursor
+        self.rows   = rows
+        super().__init__('Pagination stopped at cursor '+repr(cursor)+': '+str(cause))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket whose refill rate adapts additively up (on_success) and multiplicatively down (on_throttle).
+    Each throttle also caps max_rate below the rate that was throttled, so the rate settles under the provider's limit
+    instead of climbing back into it.
+    """
+    def __init__(self,rate,max_rate=None,capacity=None):
+
+        self.rate      = float(rate)
+        self.max_rate  = float(rate if max_rate is None else max_rate)
+        self.capacity  = max(1.0,self.rate) if capacity is None else float(capacity)
+        self.tokens    = self.capacity
+        self.updated   = time.monotonic()
+        self.lock      = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, blocking until it is available. Returns the time waited in seconds.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now          = time.monotonic()
+                self.tokens  = min(self.capacity,self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate,self.rate + RATE_INCREASE)
+
+    def on_throttle(self):
+        with self.lock:
+            self.max_rate = max(MIN_RATE,min(self.max_rate,self.rate * RECOVERY_CAP))
+            self.rate     = max(MIN_RATE,self.rate / 2)
+            self.tokens   = min(self.tokens,0.0)
+
+
+class EndpointMetrics:
+    """
+    Thread-safe counters of the requests made to one endpoint.
+    """
+    def __init__(self):
+
+        self.lock       = threading.Lock()
+        self.started    = time.monotonic()
+        self.requests   = 0
+        self.successes  = 0
+        self.retries    = 0
+        self.throttled  = 0
+        self.failures   = 0
+        self.bytes      = 0
+        self.latency    = 0.0
+        self.wait_time  = 0.0
+
+    def record(self,**counts):
+        with self.lock:
+            for name,value in counts.items():
+                setattr(self,name,getattr(self,name) + value)
+
+    def summary(self,rate=None):
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started,1e-9)
+            return {'requests':          self.requests,
+                    'successes':         self.successes,
+                    'retries':           self.retries,
+                    'throttled':         self.throttled,
+                    'failures':          self.failures,
+                    'requests_per_second': self.successes / elapsed,
+                    'mb_per_second':     self.bytes / elapsed / 1e6,
+                    'mean_latency':      self.latency / max(self.requests,1),
+                    'wait_time':         self.wait_time,
+                    'current_rate':      rate}
+
+
+# Limiter and metrics per endpoint url, shared by every client so concurrent downloads share the provider's budget
+ENDPOINTS      = {}
+ENDPOINTS_LOCK = threading.Lock()
+
+
+def get_endpoint(url,rate=MAX_RATE,max_rate=MAX_RATE):
+    """
+    Returns the (TokenBucket,EndpointMetrics) of an endpoint, creating them on first use.
+    An existing endpoint keeps the rate it adapted to, unless rate asks for a slower one.
+    """
+    with ENDPOINTS_LOCK:
+        if url not in ENDPOINTS:
+            ENDPOINTS[url] = (TokenBucket(rate,max_rate),EndpointMetrics())
+        elif rate < ENDPOINTS[url][0].rate:
+            ENDPOINTS[url][0].rate = float(rate)
+        return ENDPOINTS[url]
+
+
+def throughput_report():
+    """
+    DataFrame with the throughput metrics of every endpoint used so far.
+    """
+    return pd.DataFrame({url:metrics.summary(limiter.rate) for url,(limiter,metrics) in ENDPOINTS.items()}).T
+
+
+def backoff_delay(attempt,base=BACKOFF_BASE,maximum=BACKOFF_MAX):
+    """
+    Full-jitter exponential backoff: uniform between 0 and base * 2**attempt (capped at maximum).
+    """
+    return random.uniform(0,min(maximum,base * 2**attempt))
+
+
+def make_session(max_workers=MAX_WORKERS):
+    """
+    requests.Session whose connection pool can keep one connection alive per worker.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers,pool_maxsize=max_workers)
+    session.mount('https://',adapter)
+    session.mount('http://',adapter)
+    return session
+
+
+class RequestClient:
+    """
+    Shared request layer for the downloads: pooled connections, per endpoint rate limiting, retries and metrics.
+    rate is the starting rate (requests per second) of the endpoints used by this client.
+    """
+    def __init__(self,max_workers=MAX_WORKERS,rate=MAX_RATE,max_retries=MAX_RETRIES,timeout=TIMEOUT):
+
+        self.session     = make_session(max_workers)
+        self.rate        = rate
+        self.max_retries = max_retries
+        self.timeout     = timeout
+
+    def post_json(self,url,payload,headers=None):
+        """
+        POSTs a GraphQL (or JSON-RPC) payload and returns the decoded response.
+        Throttling (429), server errors (5xx), bodies that are not JSON, timeouts and connection errors are retried with jittered
+        exponential backoff (honouring Retry-After), GraphQL errors payloads up to MAX_GRAPHQL_RETRIES times. Raises RequestFailed or GraphQLError.
+        """
+        limiter,metrics = get_endpoint(url,self.rate)
+        graphql_errors  = 0
+
+        for attempt in range(self.max_retries + 1):
+            metrics.record(wait_time=limiter.acquire(),requests=1)
+            delay = None
+            start = time.monotonic()
+            try:
+                response = self.session.post(url,json=payload,headers=headers,timeout=self.timeout)
+            except (requests.Timeout,requests.ConnectionError) as error:
+                metrics.record(latency=time.monotonic() - start)
+                failure = error
+            else:
+                metrics.record(latency=time.monotonic() - start,bytes=len(response.content))
+                if response.status_code == 200:
+                    try:
+                        result = response.json()
+                    except ValueError:
+                        # Gateways and proxies sometimes answer 200 with an html error page
+                        failure = RequestFailed('Response from '+url+' is not JSON',response.status_code)
+                    else:
+                        if isinstance(result,dict) and result.get('errors'):
+                            failure         = GraphQLError(result['errors'])
+                            graphql_errors += 1
+                            if graphql_errors > MAX_GRAPHQL_RETRIES:
+                                metrics.record(failures=1)
+                                raise failure
+                        else:
+                            limiter.on_success()
+                            metrics.record(successes=1)
+                            return result
+                elif response.status_code in RETRY_STATUS:
+                    failure = RequestFailed('HTTP '+str(response.status_code)+' from '+url,response.status_code)
+                    if response.status_code == 429:
+                        limiter.on_throttle()
+                        metrics.record(throttled=1)
+                        retry_after = response.headers.get('Retry-After')
+                        if retry_after is not None and retry_after.replace('.','',1).isdigit():
+                            delay = min(BACKOFF_MAX,float(retry_after))
+                else:
+                    metrics.record(failures=1)
+                    raise RequestFailed('Query failed and return code is {}.      {}'.format(response.status_code,payload),response.status_code)
+
+            if attempt < self.max_retries:
+                metrics.record(retries=1)
+                time.sleep(backoff_delay(attempt) if delay is None else delay)
+
+        metrics.record(failures=1)
+        if isinstance(failure,GraphQLError):
+            raise failure
+        raise RequestFailed('Giving up on '+url+' after '+str(self.max_retries)+' retries: '+str(failure),getattr(failure,'status_code',None))
+
+
+def time_shards(timestamp_begin,timestamp_end,n_shards):
+    """
+    Splits the unix timestamps [timestamp_begin,timestamp_end] (both inclusive) into at most n_shards
+    contiguous, non-overlapping (begin,end) pairs, also inclusive.
+    """
+    timestamp_begin = int(timestamp_begin)
+    timestamp_end   = int(timestamp_end)
+    n_seconds       = timestamp_end - timestamp_begin + 1
+    if n_seconds <= 0:
+        return []
+    edges = [timestamp_begin + n_seconds*i//n_shards for i in range(n_shards+1)]
+    return [(edges[i],edges[i+1]-1) for i in range(n_shards) if edges[i+1] > edges[i]]
+
+
+def date_shards(date_begin,date_end,n_shards):
+    """
+    Splits the days between date_begin and date_end (both inclusive, 'YYYY-MM-DD') into at most n_shards
+    contiguous, non-overlapping ('YYYY-MM-DD','YYYY-MM-DD') ranges. A single shard keeps the dates as given.
+    """
+    if n_shards <= 1:
+        return [(date_begin,date_end)]
+    days   = pd.date_range(pd.Timestamp(date_begin).normalize(),pd.Timestamp(date_end).normalize(),freq='D')
+    edges  = [len(days)*i//n_shards for i in range(n_shards+1)]
+    return [(days[edges[i]].strftime('%Y-%m-%d'),days[edges[i+1]-1].strftime('%Y-%m-%d'))
+            for i in range(n_shards) if edges[i+1] > edges[i]]
+
+
+def block_shards(block_begin,block_end,block_step):
+    """
+    Splits the blocks [block_begin,block_end] (both inclusive) into contiguous (begin,end) ranges of at most block_step blocks.
+    """
+    block_end = int(block_end)
+    return [(begin,min(begin+int(block_step)-1,block_end)) for begin in range(int(block_begin),block_end+1,int(block_step))]
+
+
+def fetch_adaptive_range(fetch_range,block_begin,block_end,too_large):
+    """
+    Collects fetch_range(begin,end) over the blocks [block_begin,block_end]. When the provider refuses a range
+    (too_large(error) is True, eg. too many results), the range is split in two halves fetched in turn, down to single blocks.
+    Returns the rows in block order.
+    """
+    rows    = []
+    pending = [(int(block_begin),int(block_end))]
+    while pending:
+        begin,end = pending.pop()
+        try:
+            rows.extend(fetch_range(begin,end))
+        except Exception as error:
+            if begin == end or not too_large(error):
+                raise
+            middle = (begin + end) // 2
+            # Last in, first out: the lower half is fetched first
+            pending.extend([(middle+1,end),(begin,middle)])
+    return rows
+
+
+def paginate_by_id(run_page,start_id=''):
+    """
+    Collects all rows of a subgraph query paginated with id_gt: run_page(paginate_id) returns the next page,
+    which is ordered by id. Starts from the empty id so the first row is included.
+    If a page fails, raises PaginationError with the last good id so the download can resume from it.
+    """
+    rows       = []
+    current_id = start_id
+    while True:
+        try:
+            response = run_page(current_id)
+        except (RequestFailed,GraphQLError) as error:
+            raise PaginationError(current_id,rows,error) from error
+        if len(response) == 0:
+            return rows
+        rows.extend(response)
+        current_id = response[-1]['id']
+
+
+def paginate_by_offset(run_page,page_size,start_offset=0):
+    """
+    Collects all rows of a query paginated with limit/offset: run_page(offset) returns the next page.
+    A page with less than page_size rows is the last one.
+    If a page fails, raises PaginationError with the offset to resume from.
+    """
+    rows   = []
+    offset = start_offset
+    while True:
+        try:
+            response = run_page(offset)
+        except (RequestFailed,GraphQLError) as error:
+            raise PaginationError(offset,rows,error) from error
+        rows.extend(response)
+        if len(response) < page_size:
+            return rows
+        offset += page_size
+
+
+def fetch_shards(fetch_shard,shards,max_workers=MAX_WORKERS):
+    """
+    Runs fetch_shard(shard) for every shard with at most max_workers concurrent requests.
+    Returns the list of results in shard order.
+    """
+    if max_workers <= 1 or len(shards) <= 1:
+        return [fetch_shard(shard) for shard in shards]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch_shard,shards))
+
+
+def merge_shards(shard_rows,key):
+    """
+    Concatenates the rows of each shard in order, keeping the first row for each key(row).
+    """
+    merged = []
+    seen   = set()
+    for rows in shard_rows:
+        for row in rows:
+            row_key = key(row)
+            if row_key not in seen:
+                seen.add(row_key)
+                merged.append(row)
+    return merged
+
+
+DEFAULT_CLIENT = None
+
+
+def default_client():
+    """
+    Client used by the query functions when none is given.
+    """
+    global DEFAULT_CLIENT
+    if DEFAULT_CLIENT is None:
+        DEFAULT_CLIENT = RequestClient()
+    return DEFAULT_CLIENT
@@ -1,12 +1,14 @@
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 import requests
-import pickle
+import PoolDataStore
+import DownloadEngine
+import QueryCache
 import importlib
-from itertools import compress
-import time
 import os
 import math
+import binascii
 
 ##############################################################
 # Pull Uniswap v3 pool data from Google Bigquery
@@ -69,15 +71,17 @@ def download_bigquery_price_polygon(contract_address,date_begin,date_end,block_s
     query_job       = client.query(query)  # Make an API request.
     
     result = query_job.to_dataframe(create_bqstorage_client=False)
-    result['amount0']      = result['amount0'].apply(signed_int)
-    result['amount1']      = result['amount1'].apply(signed_int)
-    result['sqrtPriceX96'] = result['sqrtPriceX96'].apply(signed_int)
-    result['liquidity']    = result['liquidity'].apply(signed_int)
-    result['tick']         = result['tick'].apply(signed_int)
+    # amounts are int256 and may not fit in int64, sqrtPriceX96 and liquidity are kept exact
+    result['amount0']      = decode_hex_words(result['amount0'],'float64')
+    result['amount1']      = decode_hex_words(result['amount1'],'float64')
+    result['sqrtPriceX96'] = decode_hex_words(result['sqrtPriceX96'],'object')
+    result['liquidity']    = decode_hex_words(result['liquidity'],'object')
+    result['tick']         = decode_hex_words(result['tick'],'int64')
 
 
     return result
 
+@QueryCache.cached_query('bigquery',['contract_address','network','date_begin','date_end','block_start','decimals_0','decimals_1'],'date_end')
 def get_pool_data_bigquery(contract_address,date_begin,date_end,decimals_0,decimals_1,network='mainnet',block_start=0,credentials = None):
     
     """
@@ -92,24 +96,87 @@ def get_pool_data_bigquery(contract_address,date_begin,date_end,decimals_0,decim
     else:
         raise ValueError('Unsupported Network:'+network)
     
+    resulting_data                          = preprocess_bigquery_swaps(resulting_data,decimals_0,decimals_1)
+    resulting_data                          = resulting_data.set_index('block_date',drop=False).sort_index()
+
+    return resulting_data
+
+def preprocess_bigquery_swaps(resulting_data,decimals_0,decimals_1):
+    """
+    Internal function that adds the decimal adjusted amounts, liquidity and price used by the simulations to BigQuery swaps.
+    """
     DECIMAL_ADJ                             = 10**(decimals_1  - decimals_0)
     resulting_data['sqrtPriceX96_float']    = resulting_data['sqrtPriceX96'].astype(float)
     resulting_data['quotePrice']            = (((resulting_data['sqrtPriceX96_float'] / 2**96) **2) / DECIMAL_ADJ).astype(float)
     resulting_data['block_date']            = pd.to_datetime(resulting_data['block_timestamp'])
-    resulting_data                          = resulting_data.set_index('block_date',drop=False).sort_index()
 
-    resulting_data['tick_swap']             = resulting_data['tick'].astype(int)
+    resulting_data['tick_swap']             = resulting_data['tick'].astype('int32')
     resulting_data['amount0']               = resulting_data['amount0'].astype(float)
     resulting_data['amount1']               = resulting_data['amount1'].astype(float)
-    resulting_data['amount0_adj']           = resulting_data['amount0'].astype(float) / 10**decimals_0
-    resulting_data['amount1_adj']           = resulting_data['amount1'].astype(float) / 10**decimals_1
+    resulting_data['amount0_adj']           = resulting_data['amount0'] / 10**decimals_0
+    resulting_data['amount1_adj']           = resulting_data['amount1'] / 10**decimals_1
     resulting_data['virtual_liquidity']     = resulting_data['liquidity'].astype(float)
-    resulting_data['virtual_liquidity_adj'] = resulting_data['liquidity'].astype(float) / (10**((decimals_0  + decimals_1)/2))
-    resulting_data['token_in']              = resulting_data.apply(lambda x: 'token0' if (x['amount0_adj'] < 0) else 'token1',axis=1)
-    resulting_data['traded_in']             = resulting_data.apply(lambda x: -x['amount0_adj'] if (x['amount0_adj'] < 0) else -x['amount1_adj'],axis=1).astype(float)
+    resulting_data['virtual_liquidity_adj'] = resulting_data['virtual_liquidity'] / (10**((decimals_0  + decimals_1)/2))
+    # token with negative amounts is the token being swapped in
+    token_0_in                              = (resulting_data['amount0_adj'] < 0).to_numpy()
+    resulting_data['token_in']              = token_in_column(token_0_in)
+    resulting_data['traded_in']             = -np.where(token_0_in,resulting_data['amount0_adj'],resulting_data['amount1_adj'])
 
     return resulting_data
 
+# Columns of blockchain-etl's swap events needed by the simulations (plus block and log index to order them)
+BIGQUERY_SWAP_COLUMNS = ['block_timestamp','block_number','log_index','amount0','amount1','sqrtPriceX96','liquidity','tick']
+BIGQUERY_PAGE_SIZE    = 100000
+BIGQUERY_NETWORKS     = {'mainnet':'ethereum','polygon':'polygon'}
+
+def stream_pool_data_bigquery(contract_address,date_begin,date_end,decimals_0,decimals_1,file_name,network='mainnet',block_start=0,credentials=None,page_size=BIGQUERY_PAGE_SIZE,client=None):
+    """
+    Streams the swap history of a Uniswap v3 pool from Google Bigquery into the local data store (table 'swap_bigquery' under file_name)
+    with bounded memory: only the needed columns are queried, and the results are read page_size rows at a time,
+    preprocessed like get_pool_data_bigquery and appended to the store, so no more than one page is held in memory.
+    The stored swaps between date_begin and date_end are replaced. client defaults to a bigquery.Client, any object with the same
+    query(...).result(page_size=...).to_dataframe_iterable() interface can be used instead.
+    Returns the number of swaps stored; read them with PoolDataStore.read_table('swap_bigquery',file_name,date_begin,date_end).
+    """
+    if network not in BIGQUERY_NETWORKS:
+        raise ValueError('Unsupported Network:'+network)
+
+    if client is None:
+        from google.cloud import bigquery
+        client = bigquery.Client() if credentials is None else bigquery.Client(credentials=credentials)
+
+    query = """
+            SELECT """+', '.join(BIGQUERY_SWAP_COLUMNS)+"""
+            FROM blockchain-etl."""+BIGQUERY_NETWORKS[network]+"""_uniswap.UniswapV3Pool_event_Swap
+            where contract_address = lower('"""+contract_address.lower()+"""') and
+              block_timestamp >= '"""+str(date_begin)+"""' and block_timestamp <= '"""+str(date_end)+"""' and block_number >= """+str(block_start)+"""
+            order by block_number, log_index
+            """
+
+    # BigQuery compares the dates as timestamps (a bare date is midnight), so only the stored swaps in that exact range are replaced
+    PoolDataStore.delete_dates('swap_bigquery',file_name,pd.Timestamp(date_begin),pd.Timestamp(date_end))
+    n_rows = 0
+    for chunk in client.query(query).result(page_size=page_size).to_dataframe_iterable():
+        if len(chunk) == 0:
+            continue
+        chunk            = preprocess_bigquery_swaps(chunk,decimals_0,decimals_1)
+        chunk['time_pd'] = pd.to_datetime(chunk['block_timestamp'],utc=True)
+        # Raw sqrtPriceX96 and liquidity are kept as strings, with full precision
+        chunk            = chunk.astype({'sqrtPriceX96':str,'liquidity':str}).drop(columns=['block_timestamp','block_date','tick'])
+        PoolDataStore.write_table(chunk,'swap_bigquery',file_name,mode='append')
+        n_rows          += len(chunk)
+
+    return n_rows
+
+# token_in is stored as a categorical with these two values, so comparisons with 'token0' keep working
+TOKEN_IN_DTYPE = pd.CategoricalDtype(['token0','token1'])
+
+def token_in_column(token_0_in):
+    """
+    Internal function that builds the token_in column ('token0' where token_0_in is True, else 'token1') without a per row apply.
+    """
+    return pd.Categorical.from_codes(np.where(token_0_in,0,1),dtype=TOKEN_IN_DTYPE)
+
 def signed_int(h):
     """
     Converts hex values to signed integers.
@@ -118,89 +185,413 @@ def signed_int(h):
     i = int.from_bytes(s, 'big', signed=True)
     return i
 
+HEX_WORD_BYTES = 32
+
+def hex_words_to_bytes(values):
+    """
+    Internal function that parses a column of '0x' prefixed 32-byte hex words into an (n,32) uint8 array in bulk.
+    """
+    n_chars = 2 + 2*HEX_WORD_BYTES
+    # One spare character to detect words that are too long
+    chars   = np.asarray(values,dtype='S'+str(n_chars+1)).reshape(-1).view(np.uint8).reshape(-1,n_chars+1)
+    if not (np.all(chars[:,0] == ord('0')) and np.all(chars[:,1] == ord('x')) and np.all(chars[:,n_chars-1] != 0) and np.all(chars[:,n_chars] == 0)):
+        raise ValueError('Expected 0x prefixed 32-byte hex words')
+    # Digits must be contiguous before converting them all at once (binascii.Error, a ValueError, on non hex characters)
+    digits  = np.ascontiguousarray(chars[:,2:n_chars])
+    return np.frombuffer(binascii.unhexlify(digits.tobytes()),dtype=np.uint8).reshape(len(chars),HEX_WORD_BYTES)
+
+def decode_hex_words(values,dtype='int64',signed=True):
+    """
+    Decodes a whole column of 32-byte (two's complement if signed) hex words, as in the data field of event logs, in one pass.
+    dtype is 'int64' (raises OverflowError if a value does not fit), 'float64' (nearest double)
+    or 'object' (exact Python ints, for values such as sqrtPriceX96 and liquidity).
+    """
+    words = hex_words_to_bytes(values)
+
+    if dtype == 'object':
+        buffer = words.tobytes()
+        return np.array([int.from_bytes(buffer[i:i+HEX_WORD_BYTES],'big',signed=signed) for i in range(0,len(buffer),HEX_WORD_BYTES)],dtype=object)
+
+    # Four 64 bit limbs per word, most significant first
+    limbs    = words.view('>u8').astype(np.uint64)
+    negative = (limbs[:,0] >> np.uint64(63) == 1) if signed else np.zeros(len(limbs),dtype=bool)
+
+    if dtype == 'int64':
+        extension = np.where(negative,np.uint64(0xFFFFFFFFFFFFFFFF),np.uint64(0))
+        fits      = (limbs[:,:3] == extension[:,None]).all(axis=1) & ((limbs[:,3] >> np.uint64(63) == 1) == negative)
+        if not fits.all():
+            raise OverflowError('Hex word does not fit in int64')
+        return np.ascontiguousarray(limbs[:,3]).view(np.int64)
+    elif dtype == 'float64':
+        # Magnitude of negative values: invert and add one, propagating the carry from the least significant limb
+        magnitude = np.where(negative[:,None],~limbs,limbs)
+        carry     = negative.astype(np.uint64)
+        for j in range(3,-1,-1):
+            magnitude[:,j] += carry
+            carry           = carry & (magnitude[:,j] == 0)
+        value = magnitude[:,0].astype(float)
+        for j in range(1,4):
+            value = value * 2.0**64 + magnitude[:,j].astype(float)
+        return np.where(negative,-value,value)
+    else:
+        raise ValueError('Unsupported dtype: '+str(dtype))
+
+##############################################################
+# Get Uniswap v3 events straight from a JSON-RPC node (eth_getLogs)
+##############################################################
+
+# topic0 (keccak of the signature) of the Uniswap v3 pool events
+UNIV3_EVENT_TOPICS = {'Swap': '0xc42079f94a6350d7e6235f29174924f928cc2ac818eb64fed8004e115fbcca67',
+                      'Mint': '0x7a53080ba414158be7ec69b987b5fb7d07dee101fe85488f0853ae16239d0bde',
+                      'Burn': '0x0c396cd989a39f4459b5fa1aed6a9a8dcdbc45908acfd67e028cd568da98982c'}
+# Number of 32-byte words in the (non indexed) data field of each event
+UNIV3_EVENT_WORDS  = {'Swap':5,'Mint':4,'Burn':3}
+RPC_BLOCK_STEP     = 2000   # blocks per eth_getLogs request, before any adaptive split
+RPC_BATCH_SIZE     = 100    # eth_getBlockByNumber calls per batch request
+# Errors with which nodes refuse a log query that is too large (eg. Infura's -32005 'query returned more than 10000 results')
+RPC_TOO_LARGE_CODES    = (-32005,)
+RPC_TOO_LARGE_MESSAGES = ('more than','too large','too many','exceed','limit')
+
+def run_rpc_query(rpc_url,method,params,client=None):
+    """
+    Internal function that calls a JSON-RPC method and returns its result. Raises DownloadEngine.JSONRPCError if the node answers with an error.
+    """
+    response = (DownloadEngine.default_client() if client is None else client).post_json(rpc_url,{'jsonrpc':'2.0','id':1,'method':method,'params':params})
+    if response.get('error') is not None:
+        raise DownloadEngine.JSONRPCError(response['error'])
+    return response['result']
+
+def run_rpc_batch(rpc_url,calls,client=None):
+    """
+    Internal function that sends a list of (method,params) calls as one JSON-RPC batch request and returns their results in order.
+    """
+    payload  = [{'jsonrpc':'2.0','id':i,'method':method,'params':params} for i,(method,params) in enumerate(calls)]
+    response = (DownloadEngine.default_client() if client is None else client).post_json(rpc_url,payload)
+    # A node that rejects the whole batch answers with a single error object
+    if isinstance(response,dict):
+        raise DownloadEngine.JSONRPCError(response.get('error',response))
+    by_id    = {x['id']:x for x in response}
+    for x in by_id.values():
+        if x.get('error') is not None:
+            raise DownloadEngine.JSONRPCError(x['error'])
+    return [by_id[i]['result'] for i in range(len(calls))]
+
+def rpc_response_too_large(error):
+    """
+    Internal function that tells if a node refused a log query because the range returns too many logs.
+    """
+    return isinstance(error,DownloadEngine.JSONRPCError) and (error.code in RPC_TOO_LARGE_CODES or any(x in error.message.lower() for x in RPC_TOO_LARGE_MESSAGES))
+
+def download_rpc_logs(rpc_url,contract_address,event,block_begin,block_end,block_step=RPC_BLOCK_STEP,max_workers=DownloadEngine.MAX_WORKERS,client=None):
+    """
+    Internal function that scans the blocks [block_begin,block_end] for the logs of a Uniswap v3 event ('Swap', 'Mint' or 'Burn') emitted by contract_address.
+    The blocks are split in ranges of block_step blocks fetched concurrently by up to max_workers threads, and a range the node
+    refuses as too large is split in halves. Returns the logs sorted by block and log index.
+    """
+    def fetch_range(begin,end):
+        return run_rpc_query(rpc_url,'eth_getLogs',[{'address':  contract_address.lower(),
+                                                     'topics':   [UNIV3_EVENT_TOPICS[event]],
+                                                     'fromBlock':hex(begin),
+                                                     'toBlock':  hex(end)}],client)
+
+    def fetch_shard(shard):
+        return DownloadEngine.fetch_adaptive_range(fetch_range,shard[0],shard[1],rpc_response_too_large)
+
+    shards = DownloadEngine.block_shards(block_begin,block_end,block_step)
+    logs   = DownloadEngine.merge_shards(DownloadEngine.fetch_shards(fetch_shard,shards,max_workers),key=lambda x: (x['blockHash'],x['logIndex']))
+    # Logs removed by a reorg are dropped
+    logs   = [x for x in logs if not x.get('removed',False)]
+    return sorted(logs,key=lambda x: (int(x['blockNumber'],16),int(x['logIndex'],16)))
+
+def download_rpc_block_timestamps(rpc_url,block_numbers,batch_size=RPC_BATCH_SIZE,max_workers=DownloadEngine.MAX_WORKERS,client=None):
+    """
+    Internal function that returns {block number: unix timestamp} of the blocks, fetched with batched eth_getBlockByNumber calls.
+    """
+    block_numbers = sorted(set(int(x) for x in block_numbers))
+    batches       = [block_numbers[i:i+batch_size] for i in range(0,len(block_numbers),batch_size)]
+
+    def fetch_batch(batch):
+        return run_rpc_batch(rpc_url,[('eth_getBlockByNumber',[hex(x),False]) for x in batch],client)
+
+    blocks = [block for batch in DownloadEngine.fetch_shards(fetch_batch,batches,max_workers) for block in batch]
+    return {number: int(block['timestamp'],16) for number,block in zip(block_numbers,blocks)}
+
+def split_data_words(data,n_words):
+    """
+    Internal function that splits a column of log data fields ('0x' followed by n_words 32-byte words) into an (n,n_words) array
+    of '0x' prefixed words in bulk, ready for decode_hex_words.
+    """
+    n_chars = 2 + 2*HEX_WORD_BYTES*n_words
+    chars   = np.asarray(data,dtype='S'+str(n_chars+1)).reshape(-1).view(np.uint8).reshape(-1,n_chars+1)
+    if len(chars) > 0 and not (np.all(chars[:,n_chars-1] != 0) and np.all(chars[:,n_chars] == 0)):
+        raise ValueError('Expected log data of '+str(n_words)+' 32-byte words')
+    words          = np.empty((len(chars),n_words,2 + 2*HEX_WORD_BYTES),dtype=np.uint8)
+    words[:,:,0]   = ord('0')
+    words[:,:,1]   = ord('x')
+    words[:,:,2:]  = chars[:,2:n_chars].reshape(-1,n_words,2*HEX_WORD_BYTES)
+    return words.reshape(-1).view('S'+str(2 + 2*HEX_WORD_BYTES)).reshape(len(chars),n_words)
+
+def topic_addresses(topics):
+    """
+    Internal function that extracts the addresses from a column of indexed address topics.
+    """
+    return np.array(['0x'+x[-40:] for x in topics],dtype=object)
+
+def decode_rpc_logs(logs,event,block_timestamps=None):
+    """
+    Decodes the raw logs of a Uniswap v3 event in bulk into a DataFrame.
+    Swaps get the columns of blockchain-etl's swap table (as returned by download_bigquery_swap_data, sqrtPriceX96 and liquidity
+    as exact decimal strings), so they can be preprocessed like the BigQuery swaps.
+    Timestamps come from the logs' blockTimestamp field when the node provides it, else from block_timestamps ({block number: unix timestamp}).
+    """
+    n_words = UNIV3_EVENT_WORDS[event]
+    blocks  = np.array([int(x['blockNumber'],16) for x in logs],dtype=np.int64)
+    if all('blockTimestamp' in x for x in logs):
+        timestamps = np.array([int(x['blockTimestamp'],16) for x in logs],dtype=np.int64)
+    else:
+        timestamps = np.array([block_timestamps[x] for x in blocks],dtype=np.int64)
+
+    data    = pd.DataFrame({'block_timestamp':  pd.to_datetime(timestamps,unit='s',origin='unix',utc=True),
+                            'block_number':     blocks,
+                            'log_index':        np.array([int(x['logIndex'],16) for x in logs],dtype=np.int64),
+                            'transaction_hash': [x['transactionHash'] for x in logs]})
+    words   = split_data_words([x['data'] for x in logs],n_words)
+    topics  = [x['topics'] for x in logs]
+
+    if event == 'Swap':
+        data['sender']       = topic_addresses([x[1] for x in topics])
+        data['recipient']    = topic_addresses([x[2] for x in topics])
+        data['amount0']      = decode_hex_words(words[:,0],'float64')
+        data['amount1']      = decode_hex_words(words[:,1],'float64')
+        data['sqrtPriceX96'] = decode_hex_words(words[:,2],'object',signed=False).astype(str)
+        data['liquidity']    = decode_hex_words(words[:,3],'object',signed=False).astype(str)
+        data['tick']         = decode_hex_words(words[:,4],'int64')
+    else:
+        data['owner']        = topic_addresses([x[1] for x in topics])
+        data['tick_lower']   = decode_hex_words([x[2] for x in topics],'int64')
+        data['tick_upper']   = decode_hex_words([x[3] for x in topics],'int64')
+        if event == 'Mint':
+            data['sender']   = topic_addresses(words[:,0].astype(str))
+            words            = words[:,1:]
+        data['amount']       = decode_hex_words(words[:,0],'object',signed=False).astype(str)
+        data['amount0']      = decode_hex_words(words[:,1],'float64',signed=False)
+        data['amount1']      = decode_hex_words(words[:,2],'float64',signed=False)
+
+    return data
+
+def merge_stored_blocks(data,table,file_name,block_begin,block_end):
+    """
+    Internal function that adds to freshly downloaded events the stored rows of the same days outside the blocks [block_begin,block_end].
+    Overwriting those days then keeps the events a partial block range (eg. ending mid-day) did not download again.
+    """
+    if not PoolDataStore.has_table(table,file_name):
+        return data
+    days   = data['time_pd'].dt.floor('D').unique()
+    stored = PoolDataStore.read_table(table,file_name,days.min(),days.max() + pd.Timedelta(days=1) - pd.Timedelta(1,'ns')).reset_index()
+    stored = stored[stored['time_pd'].dt.floor('D').isin(days) & ((stored['block_number'] < int(block_begin)) | (stored['block_number'] > int(block_end)))]
+    return pd.concat([stored,data],ignore_index=True).sort_values(['block_number','log_index'],kind='stable')
+
+def get_pool_data_rpc(contract_address,block_begin,block_end,decimals_0,decimals_1,rpc_url,file_name,DOWNLOAD_DATA = True,block_step=RPC_BLOCK_STEP,max_workers=DownloadEngine.MAX_WORKERS,client=None):
+    """
+    Pulls the Swap, Mint and Burn logs of a Uniswap v3 pool between two blocks (block_end can be 'latest') from any JSON-RPC node with eth_getLogs,
+    without going through an indexer. Block ranges are scanned concurrently (see download_rpc_logs) and the logs are decoded in bulk.
+    The events are stored in the local data store (tables 'swap_rpc', 'mint_rpc' and 'burn_rpc' under file_name, replacing the stored events
+    of the downloaded blocks), which is read back when DOWNLOAD_DATA is False.
+    Returns the swaps preprocessed like get_pool_data_bigquery, ready for the Active Strategy Framework.
+    """
+    if DOWNLOAD_DATA:
+        client = DownloadEngine.RequestClient(max_workers) if client is None else client
+        if block_end == 'latest':
+            block_end = int(run_rpc_query(rpc_url,'eth_blockNumber',[],client),16)
+
+        logs = {event: download_rpc_logs(rpc_url,contract_address,event,block_begin,block_end,block_step,max_workers,client) for event in UNIV3_EVENT_TOPICS}
+
+        block_timestamps = None
+        if not all('blockTimestamp' in x for event_logs in logs.values() for x in event_logs):
+            block_timestamps = download_rpc_block_timestamps(rpc_url,[int(x['blockNumber'],16) for event_logs in logs.values() for x in event_logs],
+                                                             max_workers=max_workers,client=client)
+
+        for event,event_logs in logs.items():
+            event_data = decode_rpc_logs(event_logs,event,block_timestamps)
+            if event == 'Swap':
+                swap_data = event_data
+            if len(event_data) > 0:
+                event_data = merge_stored_blocks(event_data.assign(time_pd=event_data['block_timestamp']),event.lower()+'_rpc',file_name,block_begin,block_end)
+                PoolDataStore.write_table(event_data,event.lower()+'_rpc',file_name)
+    else:
+        swap_data = PoolDataStore.read_table('swap_rpc',file_name).reset_index(drop=True)
+        if block_end != 'latest':
+            swap_data = swap_data[swap_data['block_number'] <= int(block_end)]
+        swap_data = swap_data[swap_data['block_number'] >= int(block_begin)].sort_values(['block_number','log_index']).reset_index(drop=True)
+
+    swap_data = preprocess_bigquery_swaps(swap_data,decimals_0,decimals_1)
+    swap_data = swap_data.set_index('block_date',drop=False).sort_index(kind='stable')
+
+    return swap_data
+
 ##############################################################
 # Get Swaps from Uniswap v3's subgraph, and liquidity at each swap from Flipside Crypto
 ##############################################################
 
-def query_univ3_graph(query: str, variables=None,network='mainnet') -> dict:    
+UNIV3_GRAPH_URLS = {'mainnet':  'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3',
+                    'arbitrum': 'https://api.thegraph.com/subgraphs/name/ianlapham/uniswap-arbitrum-one'}
+
+def query_univ3_graph(query: str, variables=None,network='mainnet',client=None) -> dict:    
     """
     Internal function to query The Graph's Uniswap v3 subgraph on either mainnet or arbitrum. 
+    Requests go through a DownloadEngine.RequestClient (rate limiting, retries with backoff, pooled connections).
     Use GetPoolData.get_pool_data_flipside which preprocesses the data in order to conduct simualtions with the Active Strategy Framework.
     """
     
-    if network == 'mainnet':
-        univ3_graph_url = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3'
-    elif network == 'arbitrum':
-        univ3_graph_url = 'https://api.thegraph.com/subgraphs/name/ianlapham/uniswap-arbitrum-one'
+    univ3_graph_url = UNIV3_GRAPH_URLS[network]
         
     if variables:
         params = {'query': query, 'variables': variables}
     else:
         params = {'query': query}
         
-    response = requests.post(univ3_graph_url, json=params)
-    return response.json()
+    return (DownloadEngine.default_client() if client is None else client).post_json(univ3_graph_url, params)
 
-def get_swap_data(contract_address,file_name,DOWNLOAD_DATA = True,network='mainnet'):       
+# Column types of the swaps stored in PoolDataStore (the subgraphs return numbers as strings)
+SWAP_V3_TYPES = {'id':'str','timestamp':'int64','tick':'int64','amount0':'float64','amount1':'float64','amountUSD':'float64'}
+SWAP_V2_TYPES = {'id':'str','timestamp':'int64','amount0In':'float64','amount1In':'float64','amount0Out':'float64','amount1Out':'float64','amountUSD':'float64'}
+
+def normalize_swap_data(swap_data,column_types):
+    """
+    Internal function to type the raw subgraph swaps and add the time_pd column used to partition the data store.
+    """
+    swap_data            = PoolDataStore.normalize_columns(swap_data,column_types)
+    swap_data['time_pd'] = pd.to_datetime(swap_data['timestamp'], unit='s', origin='unix',utc=True)
+    return swap_data
+
+def stored_high_water_mark(table,file_name):
+    """
+    Internal function that recovers the high-water mark (last timestamp and the ids of the swaps at that timestamp)
+    of swaps stored by a full download, for the first incremental sync of a pool.
+    """
+    if not PoolDataStore.has_table(table,file_name):
+        return None,[]
+    stored   = PoolDataStore.read_table(table,file_name,columns=['id','timestamp'])
+    last_ts  = int(stored['timestamp'].max())
+    return last_ts,stored.loc[stored['timestamp'] == last_ts,'id'].tolist()
+
+def sync_subgraph_swaps(table,file_name,generate_payload,run_query,column_types,timestamp_begin=0,segment_pages=20):
+    """
+    Internal function that downloads only the swaps newer than the pool's high-water mark and appends them to the data store.
+    generate_payload(timestamp) builds the id-paginated query of swaps with timestamp >= timestamp,
+    run_query(payload,paginate_id) returns the list of swaps in the next page.
+    New swaps are appended as a new segment every segment_pages pages, together with the pagination cursor,
+    so an interrupted sync resumes where it stopped instead of starting over.
+    """
+    state = PoolDataStore.read_sync_state(table,file_name)
+    if state is None:
+        last_ts,last_ids = stored_high_water_mark(table,file_name)
+        state            = {'timestamp':last_ts,'ids':last_ids,'cursor':None}
+
+    if state['cursor'] is None:
+        # Swaps are paginated by id, which is not ordered in time, so the high-water mark only moves once a sync completes
+        since           = timestamp_begin if state['timestamp'] is None else state['timestamp']
+        state['cursor'] = {'since':since,'id':'','timestamp':state['timestamp'],'ids':state['ids']}
+
+    cursor   = state['cursor']
+    seen_ids = set(state['ids'])
+    payload  = generate_payload(cursor['since'])
+    pages    = []
+    n_pages  = 0
+    finished = False
+
+    while not finished:
+        response = run_query(payload,cursor['id'])
+
+        if len(response) == 0:
+            finished = True
+        else:
+            cursor['id'] = response[-1]['id']
+            pages.extend([x for x in response if x['id'] not in seen_ids])
+            n_pages     += 1
+
+        if finished or n_pages == segment_pages:
+            if len(pages) > 0:
+                segment  = normalize_swap_data(pd.DataFrame(pages),column_types)
+                PoolDataStore.write_table(segment,table,file_name,mode='append')
+                # Track the newest swaps appended in this sync
+                last_ts  = int(segment['timestamp'].max())
+                last_ids = segment.loc[segment['timestamp'] == last_ts,'id'].tolist()
+                if cursor['timestamp'] is None or last_ts > cursor['timestamp']:
+                    cursor['timestamp'],cursor['ids'] = last_ts,last_ids
+                elif last_ts == cursor['timestamp']:
+                    cursor['ids'] = cursor['ids'] + last_ids
+            if finished:
+                state = {'timestamp':cursor['timestamp'],'ids':cursor['ids'],'cursor':None}
+            PoolDataStore.write_sync_state(state,table,file_name)
+            pages   = []
+            n_pages = 0
+
+    return state
+
+def get_swap_data(contract_address,file_name,DOWNLOAD_DATA = True,network='mainnet',INCREMENTAL=False,n_shards=1,max_workers=DownloadEngine.MAX_WORKERS):       
     """
     Internal function to query full history of swap data from Uniswap v3's subgraph.
+    Downloaded swaps are stored in the local data store (PoolDataStore) under file_name, which is read back when DOWNLOAD_DATA is False.
+    With INCREMENTAL only the swaps newer than the last sync are downloaded and appended to the store.
+    n_shards splits the pool's history into time shards that are downloaded concurrently by up to max_workers threads.
     Use GetPoolData.get_pool_data_flipside which preprocesses the data in order to conduct simualtions with the Active Strategy Framework.
     """
         
-    request_swap = [] 
-    
-    if DOWNLOAD_DATA:
-
-        current_payload = generate_first_event_payload('swaps',contract_address)
-        current_id      = query_univ3_graph(current_payload,network=network)['data']['pool']['swaps'][0]['id']
-        finished        = False
-
-        while not finished:
-            current_payload = generate_event_payload('swaps',contract_address,str(1000))
-            response        = query_univ3_graph(current_payload,variables={'paginateId':current_id},network=network)['data']['pool']['swaps']
-
-            if len(response) == 0:
-                finished = True
-            else:
-                current_id = response[-1]['id']
-                request_swap.extend(response)
-                
-            with open('./data/'+file_name+'_swap.pkl', 'wb') as output:
-                pickle.dump(request_swap, output, pickle.HIGHEST_PROTOCOL)
+    client = DownloadEngine.RequestClient(max_workers)
+
+    if DOWNLOAD_DATA and INCREMENTAL:
+        sync_subgraph_swaps('swap',file_name,
+                            lambda since: generate_event_payload('swaps',contract_address,str(1000),timestamp_gte=since),
+                            lambda payload,paginate_id: query_univ3_graph(payload,variables={'paginateId':paginate_id},network=network,client=client)['data']['pool']['swaps'],
+                            SWAP_V3_TYPES)
+        return PoolDataStore.read_table('swap',file_name).reset_index()
+    elif DOWNLOAD_DATA:
+        if n_shards > 1:
+            first_payload = generate_first_event_payload('swaps',contract_address,order_by='timestamp')
+            first_swap    = query_univ3_graph(first_payload,network=network,client=client)['data']['pool']['swaps'][0]
+            shards        = DownloadEngine.time_shards(first_swap['timestamp'],pd.Timestamp.now(tz='UTC').timestamp(),n_shards)
+        else:
+            shards        = [(None,None)]
+
+        def fetch_shard(shard):
+            payload = generate_event_payload('swaps',contract_address,str(1000),timestamp_gte=shard[0],timestamp_lte=shard[1])
+            return DownloadEngine.paginate_by_id(lambda paginate_id: query_univ3_graph(payload,variables={'paginateId':paginate_id},network=network,client=client)['data']['pool']['swaps'])
+
+        request_swap = DownloadEngine.merge_shards(DownloadEngine.fetch_shards(fetch_shard,shards,max_workers),key=lambda x: x['id'])
+        swap_data    = normalize_swap_data(pd.DataFrame(request_swap),SWAP_V3_TYPES)
+        PoolDataStore.write_table(swap_data,'swap',file_name)
+        return swap_data
     else:
-        with open('./data/'+file_name+'_swap.pkl', 'rb') as input:
-            request_swap = pickle.load(input)
-           
-    return pd.DataFrame(request_swap)
-
+        return PoolDataStore.read_table('swap',file_name).reset_index()
 
 def get_liquidity_flipside(flipside_query,file_name,DOWNLOAD_DATA = True):
     """
     Internal function to query full history of liquidity values from Flipside Crypto's Uniswap v3's databases.
+    Downloaded data is stored in the local data store (PoolDataStore) under file_name, which is read back when DOWNLOAD_DATA is False.
     Use GetPoolData.get_pool_data_flipside which preprocesses the data in order to conduct simualtions with the Active Strategy Framework.
     """
 
     if DOWNLOAD_DATA:        
-        request_stats    = [pd.DataFrame(requests.get(x).json()) for x in flipside_query]
-        with open('./data/'+file_name+'_liquidity.pkl', 'wb') as output:
-            pickle.dump(request_stats, output, pickle.HIGHEST_PROTOCOL)
+        request_stats         = [pd.DataFrame(requests.get(x).json()) for x in flipside_query]
+        stats_data            = pd.concat(request_stats)
+        stats_data['time_pd'] = pd.to_datetime(stats_data['BLOCK_TIMESTAMP'], origin='unix',utc=True)
+        PoolDataStore.write_table(stats_data,'liquidity',file_name)
     else:
-        with open('./data/'+file_name+'_liquidity.pkl', 'rb') as input:
-            request_stats = pickle.load(input)            
-            
-    stats_data                      = pd.concat(request_stats)
-    
+        stats_data            = PoolDataStore.read_table('liquidity',file_name).reset_index()
    
     return stats_data
     
 
-def get_pool_data_flipside(contract_address,flipside_query,file_name,DOWNLOAD_DATA = True):
+@QueryCache.cached_query('flipside',['contract_address','flipside_query'],opt_in=True)
+def get_pool_data_flipside(contract_address,flipside_query,file_name,DOWNLOAD_DATA = True,INCREMENTAL=False,n_shards=1):
     """
     Queries Uniswap v3's subgraph for swap data and Flipside Crypto's queries to find liquidity in order to conduct simulations using the Active Strategy Framework.
+    INCREMENTAL only downloads the swaps newer than the last sync of file_name, n_shards downloads the swaps in concurrent time shards.
     """
 
     # Download  events
-    swap_data               = get_swap_data(contract_address,file_name,DOWNLOAD_DATA)
+    swap_data               = get_swap_data(contract_address,file_name,DOWNLOAD_DATA,INCREMENTAL=INCREMENTAL,n_shards=n_shards)
     swap_data['time_pd']    = pd.to_datetime(swap_data['timestamp'], unit='s', origin='unix',utc=True)
     swap_data               = swap_data.set_index('time_pd')
     swap_data['tick_swap']  = swap_data['tick']
@@ -216,14 +607,21 @@ def get_pool_data_flipside(contract_address,flipside_query,file_name,DOWNLOAD_DA
     full_data               = pd.merge_asof(swap_data,stats_data[['VIRTUAL_LIQUIDITY_ADJUSTED','tick_pool']],on='time_pd',direction='backward',allow_exact_matches = False)
     full_data               = full_data.set_index('time_pd')
     # token with negative amounts is the token being swapped in
-    full_data['tick_swap']       = full_data['tick_swap'].astype(int)
+    full_data['tick_swap']       = full_data['tick_swap'].astype('int32')
     full_data['amount0']         = full_data['amount0'].astype(float)
     full_data['amount1']         = full_data['amount1'].astype(float)
-    full_data['token_in']        = full_data.apply(lambda x: 'token0' if (x['amount0'] < 0) else 'token1',axis=1)
+    full_data['token_in']        = token_in_column((full_data['amount0'] < 0).to_numpy())
     
     return full_data
 
-def generate_event_payload(event,address,n_query):
+def generate_event_payload(event,address,n_query,timestamp_gte=None,timestamp_lte=None):
+        timestamp_filter = ''
+        if timestamp_gte is not None:
+            timestamp_filter += ''',
+                    timestamp_gte: "'''+str(int(timestamp_gte))+'''"'''
+        if timestamp_lte is not None:
+            timestamp_filter += ''',
+                    timestamp_lte: "'''+str(int(timestamp_lte))+'''"'''
         payload =   '''
             query($paginateId: String!){
               pool(id:"'''+address+'''"){
@@ -232,7 +630,7 @@ def generate_event_payload(event,address,n_query):
                   orderBy: id
                   orderDirection: asc
                   where: {
-                    id_gt: $paginateId
+                    id_gt: $paginateId'''+timestamp_filter+'''
                   }
                 ) {
                   id
@@ -246,12 +644,12 @@ def generate_event_payload(event,address,n_query):
             }'''
         return payload
     
-def generate_first_event_payload(event,address):
+def generate_first_event_payload(event,address,order_by='id'):
         payload = '''query{
                       pool(id:"'''+address+'''"){
                       '''+event+'''(
                       first: 1
-                      orderBy: id
+                      orderBy: '''+order_by+'''
                       orderDirection: asc
                         ) {
                           id
@@ -270,73 +668,75 @@ def generate_first_event_payload(event,address):
 ##########################
 
 
-def query_univ2_graph(query: str, variables=None) -> dict:
+UNIV2_GRAPH_URL = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2'
+
+def query_univ2_graph(query: str, variables=None,client=None) -> dict:
     """
     Internal function to query The Graph's Uniswap v2 subgraph on mainnet.
+    Requests go through a DownloadEngine.RequestClient (rate limiting, retries with backoff, pooled connections).
     Use GetPoolData.get_swap_data_univ2 which preprocesses the data in order to conduct simualtions with the Active Strategy Framework.
     """
     
-    univ2_graph_url = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2'
+    univ2_graph_url = UNIV2_GRAPH_URL
         
     if variables:
         params = {'query': query, 'variables': variables}
     else:
         params = {'query': query}
         
-    response = requests.post(univ2_graph_url, json=params)
-    
-    return response.json()
+    return (DownloadEngine.default_client() if client is None else client).post_json(univ2_graph_url, params)
 
-def download_swap_univ2_subgraph(contract_address,file_name,date_begin,date_end,DOWNLOAD_DATA,RATE_LIMIT):
+def download_swap_univ2_subgraph(contract_address,file_name,date_begin,date_end,DOWNLOAD_DATA,RATE_LIMIT,INCREMENTAL=False,n_shards=1,max_workers=DownloadEngine.MAX_WORKERS):
     """
     Internal function to query the history of swap data from Uniswap v2's subgraph between begin_date and end_date.
+    Downloaded swaps are stored in the local data store (PoolDataStore) under file_name, which is read back when DOWNLOAD_DATA is False.
+    With INCREMENTAL only the swaps newer than the last sync (and up to date_end) are downloaded and appended to the store.
+    n_shards splits the dates into time shards that are downloaded concurrently by up to max_workers threads.
     Use GetPoolData.get_swap_data_univ2 which preprocesses the data in order to conduct simualtions with the Active Strategy Framework.
     """
         
-    request_swap = [] 
-    
-    if DOWNLOAD_DATA:
-
-        current_payload = generate_first_swap_univ2_payload(contract_address,date_begin,date_end)
-        current_id      = query_univ2_graph(current_payload)['data']['swaps'][0]['id']
-        finished        = False
-
-        while not finished:
-            current_payload = generate_swap_univ2_payload(contract_address,date_begin,date_end,str(1000))
-            response        = query_univ2_graph(current_payload,variables={'paginateId':current_id})['data']['swaps']
-
-            if len(response) == 0:
-                finished = True
-            else:
-                current_id = response[-1]['id']
-                request_swap.extend(response)
-                
-            if RATE_LIMIT:
-                time.sleep(5)
-                
-            with open('./data/'+file_name+'_swap_v2.pkl', 'wb') as output:
-                pickle.dump(request_swap, output, pickle.HIGHEST_PROTOCOL)
+    client = DownloadEngine.RequestClient(max_workers,rate=DownloadEngine.LIMITED_RATE if RATE_LIMIT else DownloadEngine.MAX_RATE)
+
+    if DOWNLOAD_DATA and INCREMENTAL:
+        sync_subgraph_swaps('swap_v2',file_name,
+                            lambda since: generate_swap_univ2_payload(contract_address,pd.Timestamp(since,unit='s'),date_end,str(1000)),
+                            lambda payload,paginate_id: query_univ2_graph(payload,variables={'paginateId':paginate_id},client=client)['data']['swaps'],
+                            SWAP_V2_TYPES,timestamp_begin=int(pd.Timestamp(date_begin).timestamp()))
+        return PoolDataStore.read_table('swap_v2',file_name,date_begin,date_end).reset_index()
+    elif DOWNLOAD_DATA:
+        shards  = DownloadEngine.time_shards(pd.Timestamp(date_begin).timestamp(),pd.Timestamp(date_end).timestamp(),n_shards)
+
+        def fetch_shard(shard):
+            payload = generate_swap_univ2_payload(contract_address,pd.Timestamp(shard[0],unit='s'),pd.Timestamp(shard[1],unit='s'),str(1000))
+            return DownloadEngine.paginate_by_id(lambda paginate_id: query_univ2_graph(payload,variables={'paginateId':paginate_id},client=client)['data']['swaps'])
+
+        request_swap = DownloadEngine.merge_shards(DownloadEngine.fetch_shards(fetch_shard,shards,max_workers),key=lambda x: x['id'])
+        swap_data    = normalize_swap_data(pd.DataFrame(request_swap),SWAP_V2_TYPES)
+        PoolDataStore.write_table(swap_data,'swap_v2',file_name)
+        return swap_data
     else:
-        with open('./data/'+file_name+'_swap_v2.pkl', 'rb') as input:
-            request_swap = pickle.load(input)
-           
-    return pd.DataFrame(request_swap)
+        return PoolDataStore.read_table('swap_v2',file_name,date_begin,date_end).reset_index()
 
 
-def get_swap_data_univ2(contract_address,file_name,date_begin,date_end,DOWNLOAD_DATA = True,RATE_LIMIT=False):    
+@QueryCache.cached_query('univ2_subgraph',['contract_address','date_begin','date_end'],'date_end',opt_in=True)
+def get_swap_data_univ2(contract_address,file_name,date_begin,date_end,DOWNLOAD_DATA = True,RATE_LIMIT=False,INCREMENTAL=False,n_shards=1):    
     """
     Queries Uniswap v2's subgraph for swap data in order to conduct simulations using the Active Strategy Framework.
+    INCREMENTAL only downloads the swaps newer than the last sync of file_name, n_shards downloads the swaps in concurrent time shards.
     """
     
-    swap_data               = download_swap_univ2_subgraph(contract_address,file_name,date_begin,date_end,DOWNLOAD_DATA,RATE_LIMIT)
+    swap_data               = download_swap_univ2_subgraph(contract_address,file_name,date_begin,date_end,DOWNLOAD_DATA,RATE_LIMIT,INCREMENTAL,n_shards)
     swap_data['time_pd']    = pd.to_datetime(swap_data['timestamp'], unit='s', origin='unix',utc=True)
     swap_data               = swap_data.set_index('time_pd',drop=False)
     swap_data               = swap_data.sort_index()
     
-    swap_data['token_in']   = swap_data.apply(lambda x: 'token0' if float(x['amount0In']) > 0 else 'token1',axis=1)
-    swap_data['amount0']    = swap_data.apply(lambda x: -float(x['amount0In'])  if x['token_in'] == 'token0'  else float(x['amount0Out']),axis=1)
-    swap_data['amount1']    = swap_data.apply(lambda x:  float(x['amount1Out']) if x['token_in'] == 'token0'  else -float(x['amount1In']),axis=1)
-    swap_data['traded_in']  = swap_data.apply(lambda x: -x['amount0'] if (x['amount0'] < 0) else -x['amount1'],axis=1).astype(float)
+    amount_0_in             = swap_data['amount0In'].to_numpy(dtype=float)
+    amount_1_in             = swap_data['amount1In'].to_numpy(dtype=float)
+    token_0_in              = amount_0_in > 0
+    swap_data['token_in']   = token_in_column(token_0_in)
+    swap_data['amount0']    = np.where(token_0_in,-amount_0_in,swap_data['amount0Out'].to_numpy(dtype=float))
+    swap_data['amount1']    = np.where(token_0_in,swap_data['amount1Out'].to_numpy(dtype=float),-amount_1_in)
+    swap_data['traded_in']  = np.where(swap_data['amount0'] < 0,-swap_data['amount0'],-swap_data['amount1'])
 
     return swap_data
 
@@ -408,105 +808,92 @@ def generate_first_swap_univ2_payload(address,date_begin,date_end):
 ##############################################################
 # Get Price Data from Bitquery
 ##############################################################
-def get_price_data_bitquery(token_0_address,token_1_address,date_begin,date_end,api_token,file_name,DOWNLOAD_DATA = True,RATE_LIMIT=False,exchange_to_query='Uniswap'):
+@QueryCache.cached_query('bitquery_price',['token_0_address','token_1_address','date_begin','date_end','exchange_to_query'],'date_end',opt_in=True)
+def get_price_data_bitquery(token_0_address,token_1_address,date_begin,date_end,api_token,file_name,DOWNLOAD_DATA = True,RATE_LIMIT=False,exchange_to_query='Uniswap',n_shards=1,max_workers=DownloadEngine.MAX_WORKERS):
     """
     Queries the price history of a pair of ERC20's (located at token_0_address and token_1_address) in exchange_to_query (defaults to all Uniswap versions on mainnet) between begin_date and end_date on Bitquery.
+    Prices are stored in the local data store (PoolDataStore) under file_name, which is read back when DOWNLOAD_DATA is False.
+    n_shards splits the dates into ranges of days that are downloaded concurrently by up to max_workers threads.
     """
-    request = []
-    max_rows_bitquery = 10000
     
     if DOWNLOAD_DATA:        
-        # Paginate using limit and an offset
-        offset = 0
-        current_request = run_bitquery_query(generate_price_payload(token_0_address,token_1_address,date_begin,date_end,offset,exchange_to_query),api_token)
-        request.append(current_request)
-        
-        # When a request has less than 10,000 rows we are at the last one
-        while len(current_request['data']['ethereum']['dexTrades']) == max_rows_bitquery:
-            current_request = run_bitquery_query(generate_price_payload(token_0_address,token_1_address,date_begin,date_end,offset,exchange_to_query),api_token)
-            request.append(current_request)
-            offset += max_rows_bitquery
-            if RATE_LIMIT:
-                time.sleep(5)
-
-        with open('./data/'+file_name+'_1min.pkl', 'wb') as output:
-            pickle.dump(request, output, pickle.HIGHEST_PROTOCOL)
-
+        client = DownloadEngine.RequestClient(max_workers,rate=DownloadEngine.LIMITED_RATE if RATE_LIMIT else DownloadEngine.MAX_RATE)
+
+        def fetch_shard(shard):
+            return DownloadEngine.paginate_by_offset(lambda offset: run_bitquery_query(generate_price_payload(token_0_address,token_1_address,shard[0],shard[1],offset,exchange_to_query),api_token,client)['data']['ethereum']['dexTrades'],
+                                                     MAX_ROWS_BITQUERY)
+
+        trades = DownloadEngine.merge_shards(DownloadEngine.fetch_shards(fetch_shard,DownloadEngine.date_shards(date_begin,date_end,n_shards),max_workers),key=bitquery_trade_key)
+
+        # Prepare data for strategy:
+        # Collect json data and add to a pandas Data Frame
+        price_data = pd.DataFrame({
+        'time':           [x['timeInterval']['minute'] for x in trades],
+        'baseCurrency':   [x['baseCurrency']['symbol'] for x in trades],
+        'quoteCurrency':  [x['quoteCurrency']['symbol'] for x in trades],
+        'quoteAmount':    [x['quoteAmount'] for x in trades],
+        'baseAmount':     [x['baseAmount'] for x in trades],
+        'tradeAmount':    [x['tradeAmount'] for x in trades],
+        'quotePrice':     [x['quotePrice'] for x in trades]
+        })
+    
+        price_data['time']    = pd.to_datetime(price_data['time'], format = '%Y-%m-%d %H:%M:%S')
+        price_data['time_pd'] = pd.to_datetime(price_data['time'],utc=True)
+        price_data            = price_data.set_index('time_pd')
+
+        PoolDataStore.write_table(price_data,'1min',file_name)
     else:
-        with open('./data/'+file_name+'_1min.pkl', 'rb') as input:
-            request = pickle.load(input)
-
-    # Prepare data for strategy:
-    # Collect json data and add to a pandas Data Frame
-    
-    requests_with_data = [len(x['data']['ethereum']['dexTrades']) > 0 for x in request]
-    relevant_requests  = list(compress(request, requests_with_data))
-    
-    price_data = pd.concat([pd.DataFrame({
-    'time':           [x['timeInterval']['minute'] for x in request_price['data']['ethereum']['dexTrades']],
-    'baseCurrency':   [x['baseCurrency']['symbol'] for x in request_price['data']['ethereum']['dexTrades']],
-    'quoteCurrency':  [x['quoteCurrency']['symbol'] for x in request_price['data']['ethereum']['dexTrades']],
-    'quoteAmount':    [x['quoteAmount'] for x in request_price['data']['ethereum']['dexTrades']],
-    'baseAmount':     [x['baseAmount'] for x in request_price['data']['ethereum']['dexTrades']],
-    'tradeAmount':    [x['tradeAmount'] for x in request_price['data']['ethereum']['dexTrades']],
-    'quotePrice':     [x['quotePrice'] for x in request_price['data']['ethereum']['dexTrades']]
-    }) for request_price in relevant_requests])
-    
-    price_data['time']    = pd.to_datetime(price_data['time'], format = '%Y-%m-%d %H:%M:%S')
-    price_data['time_pd'] = pd.to_datetime(price_data['time'],utc=True)
-    price_data            = price_data.set_index('time_pd')
+        price_data = PoolDataStore.read_table('1min',file_name,date_begin,date_end)
 
     return price_data
 
-def get_price_usd_data_bitquery(token_address,date_begin,date_end,api_token,file_name,DOWNLOAD_DATA = True ,RATE_LIMIT=False,exchange_to_query='Uniswap'):
+@QueryCache.cached_query('bitquery_price_usd',['token_address','date_begin','date_end','exchange_to_query'],'date_end',opt_in=True)
+def get_price_usd_data_bitquery(token_address,date_begin,date_end,api_token,file_name,DOWNLOAD_DATA = True ,RATE_LIMIT=False,exchange_to_query='Uniswap',n_shards=1,max_workers=DownloadEngine.MAX_WORKERS):
     """
     Queries the price history of an ERC20 + USD Stablecoins (located at token_address) in exchange_to_query (defaults to all Uniswap versions on mainnet) between begin_date and end_date on Bitquery.
+    Prices are stored in the local data store (PoolDataStore) under file_name, which is read back when DOWNLOAD_DATA is False.
+    n_shards splits the dates into ranges of days that are downloaded concurrently by up to max_workers threads.
     """
-
-    request = []
-    max_rows_bitquery = 10000
     
     if DOWNLOAD_DATA:        
-        # Paginate using limit and an offset
-        offset = 0
-        current_request = run_bitquery_query(generate_usd_price_payload(token_address,date_begin,date_end,offset,exchange_to_query),api_token)
-        request.append(current_request)
-        
-        # When a request has less than 10,000 rows we are at the last one
-        while len(current_request['data']['ethereum']['dexTrades']) == max_rows_bitquery:
-            current_request = run_bitquery_query(generate_usd_price_payload(token_address,date_begin,date_end,offset,exchange_to_query),api_token)
-            request.append(current_request)
-            offset += max_rows_bitquery
-            if RATE_LIMIT:
-                time.sleep(5)
-
-        with open('./data/'+file_name+'_1min.pkl', 'wb') as output:
-            pickle.dump(request, output, pickle.HIGHEST_PROTOCOL)
+        client = DownloadEngine.RequestClient(max_workers,rate=DownloadEngine.LIMITED_RATE if RATE_LIMIT else DownloadEngine.MAX_RATE)
+
+        def fetch_shard(shard):
+            return DownloadEngine.paginate_by_offset(lambda offset: run_bitquery_query(generate_usd_price_payload(token_address,shard[0],shard[1],offset,exchange_to_query),api_token,client)['data']['ethereum']['dexTrades'],
+                                                     MAX_ROWS_BITQUERY)
+
+        trades = DownloadEngine.merge_shards(DownloadEngine.fetch_shards(fetch_shard,DownloadEngine.date_shards(date_begin,date_end,n_shards),max_workers),key=bitquery_trade_key)
+
+        # Prepare data for strategy:
+        # Collect json data and add to a pandas Data Frame
+        price_data = pd.DataFrame({
+        'time':           [x['timeInterval']['minute'] for x in trades],
+        'baseCurrency':   [x['baseCurrency']['symbol'] for x in trades],
+        'quoteCurrency':  [x['quoteCurrency']['symbol'] for x in trades],
+        'quoteAmount':    [x['quoteAmount'] for x in trades],
+        'baseAmount':     [x['baseAmount'] for x in trades],
+        'quotePrice':     [x['quotePrice'] for x in trades]
+        })
+    
+        price_data['time']    = pd.to_datetime(price_data['time'], format = '%Y-%m-%d %H:%M:%S')
+        price_data['time_pd'] = pd.to_datetime(price_data['time'],utc=True)
+        price_data            = price_data.set_index('time_pd')
+
+        PoolDataStore.write_table(price_data,'1min',file_name)
     else:
-        with open('./data/'+file_name+'_1min.pkl', 'rb') as input:
-            request = pickle.load(input)
-
-    # Prepare data for strategy:
-    # Collect json data and add to a pandas Data Frame
-    
-    requests_with_data = [len(x['data']['ethereum']['dexTrades']) > 0 for x in request]
-    relevant_requests  = list(compress(request, requests_with_data))
-    
-    price_data = pd.concat([pd.DataFrame({
-    'time':           [x['timeInterval']['minute'] for x in request_price['data']['ethereum']['dexTrades']],
-    'baseCurrency':   [x['baseCurrency']['symbol'] for x in request_price['data']['ethereum']['dexTrades']],
-    'quoteCurrency':  [x['quoteCurrency']['symbol'] for x in request_price['data']['ethereum']['dexTrades']],
-    'quoteAmount':    [x['quoteAmount'] for x in request_price['data']['ethereum']['dexTrades']],
-    'baseAmount':     [x['baseAmount'] for x in request_price['data']['ethereum']['dexTrades']],
-    'quotePrice':     [x['quotePrice'] for x in request_price['data']['ethereum']['dexTrades']]
-    }) for request_price in relevant_requests])
-    
-    price_data['time']    = pd.to_datetime(price_data['time'], format = '%Y-%m-%d %H:%M:%S')
-    price_data['time_pd'] = pd.to_datetime(price_data['time'],utc=True)
-    price_data            = price_data.set_index('time_pd')
+        price_data = PoolDataStore.read_table('1min',file_name,date_begin,date_end)
 
     return price_data
 
+# Bitquery returns at most this many rows per query
+MAX_ROWS_BITQUERY = 10000
+
+def bitquery_trade_key(trade):
+    """
+    Internal function that identifies a row of Bitquery's per minute dexTrades, used to merge pages without duplicates.
+    """
+    return (trade['timeInterval']['minute'],trade['baseCurrency']['address'],trade['quoteCurrency']['address'])
+
 def generate_price_payload(token_0_address,token_1_address,date_begin,date_end,offset,exchange_to_query='Uniswap'):
     payload =   '''{
                   ethereum(network: ethereum) {
@@ -574,15 +961,13 @@ def generate_usd_price_payload(token_address,date_begin,date_end,offset,exchange
     return payload
     
 
-def run_bitquery_query(query,api_token):  
+BITQUERY_URL = 'https://graphql.bitquery.io/'
+
+def run_bitquery_query(query,api_token,client=None):  
     """
     Internal function that runs a GraphQL query on Bitquery.
+    Requests go through a DownloadEngine.RequestClient (rate limiting, retries with backoff, pooled connections).
     """
-    url       = 'https://graphql.bitquery.io/'
+    url       = BITQUERY_URL
     headers = {'X-API-KEY': api_token}
-    request = requests.post(url,
-                            json={'query': query}, headers=headers)
-    if request.status_code == 200:
-        return request.json()
-    else:
-        raise Exception('Query failed and return code is {}.      {}'.format(request.status_code,query))
\ No newline at end of file
+    return (DownloadEngine.default_client() if client is None else client).post_json(url,{'query': query},headers)
@@ -0,0 +1,326 @@
+import numpy as np
+import pandas as pd
+import math
+import UNI_v3_funcs
+import SwapDataset
+import ARGarchModel
+
+##############################################################
+# Vectorized Monte Carlo simulation of strategies over synthetic price and swap paths
+# Paths are generated from a model fitted to the historical observations:
+#     - 'bootstrap': historical steps (a price return together with the swaps of that step) resampled in blocks,
+#                    the same empirical distribution ResetStrategy's ECDF is built from
+#     - 'ar_garch':  returns simulated from the AR(1)-GARCH(1,1) of ARGarchModel (as fitted by AutoRegressiveStrategy),
+#                    with the swaps of historical steps resampled independently
+# The strategy then runs over all the paths at once: its state is held in one array per variable with an element per path,
+# and each step is a few vector operations, so the cost grows with paths x steps without a simulate_strategy call per path.
+# Swaps are aggregated per step (total amount traded of each token, median virtual liquidity) and priced at the tick at
+# the end of the step, so fees are an approximation of the per swap accrual of StrategyObservation.accrue_fees.
+##############################################################
+
+PATH_QUANTILES = [0.01,0.05,0.25,0.5,0.75,0.95,0.99]
+TAIL_LEVELS    = [0.01,0.05]
+PATH_METRICS   = ['net_return','gross_fee_return','impermanent_loss','max_drawdown','rebalances','final_value']
+
+
+def historical_steps(price_data,swap_data):
+    """
+    Return and swap flows of every step between consecutive observations of price_data (a price Series, as passed to simulate_strategy).
+    Swaps between two observations, both ends included as in simulate_strategy, are summed per token in (traded_0, traded_1)
+    and their median virtual liquidity is kept. Returns a DataFrame indexed by the time at the end of each step.
+    """
+    prices         = np.asarray(price_data,dtype=float)
+    times_ns       = SwapDataset.time_ns(price_data.index)
+    swap_times     = SwapDataset.swap_times(swap_data)
+    _,token_0_in,virtual_liquidity,traded_in = SwapDataset.fee_columns(swap_data)
+
+    swap_start     = np.searchsorted(swap_times,times_ns[:-1],side='left')
+    swap_end       = np.searchsorted(swap_times,times_ns[1:], side='right')
+    cumulative_0   = np.r_[0.0,np.cumsum(np.where(token_0_in,traded_in,0.0))]
+    cumulative_1   = np.r_[0.0,np.cumsum(np.where(token_0_in,0.0,traded_in))]
+
+    virtual_median = np.full(len(prices) - 1,np.nan)
+    for i in np.flatnonzero(swap_end > swap_start):
+        step_virtual = virtual_liquidity[swap_start[i]:swap_end[i]]
+        if np.any(~np.isnan(step_virtual)):
+            virtual_median[i] = np.nanmedian(step_virtual)
+
+    return pd.DataFrame({'price_return':      prices[1:]/prices[:-1] - 1,
+                         'traded_0':          cumulative_0[swap_end] - cumulative_0[swap_start],
+                         'traded_1':          cumulative_1[swap_end] - cumulative_1[swap_start],
+                         'virtual_liquidity': virtual_median},index=price_data.index[1:])
+
+
+def path_swaps(steps,swap_step):
+    """
+    Paths dict entries for the swaps: the historical step of each path step (swap_step) and the per step flows it indexes.
+    """
+    return {'swap_step':         swap_step,
+            'traded_0':          steps['traded_0'].to_numpy(dtype=float),
+            'traded_1':          steps['traded_1'].to_numpy(dtype=float),
+            'virtual_liquidity': steps['virtual_liquidity'].to_numpy(dtype=float)}
+
+
+def bootstrap_paths(steps,n_paths,n_steps,initial_price,block_size=1,seed=None):
+    """
+    Price and swap paths resampled from historical steps (see historical_steps) in blocks of block_size consecutive steps,
+    which keeps the swaps with the return of their step and, for blocks longer than 1, the short term dependence of both.
+    Returns a paths dict: price (n_paths, n_steps+1) starting at initial_price, and the swaps (see path_swaps).
+    """
+    if block_size < 1 or block_size > len(steps):
+        raise ValueError('block_size must be between 1 and the number of historical steps')
+    rng       = np.random.default_rng(seed)
+    n_blocks  = int(math.ceil(n_steps / block_size))
+    starts    = rng.integers(0,len(steps) - block_size + 1,size=(n_paths,n_blocks))
+    swap_step = (starts[:,:,None] + np.arange(block_size)).reshape(n_paths,-1)[:,:n_steps].astype(np.int32)
+
+    returns   = steps['price_return'].to_numpy(dtype=float)[swap_step]
+    price     = initial_price * np.cumprod(np.c_[np.ones(n_paths),1 + returns],axis=1)
+    return dict({'price':price},**path_swaps(steps,swap_step))
+
+
+def ar_garch_paths(steps,n_paths,n_steps,initial_price,seed=None):
+    """
+    Price paths from an AR(1)-GARCH(1,1) fitted to the historical step returns, continuing from the last fitted observation,
+    with Gaussian innovations. Swaps are resampled independently from the historical steps.
+    Returns a paths dict like bootstrap_paths.
+    """
+    rng        = np.random.default_rng(seed)
+    fit        = ARGarchModel.fit_ar_garch_batch(steps['price_return'].to_numpy(dtype=float))
+    mu,phi,omega,alpha,beta = fit['params'][0]
+
+    last_return   = np.full(n_paths,fit['last_return'][0])
+    last_resid    = np.full(n_paths,fit['last_resid'][0])
+    last_variance = np.full(n_paths,fit['last_variance'][0])
+    returns       = np.empty((n_paths,n_steps))
+    for t in range(n_steps):
+        last_variance = omega + alpha * last_resid**2 + beta * last_variance
+        last_resid    = np.sqrt(last_variance) * rng.standard_normal(n_paths)
+        last_return   = mu + phi * last_return + last_resid
+        returns[:,t]  = last_return
+    # Back to the original units; a return can not take the price below zero
+    returns   = np.maximum(returns / fit['scale'][0],-0.99)
+
+    price     = initial_price * np.cumprod(np.c_[np.ones(n_paths),1 + returns],axis=1)
+    swap_step = rng.integers(0,len(steps),size=(n_paths,n_steps)).astype(np.int32)
+    return dict({'price':price},**path_swaps(steps,swap_step))
+
+
+########################################################
+# Array-parallel ResetStrategy
+# The ResetStrategy state of every path is kept in arrays: base and limit ticks and liquidity, reset range, left over tokens
+# and uncollected fees. Each step updates the amounts at the new price, accrues the step's fees, checks check_strategy's
+# reset conditions for all paths and places new ranges (set_liquidity_ranges) for the paths that reset.
+########################################################
+
+class ResetPathState:
+    def __init__(self,strategy_in,n_paths,fee_tier,decimals_0,decimals_1):
+
+        self.strategy_in        = strategy_in
+        self.fee_tier           = fee_tier
+        self.decimals_0         = decimals_0
+        self.decimals_1         = decimals_1
+        self.decimal_adjustment = 10**(decimals_1 - decimals_0)
+        self.tickSpacing        = int(fee_tier*2*10000) if fee_tier > (100/1e6) else int(fee_tier*10000)
+
+        for name in ['base_lower_tick','base_upper_tick','base_liquidity','base_0','base_1',
+                     'limit_lower_tick','limit_upper_tick','limit_liquidity','limit_0','limit_1',
+                     'reset_range_lower','reset_range_upper','left_over_0','left_over_1','fees_uncollected_0','fees_uncollected_1']:
+            setattr(self,name,np.zeros(n_paths))
+
+    def range_tick(self,price):
+        """
+        Tick of a range bound, rounded to the tick spacing as in set_liquidity_ranges.
+        """
+        return np.trunc(np.round(np.trunc(np.log(self.decimal_adjustment*price)/math.log(1.0001))/self.tickSpacing)*self.tickSpacing)
+
+    def set_liquidity_ranges(self,paths,price,liquidity_in_0,liquidity_in_1):
+        """
+        Places the base and limit positions of the selected paths (an index array) with their tokens, at their prices.
+        """
+        price_tick       = np.floor(np.log(self.decimal_adjustment*price)/math.log(1.0001)/self.tickSpacing)*self.tickSpacing
+        reset_quantiles  = self.strategy_in.reset_quantiles
+        base_quantiles   = self.strategy_in.base_quantiles
+
+        self.reset_range_lower[paths] = (1 + reset_quantiles[0]) * price
+        self.reset_range_upper[paths] = (1 + reset_quantiles[1]) * price
+        base_range_lower = (1 + base_quantiles[0]) * price
+        base_range_upper = (1 + base_quantiles[1]) * price
+
+        # Base position
+        base_lower_tick  = self.range_tick(base_range_lower)
+        base_upper_tick  = self.range_tick(base_range_upper)
+        base_liquidity   = UNI_v3_funcs.get_liquidity_array(price_tick,base_lower_tick,base_upper_tick,liquidity_in_0,liquidity_in_1,self.decimals_0,self.decimals_1)
+        base_0,base_1    = UNI_v3_funcs.get_amounts_array(price_tick,base_lower_tick,base_upper_tick,base_liquidity,self.decimals_0,self.decimals_1)
+
+        # Limit position, single sided with the token of highest value left
+        remaining_0      = liquidity_in_0 - base_0
+        remaining_1      = liquidity_in_1 - base_1
+        token_0_limit    = remaining_0*price > remaining_1
+        limit_amount_0   = np.where(token_0_limit,remaining_0,0.0)
+        limit_amount_1   = np.where(token_0_limit,0.0,remaining_1)
+        limit_lower_tick = self.range_tick(np.where(token_0_limit,price,base_range_lower))
+        limit_upper_tick = self.range_tick(np.where(token_0_limit,base_range_upper,price))
+        limit_liquidity  = UNI_v3_funcs.get_liquidity_array(price_tick,limit_lower_tick,limit_upper_tick,limit_amount_0,limit_amount_1,self.decimals_0,self.decimals_1)
+        limit_0,limit_1  = UNI_v3_funcs.get_amounts_array(price_tick,limit_lower_tick,limit_upper_tick,limit_liquidity,self.decimals_0,self.decimals_1)
+
+        for name,value in [('base_lower_tick',base_lower_tick),('base_upper_tick',base_upper_tick),('base_liquidity',base_liquidity),
+                           ('base_0',base_0),('base_1',base_1),('limit_lower_tick',limit_lower_tick),('limit_upper_tick',limit_upper_tick),
+                           ('limit_liquidity',limit_liquidity),('limit_0',limit_0),('limit_1',limit_1),
+                           ('left_over_0',np.maximum(remaining_0 - limit_0,0.0)),('left_over_1',np.maximum(remaining_1 - limit_1,0.0)),
+                           ('fees_uncollected_0',0.0),('fees_uncollected_1',0.0)]:
+            getattr(self,name)[paths] = value
+
+    def update_amounts(self,tick_current):
+        self.base_0,self.base_1   = UNI_v3_funcs.get_amounts_array(tick_current,self.base_lower_tick,self.base_upper_tick,self.base_liquidity,self.decimals_0,self.decimals_1)
+        self.limit_0,self.limit_1 = UNI_v3_funcs.get_amounts_array(tick_current,self.limit_lower_tick,self.limit_upper_tick,self.limit_liquidity,self.decimals_0,self.decimals_1)
+
+    def accrue_fees(self,tick_current,traded_0,traded_1,virtual_liquidity):
+        """
+        Fees of one step for every path, added to the uncollected fees. Returns the fees earned in each token.
+        """
+        fees_0 = np.zeros(len(tick_current))
+        fees_1 = np.zeros(len(tick_current))
+        for lower,upper,liquidity in [(self.base_lower_tick,self.base_upper_tick,self.base_liquidity),
+                                      (self.limit_lower_tick,self.limit_upper_tick,self.limit_liquidity)]:
+            in_range = (lower <= tick_current) & (upper >= tick_current)
+            share    = np.where(in_range,self.fee_tier*liquidity/(liquidity + virtual_liquidity),0.0)
+            # Steps without a liquidity value earn nothing, as in StrategyObservation.accrue_fees
+            share    = np.where(np.isnan(share),0.0,share)
+            fees_0  += share * traded_0
+            fees_1  += share * traded_1
+        self.fees_uncollected_0 += fees_0
+        self.fees_uncollected_1 += fees_1
+        return fees_0,fees_1
+
+    def check_strategy(self,price):
+        """
+        Paths that reset at this step, with check_strategy's conditions (left the reset range or imbalanced limit position).
+        """
+        limit_parameter = self.strategy_in.limit_parameter
+        left_range      = (price < self.reset_range_lower) | (price > self.reset_range_upper)
+        limit_balance   = self.limit_0 + self.limit_1*price
+        base_balance    = self.base_0 + self.base_1*price
+        both_tokens     = (self.limit_0 > 0.0) & (self.limit_1 > 0.0)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            limit_ratio     = self.limit_0/self.limit_1
+            limit_similar   = (limit_ratio >= limit_parameter) | (limit_ratio <= (limit_parameter+1))
+            balance_ratio   = np.divide(limit_balance,base_balance,out=np.zeros(len(price)),where=base_balance > 0.0)
+        limit_rebalance = both_tokens & np.where(base_balance > 0.0,(balance_ratio > (1+limit_parameter)) & limit_similar,limit_similar)
+        return left_range | limit_rebalance
+
+    def remove_liquidity(self,paths):
+        """
+        Tokens of the selected paths once their positions are withdrawn, with the left over tokens and uncollected fees.
+        """
+        return (self.base_0[paths] + self.limit_0[paths] + self.left_over_0[paths] + self.fees_uncollected_0[paths],
+                self.base_1[paths] + self.limit_1[paths] + self.left_over_1[paths] + self.fees_uncollected_1[paths])
+
+    def value_in_token_0(self,price):
+        return (self.base_0 + self.limit_0 + self.left_over_0 + self.fees_uncollected_0 +
+                (self.base_1 + self.limit_1 + self.left_over_1 + self.fees_uncollected_1) / price)
+
+
+def simulate_reset_paths(paths,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,keep_values=False):
+    """
+    Runs a ResetStrategy (with its fixed quantiles) over every path of a paths dict (bootstrap_paths or ar_garch_paths) at once.
+    Values are in token 0, like generate_simulation_series without token_0_usd_data.
+    Returns a dict of per path arrays: the path metrics of PATH_METRICS, final hold value and cumulative fees,
+    and the position value at every step (n_paths, n_steps+1) if keep_values.
+    """
+    if getattr(strategy_in,'return_distribution',None) is not None:
+        raise ValueError('Monte Carlo paths require fixed quantiles, the strategy uses an online return distribution')
+
+    price             = paths['price']
+    n_paths,n_columns = price.shape
+    state             = ResetPathState(strategy_in,n_paths,fee_tier,decimals_0,decimals_1)
+    every_path        = np.arange(n_paths)
+    state.set_liquidity_ranges(every_path,price[:,0],np.full(n_paths,float(liquidity_in_0)),np.full(n_paths,float(liquidity_in_1)))
+
+    # Buy and hold the tokens placed at the start, as generate_simulation_series does
+    token_0_initial   = state.base_0 + state.limit_0 + state.left_over_0
+    token_1_initial   = state.base_1 + state.limit_1 + state.left_over_1
+    value             = state.value_in_token_0(price[:,0])
+    initial_value     = token_0_initial + token_1_initial / price[:,0]
+    value_max         = value.copy()
+    value_min         = value.copy()
+    cum_fees          = np.zeros(n_paths)
+    rebalances        = np.zeros(n_paths,dtype=np.int64)
+    values            = np.empty((n_paths,n_columns)) if keep_values else None
+    if keep_values:
+        values[:,0]   = value
+
+    for t in range(1,n_columns):
+        step_price   = price[:,t]
+        tick_current = np.floor(np.log(state.decimal_adjustment*step_price)/math.log(1.0001))
+        swap_step    = paths['swap_step'][:,t-1]
+
+        state.update_amounts(tick_current)
+        fees_0,fees_1 = state.accrue_fees(tick_current,paths['traded_0'][swap_step],paths['traded_1'][swap_step],paths['virtual_liquidity'][swap_step])
+        cum_fees     += fees_0 + fees_1/step_price
+
+        reset = np.flatnonzero(state.check_strategy(step_price))
+        if len(reset) > 0:
+            liquidity_0,liquidity_1 = state.remove_liquidity(reset)
+            state.set_liquidity_ranges(reset,step_price[reset],liquidity_0,liquidity_1)
+            rebalances[reset] += 1
+
+        value        = state.value_in_token_0(step_price)
+        value_max    = np.maximum(value_max,value)
+        value_min    = np.minimum(value_min,value)
+        if keep_values:
+            values[:,t] = value
+
+    final_hold = token_0_initial + token_1_initial / price[:,-1]
+    results    = {'net_return':       value/initial_value - 1,
+                  'gross_fee_return': cum_fees/initial_value,
+                  'impermanent_loss': (value - final_hold)/final_hold,
+                  'max_drawdown':     (value_max - value_min)/value_max,
+                  'rebalances':       rebalances,
+                  'final_value':      value,
+                  'final_hold_value': final_hold,
+                  'cum_fees':         cum_fees}
+    if keep_values:
+        results['values'] = values
+    return results
+
+
+def summarize_paths(results,quantiles=PATH_QUANTILES,tail_levels=TAIL_LEVELS):
+    """
+    Distribution of the path metrics: mean, standard deviation and quantiles of each metric,
+    and the expected shortfall (mean of the worst paths) of the net return and impermanent loss at each tail level.
+    """
+    metrics      = pd.DataFrame({x: results[x] for x in PATH_METRICS})
+    distribution = metrics.quantile(quantiles)
+    distribution.index = ['q'+format(x,'g') for x in quantiles]
+    distribution = pd.concat([metrics.agg(['mean','std']),distribution])
+
+    tail = {}
+    for metric in ['net_return','impermanent_loss']:
+        values = np.sort(metrics[metric].to_numpy())
+        for level in tail_levels:
+            tail[(metric,'var_'+format(level,'g'))] = np.quantile(values,level)
+            tail[(metric,'es_'+format(level,'g'))]  = values[:max(1,int(math.floor(level*len(values))))].mean()
+    return {'paths':metrics,'distribution':distribution,'tail':pd.Series(tail)}
+
+
+def run_monte_carlo(strategy_in,price_data,swap_data,n_paths,n_steps,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                    model='bootstrap',block_size=1,seed=None,quantiles=PATH_QUANTILES,keep_values=False):
+    """
+    Monte Carlo risk evaluation of a ResetStrategy: n_paths synthetic paths of n_steps observations (at the spacing of price_data),
+    generated by model ('bootstrap' or 'ar_garch') from the historical price_data and swap_data and starting at the last price.
+    Returns the summarize_paths dict, with the paths themselves ('price_paths') and the per path results ('results').
+    """
+    steps = historical_steps(price_data,swap_data)
+    if   model == 'bootstrap':
+        paths = bootstrap_paths(steps,n_paths,n_steps,float(price_data.iloc[-1]),block_size=block_size,seed=seed)
+    elif model == 'ar_garch':
+        paths = ar_garch_paths(steps,n_paths,n_steps,float(price_data.iloc[-1]),seed=seed)
+    else:
+        raise ValueError('Unsupported model: '+str(model)+", use 'bootstrap' or 'ar_garch'")
+
+    results = simulate_reset_paths(paths,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,keep_values=keep_values)
+    output  = summarize_paths(results,quantiles)
+    output['price_paths'] = paths['price']
+    output['results']     = results
+    return output
@@ -0,0 +1,179 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+
+##############################################################
+# Columnar local data store for GetPoolData
+# Normalized tables are stored as Parquet files partitioned by pool and date:
+#     <root>/<table>/pool=<pool>/date=<YYYY-MM-DD>/part-0.parquet
+# Reads only touch the partitions of the requested pool and date range, project the requested
+# columns and push the time-range filter down to the Parquet row groups.
+# Requires pyarrow.
+# Incremental downloads keep a small JSON sync state per table and pool next to the tables:
+#     <root>/_sync/<table>/<pool>.json
+##############################################################
+
+STORE_ROOT  = './data/store'
+TIME_COLUMN = 'time_pd'
+
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([('pool',pa.string()),('date',pa.string())]),flavor='hive')
+
+
+def _utc_timestamp(value):
+    value = pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
+
+
+def table_path(table,root=STORE_ROOT):
+    return os.path.join(root,table)
+
+
+def has_table(table,pool,root=STORE_ROOT):
+    """
+    True if the store holds any data for this table and pool.
+    """
+    pool_path = os.path.join(table_path(table,root),'pool='+str(pool))
+    return os.path.isdir(pool_path) and len(os.listdir(pool_path)) > 0
+
+
+def normalize_columns(data,column_types):
+    """
+    Casts raw API columns (mostly strings from JSON) to typed columns.
+    column_types maps column name to a numpy/pandas dtype; missing columns are ignored.
+    """
+    data = data.copy()
+    for column,dtype in column_types.items():
+        if column in data.columns:
+            if dtype in ('float64','int64','int32'):
+                data[column] = pd.to_numeric(data[column]).astype(dtype)
+            else:
+                data[column] = data[column].astype(dtype)
+    return data
+
+
+def write_table(data,table,pool,root=STORE_ROOT,time_column=TIME_COLUMN,mode='overwrite'):
+    """
+    Writes a DataFrame to the store. data must have a tz-aware time column (or index) named time_column.
+    mode='overwrite' replaces the dates present in data for this pool; mode='append' adds new files next to existing ones.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if time_column not in data.columns:
+        data = data.reset_index()
+    if time_column not in data.columns:
+        raise ValueError('Data to store needs a '+time_column+' column or index')
+
+    data                 = data.sort_values(time_column,kind='stable').reset_index(drop=True)
+    data[time_column]    = pd.to_datetime(data[time_column],utc=True)
+    data['pool']         = str(pool)
+    # Format each distinct day once rather than every row
+    days,day_index       = np.unique(data[time_column].dt.tz_convert('UTC').dt.tz_localize(None).values.astype('datetime64[D]'),return_inverse=True)
+    data['date']         = days.astype(str).astype(object)[day_index]
+
+    arrow_table = pa.Table.from_pandas(data,preserve_index=False)
+    ds.write_dataset(arrow_table,table_path(table,root),format='parquet',partitioning=_partitioning(),
+                     basename_template='part-'+pd.Timestamp.now(tz='UTC').strftime('%Y%m%d%H%M%S%f')+'-{i}.parquet',
+                     existing_data_behavior='delete_matching' if mode == 'overwrite' else 'overwrite_or_ignore')
+
+
+def read_table(table,pool,date_begin=None,date_end=None,columns=None,root=STORE_ROOT,time_column=TIME_COLUMN):
+    """
+    Reads a pool's table from the store as a DataFrame indexed by time_column.
+    date_begin/date_end (inclusive, anything pd.Timestamp accepts, naive times are UTC) prune date partitions
+    and filter rows; a date_end given as a 'YYYY-MM-DD' string includes that whole day.
+    columns restricts the columns read from disk.
+    """
+    import pyarrow.dataset as ds
+
+    if not has_table(table,pool,root):
+        raise FileNotFoundError('No '+table+' data stored for '+str(pool)+' in '+root)
+
+    dataset    = ds.dataset(table_path(table,root),format='parquet',partitioning=_partitioning())
+    expression = ds.field('pool') == str(pool)
+
+    if date_begin is not None:
+        begin      = _utc_timestamp(date_begin)
+        expression = expression & (ds.field('date') >= begin.strftime('%Y-%m-%d')) & (ds.field(time_column) >= begin)
+    if date_end is not None:
+        end        = _utc_timestamp(date_end)
+        if isinstance(date_end,str) and len(date_end) == 10:
+            end    = end + pd.Timedelta(days=1) - pd.Timedelta(1,'ns')
+        expression = expression & (ds.field('date') <= end.strftime('%Y-%m-%d')) & (ds.field(time_column) <= end)
+
+    if columns is not None:
+        columns = [time_column] + [x for x in columns if x != time_column]
+
+    data = dataset.to_table(columns=columns,filter=expression).to_pandas()
+    data = data.drop(columns=[x for x in ['pool','date'] if x in data.columns])
+    data = data.sort_values(time_column,kind='stable').set_index(time_column)
+    return data
+
+
+def delete_dates(table,pool,date_begin,date_end,root=STORE_ROOT,time_column=TIME_COLUMN):
+    """
+    Removes the rows of a pool's table between date_begin and date_end (inclusive, as in read_table), before they are rewritten.
+    Date partitions inside the range are removed whole; on edge days that the range only covers in part,
+    the rows outside the range are kept and written back.
+    """
+    import shutil
+
+    pool_path = os.path.join(table_path(table,root),'pool='+str(pool))
+    if not os.path.isdir(pool_path):
+        return
+    begin = _utc_timestamp(date_begin)
+    end   = _utc_timestamp(date_end)
+    if isinstance(date_end,str) and len(date_end) == 10:
+        end = end + pd.Timedelta(days=1) - pd.Timedelta(1,'ns')
+
+    kept = []
+    for name in sorted(os.listdir(pool_path)):
+        if not name.startswith('date='):
+            continue
+        day_begin = pd.Timestamp(name[len('date='):],tz='UTC')
+        day_end   = day_begin + pd.Timedelta(days=1) - pd.Timedelta(1,'ns')
+        if day_end < begin or day_begin > end:
+            continue
+        if day_begin < begin or day_end > end:
+            rows = read_table(table,pool,day_begin,day_end,root=root,time_column=time_column)
+            kept.append(rows[(rows.index < begin) | (rows.index > end)])
+        shutil.rmtree(os.path.join(pool_path,name))
+
+    for rows in kept:
+        if len(rows) > 0:
+            write_table(rows,table,pool,root=root,time_column=time_column,mode='append')
+
+
+##############################################################
+# Sync state (high-water mark) for incremental downloads
+##############################################################
+
+def sync_state_path(table,pool,root=STORE_ROOT):
+    return os.path.join(root,'_sync',table,str(pool)+'.json')
+
+
+def read_sync_state(table,pool,root=STORE_ROOT):
+    """
+    Returns the sync state saved for this table and pool, or None if it was never synced incrementally.
+    """
+    path = sync_state_path(table,pool,root)
+    if not os.path.isfile(path):
+        return None
+    with open(path,'r') as input:
+        return json.load(input)
+
+
+def write_sync_state(state,table,pool,root=STORE_ROOT):
+    """
+    Saves the sync state atomically, so an interrupted write never leaves a truncated state behind.
+    """
+    path = sync_state_path(table,pool,root)
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path+'.tmp','w') as output:
+        json.dump(state,output)
+    os.replace(path+'.tmp',path)
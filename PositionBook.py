@@ -0,0 +1,190 @@
+import numpy as np
+import copy
+import UNI_v3_funcs
+
+##############################################################
+# Position book: any number of liquidity ranges in struct-of-arrays form
+# Every field of the ranges (lower_bin_tick, upper_bin_tick, position_liquidity, token_0, token_1 and any other a strategy
+# stores, eg. lower_bin_price) is one array with an element per range, so amounts, values, fees and removal of all the
+# ranges are computed in one call. A strategy can return a PositionBook as its liquidity_ranges (from set_liquidity_ranges
+# and check_strategy), and StrategyObservation then uses these calls instead of looping over the ranges.
+# The book also reads like the list of range dicts: len(book), book[i] (a dict copy of range i) and iteration, while
+# book['token_0'] is the array of a field. Ranges are modified through the arrays (book['position_liquidity'][i] = ...).
+##############################################################
+
+RANGE_FIELDS = ['lower_bin_tick','upper_bin_tick','position_liquidity','token_0','token_1']
+# Swaps x ranges evaluated at once by the fee calculations, bounding their memory
+FEE_CHUNK    = 2**20
+
+
+class PositionBook:
+    def __init__(self,lower_bin_tick,upper_bin_tick,position_liquidity,token_0=None,token_1=None,**columns):
+
+        n_ranges     = len(np.atleast_1d(lower_bin_tick))
+        self.columns = {'lower_bin_tick':     np.array(lower_bin_tick,dtype=np.int64,ndmin=1),
+                        'upper_bin_tick':     np.array(upper_bin_tick,dtype=np.int64,ndmin=1),
+                        'position_liquidity': np.array(position_liquidity,dtype=float,ndmin=1),
+                        'token_0':            np.zeros(n_ranges) if token_0 is None else np.array(token_0,dtype=float,ndmin=1),
+                        'token_1':            np.zeros(n_ranges) if token_1 is None else np.array(token_1,dtype=float,ndmin=1)}
+        for name,values in columns.items():
+            self.columns[name] = np.array(values,ndmin=1) if np.ndim(values) > 0 else np.full(n_ranges,values)
+        if any(len(values) != n_ranges for values in self.columns.values()):
+            raise ValueError('Every field of a PositionBook needs one value per range')
+
+    @classmethod
+    def from_ranges(cls,liquidity_ranges):
+        """
+        Book of a list of range dicts (a PositionBook is returned as is).
+        """
+        if isinstance(liquidity_ranges,PositionBook):
+            return liquidity_ranges
+        names = list(dict.fromkeys(name for position in liquidity_ranges for name in position))
+        data  = {name: [position.get(name,np.nan) for position in liquidity_ranges] for name in names}
+        for name in RANGE_FIELDS[3:]:
+            data.setdefault(name,np.zeros(len(liquidity_ranges)))
+        return cls(**data)
+
+    @classmethod
+    def from_amounts(cls,tick,lower_bin_tick,upper_bin_tick,amount_0,amount_1,decimals_0,decimals_1,**columns):
+        """
+        Places amount_0 and amount_1 of each range (arrays, eg. a ladder of bands) at the current tick: the liquidity they
+        provide, with the amounts actually deposited.
+        """
+        liquidity       = UNI_v3_funcs.get_liquidity_array(tick,np.asarray(lower_bin_tick),np.asarray(upper_bin_tick),amount_0,amount_1,decimals_0,decimals_1)
+        token_0,token_1 = UNI_v3_funcs.get_amounts_array(tick,np.asarray(lower_bin_tick),np.asarray(upper_bin_tick),liquidity,decimals_0,decimals_1)
+        return cls(lower_bin_tick,upper_bin_tick,liquidity,token_0,token_1,**columns)
+
+    def __len__(self):
+        return len(self.columns['lower_bin_tick'])
+
+    def __getitem__(self,key):
+        if isinstance(key,str):
+            return self.columns[key]
+        return {name: values[key].item() if hasattr(values[key],'item') else values[key] for name,values in self.columns.items()}
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __contains__(self,name):
+        return name in self.columns
+
+    def copy(self):
+        book         = PositionBook.__new__(PositionBook)
+        book.columns = {name: values.copy() for name,values in self.columns.items()}
+        return book
+
+    def __deepcopy__(self,memo):
+        book         = PositionBook.__new__(PositionBook)
+        book.columns = {name: (values.copy() if values.dtype != object else copy.deepcopy(values,memo)) for name,values in self.columns.items()}
+        return book
+
+    def to_ranges(self):
+        """
+        The ranges as a list of dicts.
+        """
+        return list(self)
+
+    ########################################################
+    # Amounts and value of every range
+    ########################################################
+
+    def amounts(self,tick,decimals_0,decimals_1):
+        """
+        Token amounts of every range at the current tick: arrays with one element per range, or (n_ranges, n_ticks) for an array of ticks.
+        """
+        tick = np.asarray(tick)
+        if tick.ndim > 0:
+            tick = tick[np.newaxis,:]
+            return UNI_v3_funcs.get_amounts_array(tick,self.columns['lower_bin_tick'][:,np.newaxis],self.columns['upper_bin_tick'][:,np.newaxis],
+                                                  self.columns['position_liquidity'][:,np.newaxis],decimals_0,decimals_1)
+        return UNI_v3_funcs.get_amounts_array(tick,self.columns['lower_bin_tick'],self.columns['upper_bin_tick'],
+                                              self.columns['position_liquidity'],decimals_0,decimals_1)
+
+    def update_amounts(self,tick,decimals_0,decimals_1):
+        self.columns['token_0'],self.columns['token_1'] = self.amounts(tick,decimals_0,decimals_1)
+
+    def value_in_token_0(self,price):
+        """
+        Value of every range in token 0 at price (from token_0 and token_1).
+        """
+        return self.columns['token_0'] + self.columns['token_1'] / price
+
+    def value_in_token_1(self,price):
+        return self.columns['token_0'] * price + self.columns['token_1']
+
+    def totals(self):
+        """
+        Tokens held in all the ranges.
+        """
+        return self.columns['token_0'].sum(),self.columns['token_1'].sum()
+
+    ########################################################
+    # Fees earned by the ranges
+    # As StrategyObservation.accrue_fees: a swap pays a range the fee tier times the range's share of the liquidity
+    # while the swap tick is inside the range, swaps without a liquidity value pay nothing
+    ########################################################
+
+    def swap_fees(self,tick_swap,token_0_in,virtual_liquidity,traded_in,fee_tier):
+        """
+        Fees in token 0 and token 1 paid by each swap to all the ranges (arrays with one element per swap).
+        """
+        fees_0 = np.zeros(len(tick_swap))
+        fees_1 = np.zeros(len(tick_swap))
+        for swaps in self.swap_chunks(len(tick_swap)):
+            fees          = self.fee_matrix(tick_swap[swaps],virtual_liquidity[swaps],traded_in[swaps],fee_tier).sum(axis=0)
+            fees_0[swaps] = np.where(token_0_in[swaps],fees,0.0)
+            fees_1[swaps] = np.where(token_0_in[swaps],0.0,fees)
+        return fees_0,fees_1
+
+    def range_fees(self,tick_swap,token_0_in,virtual_liquidity,traded_in,fee_tier):
+        """
+        Fees in token 0 and token 1 earned by each range over the swaps (arrays with one element per range).
+        """
+        fees_0 = np.zeros(len(self))
+        fees_1 = np.zeros(len(self))
+        for swaps in self.swap_chunks(len(tick_swap)):
+            fees    = self.fee_matrix(tick_swap[swaps],virtual_liquidity[swaps],traded_in[swaps],fee_tier)
+            token_0 = np.asarray(token_0_in[swaps],dtype=bool)
+            fees_0 += fees[:,token_0].sum(axis=1)
+            fees_1 += fees[:,~token_0].sum(axis=1)
+        return fees_0,fees_1
+
+    def swap_chunks(self,n_swaps):
+        step = max(1,FEE_CHUNK // max(1,len(self)))
+        return [slice(start,start + step) for start in range(0,n_swaps,step)]
+
+    def fee_matrix(self,tick_swap,virtual_liquidity,traded_in,fee_tier):
+        """
+        Fees paid by each swap to each range (n_ranges, n_swaps), in the token swapped in.
+        """
+        liquidity = self.columns['position_liquidity'][:,np.newaxis]
+        in_range  = (self.columns['lower_bin_tick'][:,np.newaxis] <= tick_swap) & (self.columns['upper_bin_tick'][:,np.newaxis] >= tick_swap)
+        fees      = in_range * fee_tier * liquidity/(liquidity + virtual_liquidity) * traded_in
+        return np.where(np.isnan(fees),0.0,fees)
+
+    ########################################################
+    # Remove liquidity
+    ########################################################
+
+    def remove(self,tick,decimals_0,decimals_1,ranges=None):
+        """
+        Withdraws the liquidity of the selected ranges (indices or a boolean mask, all of them by default) at the current tick.
+        Returns the token 0 and token 1 removed.
+        """
+        selected          = np.ones(len(self),dtype=bool) if ranges is None else np.zeros(len(self),dtype=bool)
+        if ranges is not None:
+            selected[ranges] = True
+        amount_0,amount_1 = self.amounts(tick,decimals_0,decimals_1)
+        self.columns['position_liquidity'][selected] = 0.0
+        self.columns['token_0'][selected]            = 0.0
+        self.columns['token_1'][selected]            = 0.0
+        return amount_0[selected].sum(),amount_1[selected].sum()
+
+
+def range_totals(liquidity_ranges):
+    """
+    Tokens held in all the ranges, of a list of range dicts or a PositionBook.
+    """
+    if isinstance(liquidity_ranges,PositionBook):
+        return liquidity_ranges.totals()
+    return sum(x['token_0'] for x in liquidity_ranges),sum(x['token_1'] for x in liquidity_ranges)
@@ -0,0 +1,198 @@
+import pandas as pd
+import hashlib
+import functools
+import inspect
+import threading
+import json
+import time
+import os
+
+##############################################################
+# Query-keyed local cache for the GetPoolData fetchers
+# Results are stored as Parquet files named by a fingerprint of the normalized query
+# (source, lower-cased addresses, network, UTC date range, block_start, ...), so identical queries
+# are served from disk whatever file_name the caller picked.
+# Queries that reach into recent data expire after a TTL, historical ones never do, and the least
+# recently used entries are evicted once the cache grows past max_bytes.
+##############################################################
+
+CACHE_ROOT     = './data/cache'
+MAX_BYTES      = 5*10**9
+TTL            = 3600                 # seconds a query touching recent data stays valid
+RECENT_WINDOW  = pd.Timedelta('2D')   # a query is recent if its date_end is within this window of now
+
+
+def normalize_parameter(name,value):
+    """
+    Normalizes a query parameter so equivalent queries get the same fingerprint.
+    """
+    if isinstance(value,(list,tuple)):
+        return [normalize_parameter(name,x) for x in value]
+    if value is None or isinstance(value,bool):
+        return value
+    if name.startswith('date'):
+        timestamp = pd.Timestamp(value)
+        return (timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')).isoformat()
+    if isinstance(value,str):
+        return value.lower() if value.startswith('0x') else value
+    if isinstance(value,(int,float)):
+        return int(value) if float(value).is_integer() else float(value)
+    return str(value)
+
+
+def fingerprint(source,parameters):
+    """
+    sha256 of the source name and normalized parameters.
+    """
+    normalized = {name: normalize_parameter(name,value) for name,value in parameters.items()}
+    return hashlib.sha256(json.dumps([source,normalized],sort_keys=True).encode()).hexdigest()
+
+
+class QueryCache:
+    def __init__(self,root=CACHE_ROOT,max_bytes=MAX_BYTES,ttl=TTL,recent_window=RECENT_WINDOW):
+
+        self.root          = root
+        self.max_bytes     = max_bytes
+        self.ttl           = ttl
+        self.recent_window = pd.Timedelta(recent_window)
+        self.lock          = threading.Lock()
+        self.counts        = {'hits':0,'misses':0,'expired':0,'evictions':0,'uncacheable':0}
+        self.index_path    = os.path.join(root,'index.json')
+        self.index         = {}
+        if os.path.isfile(self.index_path):
+            with open(self.index_path,'r') as input:
+                self.index = json.load(input)
+
+    def data_path(self,key):
+        return os.path.join(self.root,key+'.parquet')
+
+    def save_index(self):
+        os.makedirs(self.root,exist_ok=True)
+        with open(self.index_path+'.tmp','w') as output:
+            json.dump(self.index,output)
+        os.replace(self.index_path+'.tmp',self.index_path)
+
+    def remove(self,key):
+        self.index.pop(key,None)
+        if os.path.isfile(self.data_path(key)):
+            os.remove(self.data_path(key))
+
+    def get(self,key):
+        """
+        Cached DataFrame for key, or None if it is missing or expired.
+        """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None or not os.path.isfile(self.data_path(key)):
+                self.counts['misses'] += 1
+                return None
+            if entry['expires'] is not None and entry['expires'] < time.time():
+                self.remove(key)
+                self.save_index()
+                self.counts['expired'] += 1
+                self.counts['misses']  += 1
+                return None
+            entry['last_access'] = time.time()
+            self.save_index()
+            self.counts['hits'] += 1
+        return pd.read_parquet(self.data_path(key))
+
+    def put(self,key,data,source,parameters,date_end=None):
+        """
+        Stores data under key. It expires after ttl if date_end is missing or within recent_window of now.
+        """
+        recent = date_end is None or pd.Timestamp(normalize_parameter('date_end',date_end)) >= pd.Timestamp.now(tz='UTC') - self.recent_window
+        with self.lock:
+            os.makedirs(self.root,exist_ok=True)
+            try:
+                data.to_parquet(self.data_path(key))
+            except Exception:
+                # Columns Parquet can not hold (eg. mixed Python objects) are not cached
+                self.counts['uncacheable'] += 1
+                if os.path.isfile(self.data_path(key)):
+                    os.remove(self.data_path(key))
+                return
+            self.index[key] = {'source':      source,
+                               'parameters':  {name: normalize_parameter(name,value) for name,value in parameters.items()},
+                               'created':     time.time(),
+                               'last_access': time.time(),
+                               'expires':     time.time() + self.ttl if recent else None,
+                               'bytes':       os.path.getsize(self.data_path(key))}
+            self.evict()
+            self.save_index()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes.
+        """
+        by_access = sorted(self.index,key=lambda x: self.index[x]['last_access'])
+        total     = sum(entry['bytes'] for entry in self.index.values())
+        for key in by_access:
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]['bytes']
+            self.remove(key)
+            self.counts['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.index):
+                self.remove(key)
+            self.save_index()
+
+    def stats(self):
+        """
+        Hit/miss counters of this session, plus the number of entries and bytes held.
+        """
+        with self.lock:
+            requests = self.counts['hits'] + self.counts['misses']
+            return dict(self.counts,
+                        hit_rate = self.counts['hits']/requests if requests > 0 else None,
+                        entries  = len(self.index),
+                        bytes    = sum(entry['bytes'] for entry in self.index.values()))
+
+
+DEFAULT_CACHE = None
+
+
+def default_cache():
+    """
+    Cache used by the fetchers when none is given.
+    """
+    global DEFAULT_CACHE
+    if DEFAULT_CACHE is None:
+        DEFAULT_CACHE = QueryCache()
+    return DEFAULT_CACHE
+
+
+def cached_query(source,key_arguments,date_end_argument=None,opt_in=False):
+    """
+    Decorator that serves a fetcher from the cache, keyed by the fingerprint of its key_arguments.
+    The wrapped function takes an extra cache argument: True or None uses default_cache(), False bypasses the cache,
+    or a QueryCache to use instead.
+    Calls with DOWNLOAD_DATA=False (reading the local data store) or INCREMENTAL=True (refreshing it) bypass the cache.
+    A result served from the cache is returned as is, the fetcher's own data store writes are not repeated. Fetchers that
+    write the data store under a file_name are therefore decorated with opt_in: they only use the cache when cache is given,
+    since a hit leaves nothing under file_name for a later DOWNLOAD_DATA=False call to read.
+    """
+    def decorate(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args,cache=None,**kwargs):
+            arguments = signature.bind(*args,**kwargs)
+            arguments.apply_defaults()
+            arguments = arguments.arguments
+            if cache is False or (cache is None and opt_in) or not arguments.get('DOWNLOAD_DATA',True) or arguments.get('INCREMENTAL',False):
+                return function(*args,**kwargs)
+
+            cache      = default_cache() if cache is None or cache is True else cache
+            parameters = {name: arguments[name] for name in key_arguments}
+            key        = fingerprint(source,parameters)
+            data       = cache.get(key)
+            if data is None:
+                data = function(*args,**kwargs)
+                cache.put(key,data,source,parameters,None if date_end_argument is None else arguments[date_end_argument])
+            return data
+        return wrapper
+    return decorate
@@ -1,20 +1,118 @@
 import pandas as pd
 import numpy as np
 import math
-from statsmodels.distributions.empirical_distribution import ECDF, monotone_fn_inverter
 import UNI_v3_funcs
+import SwapDataset
+import PositionBook
 import copy
 
+########################################################
+# Empirical quantile function
+# Inverts the ECDF of returns by linear interpolation over an evenly spaced grid of returns, evaluated for any number of
+# probabilities at once. The ECDF is flat between returns, so many grid points share a level: the quantile at p interpolates
+# between the last grid point where the ECDF is below p and the first grid point where it reaches p. statsmodels'
+# monotone_fn_inverter (used before) interpolates over the grid points sorted by level, which picks other points inside
+# flat steps, so quantiles can differ from it by a few grid steps.
+########################################################
+
+def build_quantile_table(returns,n_grid=1000):
+    """
+    Evaluates the ECDF of returns on n_grid evenly spaced points between the minimum and maximum return.
+    Returns (cdf_grid, return_grid), the table used by interpolate_quantiles.
+    """
+    sorted_returns = np.sort(np.asarray(returns,dtype=float))
+    sorted_returns = sorted_returns[~np.isnan(sorted_returns)]
+    n_obs          = len(sorted_returns)
+    if n_obs == 0:
+        raise ValueError('No returns to build the empirical distribution from')
+
+    return_grid    = np.linspace(sorted_returns[0],sorted_returns[-1],n_grid)
+    ecdf_levels    = np.r_[0.0,np.linspace(1./n_obs,1,n_obs)]
+    cdf_grid       = ecdf_levels[np.searchsorted(sorted_returns,return_grid,side='right')]
+    return cdf_grid,return_grid
+
+def interpolate_quantiles(probabilities,cdf_grid,return_grid):
+    """
+    Vectorized inverse of the ECDF stored in (cdf_grid, return_grid) for an array of probabilities.
+    A probability equal to the level of a flat step of the ECDF maps to the first grid point where the ECDF reaches it.
+    """
+    probabilities = np.asarray(probabilities,dtype=float)
+    if np.any(probabilities < cdf_grid[0]) or np.any(probabilities > cdf_grid[-1]):
+        raise ValueError('Probabilities must be between '+str(cdf_grid[0])+' and '+str(cdf_grid[-1]))
+
+    # First grid point where the ECDF reaches each probability, and the grid point before it
+    upper         = np.clip(np.searchsorted(cdf_grid,probabilities,side='left'),1,len(cdf_grid)-1)
+    lower         = upper - 1
+    # The segment only has zero width for probabilities at the level of the first grid point, which map to that point
+    width         = cdf_grid[upper] - cdf_grid[lower]
+    weight        = np.divide(probabilities - cdf_grid[lower],width,out=np.zeros(np.broadcast(probabilities,width).shape),where=width > 0)
+    return return_grid[lower] + weight * (return_grid[upper] - return_grid[lower])
+
 class ResetStrategy:
-    def __init__(self,model_data,alpha_param,tau_param,limit_parameter):
+    def __init__(self,model_data,alpha_param,tau_param,limit_parameter,return_distribution=None):
     
         self.alpha_param            = alpha_param
         self.tau_param              = tau_param
         self.limit_parameter        = limit_parameter
+        
+        # Optional ReturnDistribution.OnlineReturnDistribution, seeded with the model returns
+        # and updated with every observed price, instead of the fixed ECDF
+        self.return_distribution    = return_distribution
+        
+        if self.return_distribution is None:
+            self.cdf_grid,self.return_grid = build_quantile_table(model_data['price_return'].to_numpy())
+        else:
+            self.return_distribution.add_returns(model_data['price_return'].to_numpy())
+            if len(model_data) > 0:
+                self.return_distribution.update(model_data.index[-1],model_data['quotePrice'].iloc[-1])
+        
+        # Quantiles are fixed for the model, compute them once for the reset and base ranges
+        self.reset_quantiles        = self.central_quantiles(self.tau_param)
+        self.base_quantiles         = self.central_quantiles(self.alpha_param)
+        
+    def inverse_ecdf(self,probabilities):
+        if self.return_distribution is None:
+            return interpolate_quantiles(probabilities,self.cdf_grid,self.return_grid)
+        else:
+            return self.return_distribution.quantile(probabilities)
+        
+    def observe_price(self,current_strat_obs):
+        """
+        Feeds the observed price to the online return distribution, if the strategy uses one.
+        """
+        if self.return_distribution is not None:
+            self.return_distribution.update(current_strat_obs.time,current_strat_obs.price)
     
-        ecdf                         = ECDF(model_data['price_return'].to_numpy())
-        self.inverse_ecdf            = monotone_fn_inverter(ecdf,np.linspace(model_data['price_return'].min(),model_data['price_return'].max(),1000),vectorized=False)
+    def central_quantiles(self,coverage):
+        """
+        Lower and upper return quantiles of the central interval with the given coverage (eg. alpha_param or tau_param).
+        Accepts an array of coverages to sweep many parameters at once.
+        """
+        coverage = np.asarray(coverage,dtype=float)
+        return self.inverse_ecdf((1 - coverage)/2),self.inverse_ecdf(1 - (1 - coverage)/2)
         
+    #####################################
+    # Triggers of check_strategy for StrategyRules.simulate_rules, evaluated over blocks of observations
+    # An online return distribution observes every price, so the strategy is then checked on every observation
+    #####################################
+
+    def triggers(self):
+        if self.return_distribution is not None:
+            return None
+        return {'exited_range':    self.exited_range,
+                'limit_imbalance': self.limit_imbalance}
+
+    def exited_range(self,block):
+        return (block.price < block.strategy_info['reset_range_lower']) | (block.price > block.strategy_info['reset_range_upper'])
+
+    def limit_imbalance(self,block):
+        # Limit position holds both tokens only while the price is inside it
+        limit_ticks   = sorted([block.liquidity_ranges[1]['lower_bin_tick'],block.liquidity_ranges[1]['upper_bin_tick']])
+        in_limit      = (block.liquidity_ranges[1]['position_liquidity'] > 0) & (block.tick >= limit_ticks[0]) & (block.tick <= limit_ticks[1])
+        limit_balance = block.token_0[1] + block.token_1[1]*block.price
+        base_balance  = block.token_0[0] + block.token_1[0]*block.price
+        return in_limit & ((base_balance <= 0.0) | block.greater(limit_balance,(1+self.limit_parameter)*base_balance))
+
     #####################################
     # Check if a rebalance is necessary. 
     # If it is, remove the liquidity and set new ranges
@@ -31,6 +129,8 @@ class ResetStrategy:
         #
         #####################################
         
+        self.observe_price(current_strat_obs)
+        
         LEFT_RANGE_LOW      = current_strat_obs.price < current_strat_obs.strategy_info['reset_range_lower']
         LEFT_RANGE_HIGH     = current_strat_obs.price > current_strat_obs.strategy_info['reset_range_upper']
         LIMIT_ORDER_BALANCE = current_strat_obs.liquidity_ranges[1]['token_0'] + current_strat_obs.liquidity_ranges[1]['token_1']*current_strat_obs.price
@@ -81,13 +181,19 @@ class ResetStrategy:
             strategy_info_here = dict()
         else:
             strategy_info_here = copy.deepcopy(current_strat_obs.strategy_info)
+        
+        # With an online return distribution the quantiles follow the latest returns
+        if self.return_distribution is not None:
+            self.observe_price(current_strat_obs)
+            self.reset_quantiles  = self.central_quantiles(self.tau_param)
+            self.base_quantiles   = self.central_quantiles(self.alpha_param)
             
-        strategy_info_here['reset_range_lower']     = (1 + self.inverse_ecdf((1 -      self.tau_param)/2))    * current_strat_obs.price
-        strategy_info_here['reset_range_upper']     = (1 + self.inverse_ecdf( 1 - (1 - self.tau_param)/2))    * current_strat_obs.price
+        strategy_info_here['reset_range_lower']     = (1 + self.reset_quantiles[0])    * current_strat_obs.price
+        strategy_info_here['reset_range_upper']     = (1 + self.reset_quantiles[1])    * current_strat_obs.price
 
         # Set the base range
-        base_range_lower      = (1 + self.inverse_ecdf((1 -      self.alpha_param)/2))  * current_strat_obs.price
-        base_range_upper      = (1 + self.inverse_ecdf( 1 - (1 - self.alpha_param)/2))  * current_strat_obs.price
+        base_range_lower      = (1 + self.base_quantiles[0])  * current_strat_obs.price
+        base_range_upper      = (1 + self.base_quantiles[1])  * current_strat_obs.price
 
         save_ranges                = []
         
@@ -244,4 +350,179 @@ class ResetStrategy:
             this_data['base_position_value_in_token_0']    = strategy_observation.liquidity_ranges[0]['token_0'] + strategy_observation.liquidity_ranges[0]['token_1'] / this_data['price']
             this_data['limit_position_value_in_token_0']   = strategy_observation.liquidity_ranges[1]['token_0'] + strategy_observation.liquidity_ranges[1]['token_1'] / this_data['price']
              
-            return this_data
\ No newline at end of file
+            return this_data
+
+########################################################
+# Fast backtest for the ResetStrategy
+# Between resets the positions are fixed, so the next reset is the first observation where the price leaves the
+# reset range or the limit position becomes imbalanced. Both are evaluated over blocks of the price array at once,
+# and fees for every observation of a holding period are computed in bulk from cumulative sums over the swaps.
+# Returns a DataFrame with one row of dict_components per observation, which can be passed to
+# ActiveStrategyFramework.generate_simulation_series in place of the list of observations.
+########################################################
+
+FIRST_PASSAGE_BLOCK = 256
+
+def simulate_reset_strategy(price_data,swap_data,strategy_in,
+                            liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1):
+
+    import ActiveStrategyFramework
+
+    ActiveStrategyFramework.validate_simulation_inputs(price_data,swap_data,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1)
+    if strategy_in.return_distribution is not None:
+        raise ValueError('The fast backtest requires fixed quantiles, use simulate_strategy with an online return distribution')
+
+    times          = price_data.index
+    prices         = np.asarray(price_data,dtype=float)
+    n_obs          = len(prices)
+    tick_current   = np.floor(np.log(10**(decimals_1 - decimals_0)*prices)/math.log(1.0001))
+
+    # swap_data is a DataFrame or SwapDataset.SwapArrays, memory-mapped columns are used in place
+    swap_times     = SwapDataset.swap_times(swap_data)
+    swap_ticks,swap_token_0,swap_virtual,swap_traded = SwapDataset.fee_columns(swap_data)
+    swap_ticks     = swap_ticks.astype(float)
+
+    # Swaps between consecutive observations, both ends included as in simulate_strategy
+    times_ns       = SwapDataset.time_ns(times)
+    swap_start     = np.searchsorted(swap_times,times_ns[:-1],side='left')
+    swap_end       = np.searchsorted(swap_times,times_ns[1:], side='right')
+
+    # Per observation outputs
+    columns_float  = ['base_range_lower','base_range_upper','limit_range_lower','limit_range_upper','reset_range_lower','reset_range_upper',
+                      'price_at_reset','token_0_fees','token_1_fees','token_0_fees_uncollected','token_1_fees_uncollected',
+                      'token_0_left_over','token_1_left_over','base_0','base_1','limit_0','limit_1']
+    out            = {x: np.zeros(n_obs) for x in columns_float}
+    reset_point    = np.zeros(n_obs,dtype=bool)
+    reset_reason   = np.full(n_obs,'',dtype=object)
+
+    def store_reset_row(i,observation):
+        row = strategy_in.dict_components(observation)
+        for column in columns_float[:13]:
+            out[column][i] = row[column]
+        out['base_0'][i]  = observation.liquidity_ranges[0]['token_0']
+        out['base_1'][i]  = observation.liquidity_ranges[0]['token_1']
+        out['limit_0'][i] = observation.liquidity_ranges[1]['token_0']
+        out['limit_1'][i] = observation.liquidity_ranges[1]['token_1']
+        reset_point[i]    = observation.reset_point
+        reset_reason[i]   = observation.reset_reason
+
+    observation = ActiveStrategyFramework.StrategyObservation(times[0],prices[0],strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1)
+    store_reset_row(0,observation)
+
+    last_reset = 0
+    block      = FIRST_PASSAGE_BLOCK
+    while last_reset < n_obs - 1:
+        ranges      = observation.liquidity_ranges
+        info        = observation.strategy_info
+        base_ticks  = sorted([ranges[0]['lower_bin_tick'],ranges[0]['upper_bin_tick']])
+        limit_ticks = sorted([ranges[1]['lower_bin_tick'],ranges[1]['upper_bin_tick']])
+
+        #####################################
+        # 1. First passage: find the next observation that triggers a reset (check_strategy's conditions)
+        #####################################
+        next_reset = n_obs
+        search     = last_reset + 1
+        while search < n_obs and next_reset == n_obs:
+            stop      = min(n_obs,search + block)
+            p         = prices[search:stop]
+            tc        = tick_current[search:stop]
+            left      = (p < info['reset_range_lower']) | (p > info['reset_range_upper'])
+
+            # Limit position holds both tokens only while the price is strictly inside it
+            limit_rebalance = np.zeros(len(p),dtype=bool)
+            both            = (ranges[1]['position_liquidity'] > 0) & (tc > limit_ticks[0]) & (tc < limit_ticks[1])
+            if both.any():
+                limit_0,limit_1 = UNI_v3_funcs.get_amounts_array(tc[both],limit_ticks[0],limit_ticks[1],ranges[1]['position_liquidity'],decimals_0,decimals_1)
+                base_0,base_1   = UNI_v3_funcs.get_amounts_array(tc[both],base_ticks[0],base_ticks[1],ranges[0]['position_liquidity'],decimals_0,decimals_1)
+                limit_balance   = limit_0 + limit_1*p[both]
+                base_balance    = base_0  + base_1*p[both]
+                limit_similar   = ((limit_0/limit_1) >= strategy_in.limit_parameter) | ((limit_0/limit_1) <= (strategy_in.limit_parameter+1))
+                ratio           = np.divide(limit_balance,base_balance,out=np.zeros(len(base_balance)),where=base_balance > 0.0)
+                limit_rebalance[both] = np.where(base_balance > 0.0,(ratio > (1+strategy_in.limit_parameter)) & limit_similar,limit_similar)
+
+            trigger = left | limit_rebalance
+            if trigger.any():
+                next_reset = search + int(np.argmax(trigger))
+            search = stop
+            block  = block * 2
+
+        # Next search starts with a block sized on this holding period
+        block = max(FIRST_PASSAGE_BLOCK,next_reset - last_reset)
+
+        #####################################
+        # 2. Bulk fees and position amounts for every observation of the holding period
+        #####################################
+        last_row = min(next_reset,n_obs - 1)
+        steps    = slice(last_reset + 1,last_row + 1)
+
+        first_swap = swap_start[last_reset]
+        last_swap  = swap_end[last_row - 1]
+        swap_slice = slice(first_swap,last_swap)
+        fees_0,fees_1 = PositionBook.PositionBook.from_ranges(ranges).swap_fees(swap_ticks[swap_slice],swap_token_0[swap_slice],
+                                                                                swap_virtual[swap_slice],swap_traded[swap_slice],fee_tier)
+
+        cumulative_0 = np.r_[0.0,np.cumsum(fees_0)]
+        cumulative_1 = np.r_[0.0,np.cumsum(fees_1)]
+        step_start   = swap_start[last_reset:last_row] - first_swap
+        step_end     = swap_end[last_reset:last_row]   - first_swap
+        out['token_0_fees'][steps] = cumulative_0[step_end] - cumulative_0[step_start]
+        out['token_1_fees'][steps] = cumulative_1[step_end] - cumulative_1[step_start]
+        out['token_0_fees_uncollected'][steps] = np.cumsum(out['token_0_fees'][steps])
+        out['token_1_fees_uncollected'][steps] = np.cumsum(out['token_1_fees'][steps])
+
+        out['base_0'][steps],out['base_1'][steps]   = UNI_v3_funcs.get_amounts_array(tick_current[steps],ranges[0]['lower_bin_tick'],ranges[0]['upper_bin_tick'],
+                                                                                     ranges[0]['position_liquidity'],decimals_0,decimals_1)
+        out['limit_0'][steps],out['limit_1'][steps] = UNI_v3_funcs.get_amounts_array(tick_current[steps],ranges[1]['lower_bin_tick'],ranges[1]['upper_bin_tick'],
+                                                                                     ranges[1]['position_liquidity'],decimals_0,decimals_1)
+        for column,value in [('base_range_lower',ranges[0]['lower_bin_price']),('base_range_upper',ranges[0]['upper_bin_price']),
+                             ('limit_range_lower',ranges[1]['lower_bin_price']),('limit_range_upper',ranges[1]['upper_bin_price']),
+                             ('reset_range_lower',info['reset_range_lower']),('reset_range_upper',info['reset_range_upper']),
+                             ('price_at_reset',ranges[0]['price']),
+                             ('token_0_left_over',observation.token_0_left_over),('token_1_left_over',observation.token_1_left_over)]:
+            out[column][steps] = value
+
+        #####################################
+        # 3. Reset: remove liquidity with the exact liquidity math and place new ranges
+        #####################################
+        if next_reset < n_obs:
+            removed_0 = 0.0
+            removed_1 = 0.0
+            for position in ranges:
+                amount_0,amount_1 = UNI_v3_funcs.get_amounts(int(tick_current[next_reset]),position['lower_bin_tick'],position['upper_bin_tick'],
+                                                             position['position_liquidity'],decimals_0,decimals_1)
+                removed_0 += amount_0
+                removed_1 += amount_1
+
+            exited      = (prices[next_reset] < info['reset_range_lower']) | (prices[next_reset] > info['reset_range_upper'])
+            observation = ActiveStrategyFramework.StrategyObservation(times[next_reset],prices[next_reset],strategy_in,
+                                                    removed_0 + observation.token_0_left_over + out['token_0_fees_uncollected'][next_reset],
+                                                    removed_1 + observation.token_1_left_over + out['token_1_fees_uncollected'][next_reset],
+                                                    fee_tier,decimals_0,decimals_1,strategy_info=info)
+            observation.reset_point  = True
+            observation.reset_reason = 'exited_range' if exited else 'limit_imbalance'
+            observation.token_0_fees = out['token_0_fees'][next_reset]
+            observation.token_1_fees = out['token_1_fees'][next_reset]
+            store_reset_row(next_reset,observation)
+
+        last_reset = next_reset
+
+    #####################################
+    # Assemble the same columns as dict_components
+    #####################################
+    data_strategy = pd.DataFrame({'time': times, 'price': prices, 'reset_point': reset_point, 'reset_reason': reset_reason})
+    for column in columns_float[:13]:
+        data_strategy[column] = out[column]
+    data_strategy['token_0_left_over']  = out['token_0_left_over']
+    data_strategy['token_1_left_over']  = out['token_1_left_over']
+    data_strategy['token_0_allocated']  = 0.0 + out['base_0'] + out['limit_0']
+    data_strategy['token_1_allocated']  = 0.0 + out['base_1'] + out['limit_1']
+    data_strategy['token_0_total']      = data_strategy['token_0_allocated'] + data_strategy['token_0_left_over'] + data_strategy['token_0_fees_uncollected']
+    data_strategy['token_1_total']      = data_strategy['token_1_allocated'] + data_strategy['token_1_left_over'] + data_strategy['token_1_fees_uncollected']
+
+    data_strategy['value_position_in_token_0']       = data_strategy['token_0_total']     + data_strategy['token_1_total']     / data_strategy['price']
+    data_strategy['value_allocated_in_token_0']      = data_strategy['token_0_allocated'] + data_strategy['token_1_allocated'] / data_strategy['price']
+    data_strategy['value_left_over_in_token_0']      = data_strategy['token_0_left_over'] + data_strategy['token_1_left_over'] / data_strategy['price']
+    data_strategy['base_position_value_in_token_0']  = out['base_0']  + out['base_1']  / prices
+    data_strategy['limit_position_value_in_token_0'] = out['limit_0'] + out['limit_1'] / prices
+
+    return data_strategy
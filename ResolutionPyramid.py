@@ -0,0 +1,136 @@
+import pandas as pd
+import PoolDataStore
+
+##############################################################
+# Pre-aggregated multi-resolution price and swap pyramids
+# The price (or swap) table of a pool in PoolDataStore is aggregated once to every frequency of the pyramid
+# (1 minute -> 5 minutes -> 1 hour -> 1 day) and each level is stored next to the raw data as its own table:
+#     <table>_<kind>_<frequency>, eg. 1min_price_H or swap_bigquery_swap_D
+# Updates only recompute the days from the last stored day onwards, so a request for any frequency is a read.
+# Levels are aggregated as ActiveStrategyFramework's aggregate_price_data / aggregate_swap_data do:
+#     prices: last price (forward filled) with open/high/low, swaps: summed amounts and median virtual liquidity (forward filled)
+##############################################################
+
+# Pyramid frequencies and their resample rule, from the finest level
+LEVELS        = {'M':'1min','5M':'5min','H':'1h','D':'1D'}
+PRICE_COLUMNS = ['quotePrice','price_open','price_high','price_low']
+SWAP_COLUMNS  = ['amount0_adj','amount1_adj','virtual_liquidity_adj']
+
+
+def pyramid_table(table,kind,frequency):
+    return table+'_'+kind+'_'+frequency
+
+
+def price_levels(price_data,last_price=None,start=None):
+    """
+    Aggregates prices (a time indexed quotePrice column) to every level of the pyramid.
+    last_price is the price before the first row, used to fill the minutes before the first price.
+    start (a minute) makes every level begin there even if the first price comes later, as when updating a stored day.
+    Each level is aggregated from the one below it: last, first, max and min of last, first, max and min are exact.
+    """
+    minutes                = price_data['quotePrice'].resample(LEVELS['M'])
+    level                  = pd.DataFrame({'quotePrice':minutes.last(),'price_open':minutes.first(),'price_high':minutes.max(),'price_low':minutes.min()})
+    if start is not None:
+        level              = level.reindex(pd.date_range(start,level.index.max(),freq=LEVELS['M'],name=level.index.name))
+    level['quotePrice']    = level['quotePrice'].ffill()
+    if last_price is not None:
+        level['quotePrice'] = level['quotePrice'].fillna(last_price)
+    # Minutes without trades open, close and stay at the last price
+    for column in PRICE_COLUMNS[1:]:
+        level[column]      = level[column].fillna(level['quotePrice'])
+
+    levels = {'M':level}
+    for frequency in list(LEVELS)[1:]:
+        level              = level.resample(LEVELS[frequency]).agg({'quotePrice':'last','price_open':'first','price_high':'max','price_low':'min'})
+        levels[frequency]  = level
+    return levels
+
+
+def swap_levels(swap_data,last_values=None,start=None):
+    """
+    Aggregates swaps (time indexed amount0_adj, amount1_adj and virtual_liquidity_adj columns) to every level of the pyramid.
+    Medians can not be aggregated further, so every level is computed from the swaps.
+    last_values ({frequency: {column: value}}) fill the liquidity of the bins before the first swap of each level,
+    start (a minute) makes every level begin at its bin, with no volume until the first swap.
+    """
+    levels = {}
+    for frequency,rule in LEVELS.items():
+        level = swap_data[SWAP_COLUMNS].resample(rule).agg({'amount0_adj':'sum','amount1_adj':'sum','virtual_liquidity_adj':'median'})
+        if start is not None:
+            level = level.reindex(pd.date_range(start.floor(rule),level.index.max(),freq=rule,name=level.index.name))
+            level[SWAP_COLUMNS[:2]] = level[SWAP_COLUMNS[:2]].fillna(0.0)
+        level = level.ffill()
+        if last_values is not None and frequency in last_values:
+            level = level.fillna(last_values[frequency])
+        levels[frequency] = level
+    return levels
+
+
+class Pyramid:
+    """
+    Resolution pyramid of a pool's price (kind='price') or swap (kind='swap') table in PoolDataStore.
+    update() brings the pyramid up to date with the raw table, read(frequency) returns one level.
+    """
+    def __init__(self,table,pool,kind='price',root=PoolDataStore.STORE_ROOT):
+
+        if kind not in ('price','swap'):
+            raise ValueError('Unsupported pyramid kind: '+str(kind))
+        self.table = table
+        self.pool  = pool
+        self.kind  = kind
+        self.root  = root
+
+    def columns(self):
+        return PRICE_COLUMNS if self.kind == 'price' else SWAP_COLUMNS
+
+    def last_stored(self,frequency,before,columns):
+        """
+        Last stored row of a level before a time, or None.
+        """
+        if not PoolDataStore.has_table(pyramid_table(self.table,self.kind,frequency),self.pool,self.root):
+            return None
+        stored = PoolDataStore.read_table(pyramid_table(self.table,self.kind,frequency),self.pool,date_end=before - pd.Timedelta(1,'ns'),
+                                          columns=columns,root=self.root)
+        return None if len(stored) == 0 else stored.iloc[-1]
+
+    def update(self):
+        """
+        Aggregates the raw rows from the last stored day onwards (all of them on the first update) and replaces those days in every level.
+        Returns the first day recomputed, or None if the raw table is empty.
+        """
+        level_table = pyramid_table(self.table,self.kind,'M')
+        day         = None
+        start       = None
+        if PoolDataStore.has_table(level_table,self.pool,self.root):
+            stored  = PoolDataStore.read_table(level_table,self.pool,columns=[self.columns()[0]],root=self.root)
+            day     = stored.index.max().floor('D') if len(stored) > 0 else None
+            # The recomputed days replace the stored ones whole, so every level restarts at the day's first stored minute
+            start   = None if day is None else max(day,stored.index.min())
+
+        raw_columns = ['quotePrice'] if self.kind == 'price' else SWAP_COLUMNS
+        raw         = PoolDataStore.read_table(self.table,self.pool,date_begin=day,columns=raw_columns,root=self.root)
+        if len(raw) == 0:
+            return None
+
+        if self.kind == 'price':
+            last   = None if day is None else self.last_stored('M',day,['quotePrice'])
+            levels = price_levels(raw,None if last is None else last['quotePrice'],start=start)
+        else:
+            last   = {} if day is None else {frequency: self.last_stored(frequency,day,SWAP_COLUMNS) for frequency in LEVELS}
+            levels = swap_levels(raw,{frequency: values.to_dict() for frequency,values in last.items() if values is not None},start=start)
+
+        for frequency,level in levels.items():
+            PoolDataStore.write_table(level,pyramid_table(self.table,self.kind,frequency),self.pool,root=self.root)
+        return raw.index.min().floor('D')
+
+    def read(self,frequency,date_begin=None,date_end=None):
+        """
+        One level of the pyramid between two dates. Price levels also get the price_return column, as in aggregate_price_data.
+        """
+        if frequency not in LEVELS:
+            raise ValueError('Unsupported frequency: '+str(frequency)+', use one of '+', '.join(LEVELS))
+        level = PoolDataStore.read_table(pyramid_table(self.table,self.kind,frequency),self.pool,date_begin,date_end,root=self.root)
+        level.index.name = 'time_pd'
+        if self.kind == 'price':
+            level['price_return'] = level['quotePrice'].pct_change()
+        return level
@@ -0,0 +1,329 @@
+import numpy as np
+import pandas as pd
+import collections
+import hashlib
+import inspect
+import sqlite3
+import json
+import types
+import time
+import sys
+import os
+import SwapDataset
+
+##############################################################
+# Indexed local store of simulation results
+# Each run (one simulation) is a row of an SQLite table with its analyze_strategy summary, strategy class, parameters,
+# a fingerprint of the input data and the version of the code that produced it. Parameters are also kept one per row
+# in a second table, so runs can be filtered by parameter ranges through an index.
+# The generate_simulation_series outputs are written to Parquet, one file per batch of runs saved together.
+#     <root>/results.sqlite
+#     <root>/series/<first run_id of the batch>.parquet
+# Runs are saved in batches (save_runs) within one transaction, and the metric columns are indexed,
+# so top-N and range queries stay fast with hundreds of thousands of runs.
+##############################################################
+
+RESULTS_ROOT    = './data/results'
+SUMMARY_METRICS = ['days_strategy','gross_fee_apr','gross_fee_return','net_apr','net_return','rebalances','compounds','max_drawdown',
+                   'volatility','sharpe_ratio','impermanent_loss','mean_base_position','median_base_position','mean_base_width',
+                   'median_base_width','final_value']
+INDEXED_METRICS = ['gross_fee_apr','net_apr','net_return','max_drawdown','sharpe_ratio','impermanent_loss','final_value']
+# Modules every simulation result depends on, besides the strategy's own module
+FRAMEWORK_MODULES = ['ActiveStrategyFramework','UNI_v3_funcs','SwapDataset','PositionBook']
+
+
+def data_fingerprint(*data):
+    """
+    sha256 of the content of the simulation inputs: DataFrames or Series (values, index and column names),
+    SwapDataset.SwapArrays, NumPy arrays or scalars.
+    """
+    digest = hashlib.sha256()
+    for item in data:
+        if isinstance(item,(pd.DataFrame,pd.Series)):
+            digest.update(json.dumps([str(x) for x in (item.columns if isinstance(item,pd.DataFrame) else [item.name])]).encode())
+            digest.update(pd.util.hash_pandas_object(item,index=True).to_numpy().tobytes())
+        elif isinstance(item,SwapDataset.SwapArrays):
+            for column in [item.time,item.tick_swap,item.token_0_in,item.virtual_liquidity,item.traded_in]:
+                digest.update(np.ascontiguousarray(column).tobytes())
+        elif isinstance(item,np.ndarray):
+            digest.update(np.ascontiguousarray(item).tobytes())
+        else:
+            digest.update(repr(item).encode())
+        # Separator, so the split between inputs is part of the fingerprint
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def slot_values(value):
+    """
+    {slot name: value} of the __slots__ attributes set on an object.
+    """
+    values = {}
+    for cls in type(value).__mro__:
+        slots = cls.__dict__.get('__slots__',())
+        for name in ([slots] if isinstance(slots,str) else slots):
+            # Private slots are stored under their mangled name
+            attribute = '_'+cls.__name__.lstrip('_')+name if name.startswith('__') and not name.endswith('__') else name
+            if name not in ('__dict__','__weakref__') and hasattr(value,attribute):
+                values[attribute] = getattr(value,attribute)
+    return values
+
+
+def state_modules(value,modules=None,seen=None):
+    """
+    Modules of the classes of the objects held in a strategy's state (eg. the ReturnDistribution of a ResetStrategy).
+    """
+    modules = [] if modules is None else modules
+    seen    = set() if seen is None else seen
+    if id(value) in seen or isinstance(value,(str,bytes,pd.DataFrame,pd.Series,pd.Index,np.ndarray,np.generic,types.ModuleType)) or callable(value):
+        return modules
+    seen.add(id(value))
+    if isinstance(value,dict):
+        items = list(value.values())
+    elif isinstance(value,(list,tuple,set,frozenset,collections.deque)):
+        items = list(value)
+    elif hasattr(value,'__dict__') or hasattr(type(value),'__slots__'):
+        module = inspect.getmodule(type(value))
+        if module is not None and module not in modules:
+            modules.append(module)
+        items  = list(slot_values(value).values()) + list(getattr(value,'__dict__',{}).values())
+    else:
+        items  = []
+    for item in items:
+        state_modules(item,modules,seen)
+    return modules
+
+
+def project_modules(roots,candidates=()):
+    """
+    The roots, the candidates that are project modules, and the project modules they import, directly or through each other.
+    Project modules are the ones next to the framework's source or to a root's source. The FRAMEWORK_MODULES are hashed
+    as listed, their imports are not followed.
+    """
+    directories = set(os.path.dirname(os.path.abspath(inspect.getsourcefile(x))) for x in roots + [sys.modules[__name__]])
+
+    def is_project_module(module):
+        return getattr(module,'__file__',None) is not None and os.path.dirname(os.path.abspath(module.__file__)) in directories
+
+    modules = []
+    pending = list(roots) + [x for x in candidates if is_project_module(x)]
+    while pending:
+        module = pending.pop(0)
+        if module in modules:
+            continue
+        modules.append(module)
+        if module.__name__ in FRAMEWORK_MODULES:
+            continue
+        for value in vars(module).values():
+            imported = value if isinstance(value,types.ModuleType) else inspect.getmodule(value) if inspect.isclass(value) or inspect.isfunction(value) else None
+            if imported is not None and is_project_module(imported):
+                pending.append(imported)
+    return modules
+
+
+def code_version(strategy,*functions):
+    """
+    sha256 of the source of the strategy's module and the project modules it imports (eg. ARGarchModel), of the framework
+    modules it is simulated with and of the modules of any other functions involved (eg. a strategy specific backtester).
+    strategy is a strategy class or object; for an object, the modules of the objects in its state are included too.
+    """
+    import importlib
+    strategy_class = strategy if inspect.isclass(strategy) else type(strategy)
+    roots          = [inspect.getmodule(strategy_class)] + [inspect.getmodule(x) for x in functions]
+    candidates     = [] if inspect.isclass(strategy) else state_modules(strategy)
+    modules        = project_modules(roots,candidates) + [importlib.import_module(x) for x in FRAMEWORK_MODULES]
+    digest         = hashlib.sha256()
+    sources        = []
+    for module in modules:
+        source = inspect.getsourcefile(module)
+        if source not in sources:
+            sources.append(source)
+    for source in sources:
+        with open(source,'rb') as input:
+            digest.update(input.read())
+    return digest.hexdigest()
+
+
+def parameter_value(value):
+    """
+    JSON friendly version of a parameter (NumPy scalars and arrays as Python numbers and lists).
+    """
+    if isinstance(value,(list,tuple)):
+        return [parameter_value(x) for x in value]
+    if isinstance(value,np.ndarray):
+        return parameter_value(value.tolist())
+    if isinstance(value,np.generic):
+        return value.item()
+    return value
+
+
+def strategy_parameters(strategy):
+    """
+    Scalar attributes of a strategy object (eg. alpha_param, tau_param, limit_parameter), used as its parameters.
+    """
+    return {name: parameter_value(value) for name,value in vars(strategy).items()
+            if value is None or isinstance(value,(bool,int,float,str,np.bool_,np.integer,np.floating))}
+
+
+class ResultsStore:
+    def __init__(self,root=RESULTS_ROOT):
+
+        self.root        = root
+        self.series_root = os.path.join(root,'series')
+        os.makedirs(self.series_root,exist_ok=True)
+        self.connection  = sqlite3.connect(os.path.join(root,'results.sqlite'))
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.create_tables()
+
+    def create_tables(self):
+        metric_columns = ''.join(', '+x+' REAL' for x in SUMMARY_METRICS)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, created REAL, strategy TEXT, sweep TEXT, '
+                                    'code_version TEXT, data_fingerprint TEXT, parameters TEXT, series_file TEXT'+metric_columns+')')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS run_parameters (run_id INTEGER, name TEXT, value REAL, text TEXT)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS runs_strategy ON runs (strategy)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS runs_sweep ON runs (sweep)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS runs_data_fingerprint ON runs (data_fingerprint)')
+            for metric in INDEXED_METRICS:
+                self.connection.execute('CREATE INDEX IF NOT EXISTS runs_'+metric+' ON runs ('+metric+')')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS run_parameters_value ON run_parameters (name, value, run_id)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS run_parameters_text ON run_parameters (name, text, run_id)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS run_parameters_run ON run_parameters (run_id)')
+
+    def close(self):
+        self.connection.close()
+
+    def save_run(self,summary,series=None,strategy=None,parameters=None,data_fingerprint=None,code_version=None,sweep=None):
+        """
+        Saves one run, see save_runs. Returns its run_id.
+        """
+        return self.save_runs([{'summary':summary,'series':series,'strategy':strategy,'parameters':parameters,
+                                'data_fingerprint':data_fingerprint,'code_version':code_version,'sweep':sweep}])[0]
+
+    def save_runs(self,runs):
+        """
+        Saves a batch of runs in one transaction. Each run is a dict with:
+            summary           analyze_strategy dict (or a row of analyze_strategies)
+            series            generate_simulation_series output (optional)
+            strategy          strategy object or class name; for an object, its class name, strategy_parameters and
+                              code_version are filled in when not given
+            parameters        dict of parameters (optional)
+            data_fingerprint  see data_fingerprint (optional)
+            code_version      see code_version (optional)
+            sweep             name grouping the runs of a sweep (optional)
+        Returns the run_ids.
+        """
+        created  = time.time()
+        versions = {}
+        rows     = []
+        for run in runs:
+            strategy   = run.get('strategy')
+            parameters = run.get('parameters')
+            version    = run.get('code_version')
+            if strategy is not None and not isinstance(strategy,str):
+                parameters = strategy_parameters(strategy) if parameters is None else parameters
+                if version is None:
+                    # Strategies of a class usually hold objects of the same classes, whose modules are part of the version
+                    version_key = (type(strategy),tuple(x.__name__ for x in state_modules(strategy)))
+                    if version_key not in versions:
+                        versions[version_key] = code_version(strategy)
+                    version = versions[version_key]
+                strategy   = type(strategy).__name__
+            parameters = {name: parameter_value(value) for name,value in (parameters or {}).items()}
+            summary    = dict(run['summary'])
+            rows.append((strategy,parameters,version,summary))
+
+        with self.connection:
+            cursor   = self.connection.execute('SELECT COALESCE(MAX(run_id),0) FROM runs')
+            first_id = cursor.fetchone()[0] + 1
+            run_ids  = list(range(first_id,first_id + len(runs)))
+
+            # Series of the whole batch go to one Parquet file
+            series      = [(run_id,run['series']) for run_id,run in zip(run_ids,runs) if run.get('series') is not None]
+            series_file = None
+            if len(series) > 0:
+                series_file = str(first_id)+'.parquet'
+                frames      = [data.reset_index(drop=True).assign(run_id=run_id) for run_id,data in series]
+                pd.concat(frames,ignore_index=True).to_parquet(os.path.join(self.series_root,series_file),index=False)
+            with_series = set(run_id for run_id,_ in series)
+
+            # Metrics as floats, missing or non finite ones as NULL
+            metrics     = pd.DataFrame([summary for _,_,_,summary in rows],columns=SUMMARY_METRICS).apply(pd.to_numeric,errors='coerce').astype(float)
+            metrics     = metrics.where(np.isfinite(metrics))
+            metrics     = metrics.astype(object).where(metrics.notna(),None).itertuples(index=False,name=None)
+            self.connection.executemany('INSERT INTO runs (run_id, created, strategy, sweep, code_version, data_fingerprint, parameters, series_file, '+
+                                        ', '.join(SUMMARY_METRICS)+') VALUES ('+', '.join(['?']*(8 + len(SUMMARY_METRICS)))+')',
+                                        [(run_id,created,strategy,run.get('sweep'),version,run.get('data_fingerprint'),json.dumps(parameters),
+                                          series_file if run_id in with_series else None) + metric_values
+                                         for run_id,run,(strategy,parameters,version,_),metric_values in zip(run_ids,runs,rows,metrics)])
+            self.connection.executemany('INSERT INTO run_parameters (run_id, name, value, text) VALUES (?, ?, ?, ?)',
+                                        [(run_id,name) + ((float(value),None) if isinstance(value,(int,float)) and not isinstance(value,bool)
+                                                          else (None,json.dumps(value)))
+                                         for run_id,(_,parameters,_,_) in zip(run_ids,rows) for name,value in parameters.items()])
+        return run_ids
+
+    def find(self,metric=None,n=None,ascending=False,strategy=None,sweep=None,data_fingerprint=None,code_version=None,parameters=None):
+        """
+        Runs matching the filters, ordered by metric (best first: highest, or lowest if ascending) and limited to n.
+        parameters filters by parameter: {name: (low,high)} for a range (either end can be None) or {name: value} for a value.
+        Returns a DataFrame indexed by run_id with the metadata, metrics and one column per parameter.
+        """
+        if metric is not None and metric not in SUMMARY_METRICS:
+            raise ValueError('Unknown metric: '+str(metric)+', use one of '+', '.join(SUMMARY_METRICS))
+
+        conditions = []
+        values     = []
+        for column,value in [('strategy',strategy),('sweep',sweep),('data_fingerprint',data_fingerprint),('code_version',code_version)]:
+            if value is not None:
+                conditions.append(column+' = ?')
+                values.append(value)
+        for name,value in (parameters or {}).items():
+            if isinstance(value,tuple) and len(value) == 2:
+                low,high = value
+                bounds   = ''.join([' AND value >= ?' if low is not None else '',' AND value <= ?' if high is not None else ''])
+                conditions.append('run_id IN (SELECT run_id FROM run_parameters WHERE name = ?'+bounds+')')
+                values.extend([name] + [x for x in (low,high) if x is not None])
+            elif isinstance(value,(int,float)) and not isinstance(value,bool):
+                conditions.append('run_id IN (SELECT run_id FROM run_parameters WHERE name = ? AND value = ?)')
+                values.extend([name,float(value)])
+            else:
+                conditions.append('run_id IN (SELECT run_id FROM run_parameters WHERE name = ? AND text = ?)')
+                values.extend([name,json.dumps(parameter_value(value))])
+
+        query = 'SELECT * FROM runs'
+        if len(conditions) > 0:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        if metric is not None:
+            query += ' AND ' if len(conditions) > 0 else ' WHERE '
+            query += metric+' IS NOT NULL ORDER BY '+metric+(' ASC' if ascending else ' DESC')
+        if n is not None:
+            query += ' LIMIT ?'
+            values.append(int(n))
+
+        results = pd.read_sql_query(query,self.connection,params=values,index_col='run_id')
+        if len(results) > 0:
+            parameters = pd.DataFrame([json.loads(x) for x in results['parameters']],index=results.index)
+            results    = results.drop(columns='parameters').join(parameters.add_prefix('param_'))
+        return results
+
+    def top(self,metric,n=10,ascending=False,**filters):
+        """
+        Best n runs by metric, see find for the filters.
+        """
+        return self.find(metric=metric,n=n,ascending=ascending,**filters)
+
+    def series(self,run_id):
+        """
+        Stored generate_simulation_series output of a run, indexed by time as generate_simulation_series returns it.
+        """
+        row = self.connection.execute('SELECT series_file FROM runs WHERE run_id = ?',(int(run_id),)).fetchone()
+        if row is None or row[0] is None:
+            raise KeyError('No series stored for run '+str(run_id))
+        data = pd.read_parquet(os.path.join(self.series_root,row[0]),filters=[('run_id','==',int(run_id))])
+        data = data.drop(columns='run_id')
+        if 'time' in data.columns:
+            data = data.set_index('time',drop=False)
+        return data
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
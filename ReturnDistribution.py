@@ -0,0 +1,191 @@
+import numpy as np
+import pandas as pd
+import collections
+import math
+
+##############################################################
+# Online return distribution for long-running strategies
+# A merging t-digest keeps a bounded number of weighted centroids (at most compression/2 + 1 after
+# compressing), with small centroids in the tails where reset and base quantiles live.
+# OnlineReturnDistribution wraps it with a lookback window (ring of digest segments) and/or an
+# exponential decay so the distribution follows the pool as new prices arrive.
+##############################################################
+
+class QuantileSketch:
+    def __init__(self,compression=200,buffer_size=500):
+
+        self.compression  = compression
+        self.buffer_size  = buffer_size
+        self.means        = np.empty(0)
+        self.weights      = np.empty(0)
+        self.buffer       = []
+        self.buffer_w     = []
+
+    def add(self,values,weights=None):
+        values  = np.atleast_1d(np.asarray(values,dtype=float))
+        weights = np.ones(len(values)) if weights is None else np.atleast_1d(np.asarray(weights,dtype=float))
+        keep    = ~np.isnan(values)
+
+        self.buffer.append(values[keep])
+        self.buffer_w.append(weights[keep])
+        if sum(len(x) for x in self.buffer) >= self.buffer_size:
+            self.compress()
+
+    def scale_weights(self,factor):
+        """
+        Multiplies every stored weight by factor, used to exponentially decay old observations.
+        """
+        self.weights  = self.weights * factor
+        self.buffer_w = [x * factor for x in self.buffer_w]
+
+    def total_weight(self):
+        return self.weights.sum() + sum(x.sum() for x in self.buffer_w)
+
+    def compress(self):
+        if len(self.buffer) == 0:
+            return
+        means        = np.concatenate([self.means] + self.buffer)
+        weights      = np.concatenate([self.weights] + self.buffer_w)
+        self.buffer   = []
+        self.buffer_w = []
+        self.means,self.weights = compress_centroids(means,weights,self.compression)
+
+    def centroids(self):
+        self.compress()
+        return self.means,self.weights
+
+    def quantile(self,probabilities):
+        self.compress()
+        return centroid_quantiles(probabilities,self.means,self.weights)
+
+
+def compress_centroids(means,weights,compression):
+    """
+    Merges sorted centroids so that each merged centroid spans at most one unit of the t-digest k1 scale,
+    k(q) = compression / (2 pi) * asin(2q - 1). Done for all centroids at once by bucketing their midpoint k.
+    """
+    keep    = weights > 0
+    means   = means[keep]
+    weights = weights[keep]
+    if len(means) == 0:
+        return means,weights
+
+    order      = np.argsort(means,kind='stable')
+    means      = means[order]
+    weights    = weights[order]
+    total      = weights.sum()
+    q_mid      = (np.cumsum(weights) - weights/2) / total
+    k_mid      = compression / (2*math.pi) * np.arcsin(2*np.clip(q_mid,0.0,1.0) - 1)
+    bucket     = np.floor(k_mid - k_mid[0]).astype(np.int64)
+    starts     = np.flatnonzero(np.r_[True,bucket[1:] != bucket[:-1]])
+
+    new_weights = np.add.reduceat(weights,starts)
+    new_means   = np.add.reduceat(means*weights,starts) / new_weights
+    return new_means,new_weights
+
+
+def centroid_quantiles(probabilities,means,weights):
+    """
+    Vectorized quantiles from centroids by interpolating between centroid centers of mass.
+    Each query is a binary search over the (bounded) centroid list.
+    """
+    if len(means) == 0:
+        raise ValueError('The distribution has no observations')
+    probabilities = np.asarray(probabilities,dtype=float)
+    centers       = (np.cumsum(weights) - weights/2) / weights.sum()
+    return np.interp(probabilities,centers,means)
+
+
+class OnlineReturnDistribution:
+    """
+    Rolling distribution of price returns that is updated one price at a time.
+    lookback      number of returns kept (approximately: the oldest of n_segments segments is dropped as a whole)
+    half_life     number of returns after which an observation counts half as much
+    sample_period minimum pd.Timedelta (or string) between the prices used to compute returns,
+                  so that returns match the frequency of the data used to build the model
+    """
+    def __init__(self,lookback=None,half_life=None,sample_period=None,compression=200,n_segments=8):
+
+        self.lookback       = lookback
+        self.half_life      = half_life
+        self.compression    = compression
+        self.sample_period  = None if sample_period is None else pd.Timedelta(sample_period)
+        self.decay_factor   = 1.0 if half_life is None else 0.5**(1.0/half_life)
+        self.segment_size   = None if lookback is None else max(1,math.ceil(lookback/n_segments))
+        self.n_segments     = n_segments
+        self.segments       = collections.deque([QuantileSketch(compression)])
+        self.segment_count  = 0
+        self.n_returns      = 0
+        self.last_time      = None
+        self.last_price     = None
+        self.merged         = None
+
+    def add_returns(self,returns):
+        """
+        Adds a batch of returns in time order (eg. model_data['price_return'] to seed the distribution).
+        """
+        returns = np.asarray(returns,dtype=float)
+        returns = returns[~np.isnan(returns)]
+
+        while len(returns) > 0:
+            # Fill the current segment, then rotate
+            if self.segment_size is None:
+                n_here = len(returns)
+            else:
+                n_here = min(len(returns),self.segment_size - self.segment_count)
+
+            chunk   = returns[:n_here]
+            returns = returns[n_here:]
+
+            if self.half_life is not None:
+                for segment in self.segments:
+                    segment.scale_weights(self.decay_factor**len(chunk))
+                self.segments[-1].add(chunk,self.decay_factor**np.arange(len(chunk)-1,-1,-1))
+            else:
+                self.segments[-1].add(chunk)
+
+            self.segment_count += n_here
+            self.n_returns     += n_here
+
+            if self.segment_size is not None and self.segment_count >= self.segment_size:
+                self.segments.append(QuantileSketch(self.compression))
+                self.segment_count = 0
+                if len(self.segments) > self.n_segments + 1:
+                    self.segments.popleft()
+
+        self.merged = None
+
+    def update(self,timepoint,price):
+        """
+        Records a new price. A return is added when at least sample_period has passed since the last recorded price.
+        Repeated calls with the same (or an earlier) time are ignored.
+        """
+        if self.last_time is not None:
+            elapsed = timepoint - self.last_time
+            if self.sample_period is None:
+                if elapsed <= pd.Timedelta(0):
+                    return
+            elif elapsed < self.sample_period:
+                return
+            self.add_returns([price/self.last_price - 1])
+
+        self.last_time  = timepoint
+        self.last_price = price
+
+    def centroids(self):
+        if self.merged is None:
+            means   = np.concatenate([segment.centroids()[0] for segment in self.segments])
+            weights = np.concatenate([segment.centroids()[1] for segment in self.segments])
+            self.merged = compress_centroids(means,weights,self.compression)
+        return self.merged
+
+    def quantile(self,probabilities):
+        means,weights = self.centroids()
+        return centroid_quantiles(probabilities,means,weights)
+
+    def central_quantiles(self,coverage):
+        """
+        Lower and upper return quantiles of the central interval with the given coverage (eg. alpha_param or tau_param).
+        """
+        coverage = np.asarray(coverage,dtype=float)
+        return self.quantile((1 - coverage)/2),self.quantile(1 - (1 - coverage)/2)
@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+import collections.abc
+import hashlib
+import shutil
+import types
+import json
+import os
+import ResultsStore
+
+##############################################################
+# Persistent memoization of simulation results
+# A simulation is keyed by a content hash of all its inputs: the strategy (its class and state, eg. the quantile table of
+# a ResetStrategy or the model data of an AutoRegressiveStrategy), price and swap data, initial tokens, fee tier, decimals
+# and the backtester used. Results are stored as the DataFrame of dict_components rows (as the fast backtesters return it,
+# which generate_simulation_series accepts) in Parquet:
+#     <root>/<strategy class>.<backtester>/<code version>/<key>.parquet
+# The code version hashes the source of the strategy, framework and backtester modules, the project modules they import
+# and the modules of the objects in the strategy's state (ResultsStore.code_version), so
+# results of older code are never served, and their directories are removed when results of the new code are stored.
+##############################################################
+
+SIMULATION_CACHE_ROOT = './data/simulations'
+
+
+class UncacheableState(Exception):
+    """
+    A strategy's state holds a value that can not be hashed by content (eg. an iterator, or an object only known by its address).
+    """
+
+
+def state_fingerprint(value,digest=None):
+    """
+    sha256 of a strategy's state: its class and attributes, hashed by content (arrays, DataFrames and the items of any
+    container included). Raises UncacheableState for values whose only representation is their memory address.
+    """
+    digest = hashlib.sha256() if digest is None else digest
+    if isinstance(value,(pd.DataFrame,pd.Series,np.ndarray)):
+        digest.update(ResultsStore.data_fingerprint(value).encode())
+    elif isinstance(value,(str,bytes,int,float,complex,bool,type(None),np.generic)):
+        digest.update(repr(value).encode())
+    elif isinstance(value,collections.abc.Mapping):
+        digest.update(b'{')
+        for name in sorted(value,key=repr):
+            digest.update(repr(name).encode())
+            state_fingerprint(value[name],digest)
+        digest.update(b'}')
+    elif isinstance(value,collections.abc.Set):
+        # Sets have no order: hash the sorted fingerprints of their items
+        digest.update(b'(')
+        for item in sorted(state_fingerprint(x) for x in value):
+            digest.update(item.encode())
+        digest.update(b')')
+    elif (hasattr(value,'__dict__') or hasattr(type(value),'__slots__')) and not callable(value) and not isinstance(value,types.ModuleType):
+        digest.update((type(value).__module__+'.'+type(value).__qualname__).encode())
+        state_fingerprint(dict(ResultsStore.slot_values(value),**getattr(value,'__dict__',{})),digest)
+    elif isinstance(value,collections.abc.Iterator):
+        raise UncacheableState('Can not hash the iterator '+type(value).__qualname__+' without consuming it')
+    elif isinstance(value,collections.abc.Iterable):
+        digest.update((type(value).__qualname__+'[').encode())
+        for item in value:
+            state_fingerprint(item,digest)
+        digest.update(b']')
+    elif isinstance(value,(types.FunctionType,types.BuiltinFunctionType)) and '<' not in value.__qualname__:
+        # Module level functions by name
+        digest.update((str(value.__module__)+'.'+value.__qualname__).encode())
+    else:
+        representation = repr(value)
+        if ' at 0x' in representation:
+            raise UncacheableState('Can not hash '+representation+' by content')
+        digest.update(representation.encode())
+    return digest.hexdigest()
+
+
+def simulation_frame(simulations,strategy_in):
+    """
+    Results of a simulation as the DataFrame of dict_components rows (the list of observations of simulate_strategy is converted).
+    """
+    if isinstance(simulations,pd.DataFrame):
+        return simulations
+    return pd.DataFrame([strategy_in.dict_components(x) for x in simulations])
+
+
+class SimulationCache:
+    def __init__(self,root=SIMULATION_CACHE_ROOT):
+
+        self.root   = root
+        self.counts = {'hits':0,'misses':0,'uncacheable':0}
+        self.purged = set()
+
+    def path(self,group,version,key):
+        return os.path.join(self.root,group,version[:16],key+'.parquet')
+
+    def get(self,group,version,key):
+        path = self.path(group,version,key)
+        if not os.path.isfile(path):
+            self.counts['misses'] += 1
+            return None
+        self.counts['hits'] += 1
+        return pd.read_parquet(path)
+
+    def put(self,group,version,key,data):
+        path = self.path(group,version,key)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        # Unique temporary file, so parallel workers storing the same key do not collide
+        temporary = path+'.'+str(os.getpid())+'.tmp'
+        try:
+            data.to_parquet(temporary)
+        except Exception:
+            # Columns Parquet can not hold (eg. mixed Python objects) are not cached
+            self.counts['uncacheable'] += 1
+            if os.path.isfile(temporary):
+                os.remove(temporary)
+            return
+        os.replace(temporary,path)
+        self.purge_versions(group,version)
+
+    def purge_versions(self,group,version):
+        """
+        Removes the results of other code versions of a strategy and backtester.
+        """
+        if (group,version) in self.purged:
+            return
+        group_root = os.path.join(self.root,group)
+        for name in os.listdir(group_root):
+            if name != version[:16]:
+                shutil.rmtree(os.path.join(group_root,name),ignore_errors=True)
+        self.purged.add((group,version))
+
+    def clear(self):
+        shutil.rmtree(self.root,ignore_errors=True)
+        self.purged = set()
+
+    def stats(self):
+        requests = self.counts['hits'] + self.counts['misses']
+        return dict(self.counts,hit_rate=self.counts['hits']/requests if requests > 0 else None)
+
+
+DEFAULT_CACHE = None
+
+
+def default_cache():
+    """
+    Cache used when cache=True is passed.
+    """
+    global DEFAULT_CACHE
+    if DEFAULT_CACHE is None:
+        DEFAULT_CACHE = SimulationCache()
+    return DEFAULT_CACHE
+
+
+def simulation_key(simulate,price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,swap_fingerprint=None):
+    """
+    Content hash of the inputs of a simulation. swap_fingerprint (ResultsStore.data_fingerprint(swap_data)) can be
+    computed once and passed in by callers simulating many times over the same swaps.
+    """
+    swap_fingerprint = ResultsStore.data_fingerprint(swap_data) if swap_fingerprint is None else swap_fingerprint
+    inputs           = [simulate.__module__+'.'+simulate.__qualname__,state_fingerprint(strategy_in),ResultsStore.data_fingerprint(price_data),
+                        swap_fingerprint,repr(float(liquidity_in_0)),repr(float(liquidity_in_1)),repr(float(fee_tier)),int(decimals_0),int(decimals_1)]
+    return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+
+def cached_simulation(simulate,price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                      cache=True,swap_fingerprint=None):
+    """
+    simulate(price_data,swap_data,strategy_in,...) served from cache (True for default_cache(), or a SimulationCache) when
+    the same inputs were simulated before with the same code. Returns the results as a DataFrame of dict_components rows.
+    """
+    cache   = default_cache() if cache is True else cache
+    group   = type(strategy_in).__name__+'.'+simulate.__name__
+    version = ResultsStore.code_version(strategy_in,simulate)
+    try:
+        key = simulation_key(simulate,price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                             swap_fingerprint)
+    except UncacheableState:
+        # Without a content key the simulation is run, and not stored
+        cache.counts['uncacheable'] += 1
+        return simulation_frame(simulate(price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1),strategy_in)
+    data    = cache.get(group,version,key)
+    if data is None:
+        data = simulation_frame(simulate(price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1),strategy_in)
+        cache.put(group,version,key,data)
+    return data
+
+
+def run_simulation(simulate,price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                   cache=False,swap_fingerprint=None):
+    """
+    simulate(...) as is without cache, through cached_simulation with one (as used by the sweep layers).
+    """
+    if not cache:
+        return simulate(price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1)
+    return cached_simulation(simulate,price_data,swap_data,strategy_in,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                             cache=cache,swap_fingerprint=swap_fingerprint)
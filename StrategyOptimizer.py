@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+import math
+import time
+import os
+import ActiveStrategyFramework
+import SimulationCache
+import ResultsStore
+from concurrent.futures import ProcessPoolExecutor
+
+##############################################################
+# Parallel strategy parameter optimization with successive halving
+# Candidates are simulated over a growing prefix of the date range (the checkpoints) and only the best 1/eta of them
+# at each checkpoint go on to the next, longer one, so clearly dominated configurations stop early and only the
+# survivors are simulated over the full range. The simulations of each checkpoint run in parallel processes.
+# The objective is pluggable: a name in OBJECTIVES or any function of the analyze_strategy summary (higher is better).
+##############################################################
+
+OBJECTIVES = {'impermanent_loss': lambda summary: summary['impermanent_loss'],
+              'net_apr':          lambda summary: summary['net_apr'],
+              'sharpe_ratio':     lambda summary: summary['sharpe_ratio']}
+
+# Simulation inputs of the worker processes, set once per process by set_worker_data
+WORKER_DATA = None
+
+
+def set_worker_data(data):
+    global WORKER_DATA
+    WORKER_DATA = data
+
+
+def sample_candidates(bounds,n_candidates,seed=None):
+    """
+    Latin hypercube sample of n_candidates parameter tuples within bounds ([(low,high),...], one pair per parameter).
+    """
+    rng     = np.random.default_rng(seed)
+    samples = np.empty((n_candidates,len(bounds)))
+    for j,(low,high) in enumerate(bounds):
+        strata        = (rng.permutation(n_candidates) + rng.random(n_candidates)) / n_candidates
+        samples[:,j]  = low + strata*(high - low)
+    return [tuple(x) for x in samples]
+
+
+def checkpoints(n_observations,n_rungs,eta):
+    """
+    Number of price observations simulated at each rung: the full range at the last rung, eta times fewer at each rung before.
+    """
+    return [max(2,int(math.ceil(n_observations / eta**(n_rungs - 1 - rung)))) for rung in range(n_rungs)]
+
+
+def evaluate_candidate(task):
+    """
+    Simulates one candidate over the first n_observations prices and returns its analyze_strategy metrics (or the error it raised).
+    Runs in the worker processes, with the simulation inputs of WORKER_DATA.
+    """
+    params,n_observations = task
+    data                  = WORKER_DATA
+    start                 = time.time()
+    try:
+        strategy    = data['make_strategy'](params)
+        price_data  = data['price_data'].iloc[:n_observations]
+        simulations = SimulationCache.run_simulation(data['simulate'],price_data,data['swap_data'],strategy,data['liquidity_in_0'],
+                                                     data['liquidity_in_1'],data['fee_tier'],data['decimals_0'],data['decimals_1'],
+                                                     cache=data['cache'],swap_fingerprint=data['swap_fingerprint'])
+        series      = ActiveStrategyFramework.generate_simulation_series(simulations,strategy,data['token_0_usd_data'])
+        summary     = ActiveStrategyFramework.analyze_strategies(series.assign(simulation=0),frequency=data['frequency']).iloc[0].to_dict()
+        error       = None
+    except Exception as exception:
+        summary     = None
+        error       = repr(exception)
+    return {'summary':summary,'error':error,'seconds':time.time() - start}
+
+
+def successive_halving(make_strategy,candidates,price_data,swap_data,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                       objective='impermanent_loss',token_0_usd_data=None,frequency='M',n_rungs=3,eta=3,max_workers=None,
+                       simulate=ActiveStrategyFramework.simulate_strategy,cache=False):
+    """
+    Finds the best of candidates (parameter tuples, eg. from sample_candidates) for a strategy built by make_strategy(params).
+    Each rung simulates the surviving candidates in parallel over a longer prefix of price_data (see checkpoints), scores them
+    with objective (higher is better; undefined scores rank last, and candidates whose simulation failed below them) and keeps
+    the best ceil(n/eta) for the next rung. The annualized metrics count whole days, so the first checkpoint must cover at least a day.
+    simulate can be a strategy specific backtester with the signature of simulate_strategy (eg. ResetStrategy.simulate_reset_strategy).
+    make_strategy and simulate must be picklable (module level functions) when max_workers > 1.
+    With cache (True for SimulationCache.default_cache(), or a SimulationCache.SimulationCache) simulations of inputs seen before
+    are read back instead of run again.
+    Returns a dict with the best parameters, score and summary, the history of every evaluation and the provenance of the run.
+    """
+    objective_function = OBJECTIVES[objective] if isinstance(objective,str) else objective
+    max_workers        = os.cpu_count() if max_workers is None else max_workers
+    rung_observations  = checkpoints(len(price_data),n_rungs,eta)
+    if price_data.index[rung_observations[0]-1] - price_data.index[0] < pd.Timedelta(days=1):
+        raise ValueError('The first checkpoint covers less than a day ('+str(price_data.index[rung_observations[0]-1] - price_data.index[0])+
+                         '), where the annualized metrics are undefined: use fewer rungs, a smaller eta or a longer date range')
+    worker_data        = {'make_strategy':make_strategy,'simulate':simulate,'price_data':price_data,'swap_data':swap_data,
+                          'liquidity_in_0':liquidity_in_0,'liquidity_in_1':liquidity_in_1,'fee_tier':fee_tier,
+                          'decimals_0':decimals_0,'decimals_1':decimals_1,'token_0_usd_data':token_0_usd_data,'frequency':frequency,
+                          'cache':cache,'swap_fingerprint':None if not cache else ResultsStore.data_fingerprint(swap_data)}
+    started            = pd.Timestamp.now(tz='UTC')
+    history            = []
+    survivors          = list(range(len(candidates)))
+
+    if max_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=max_workers,initializer=set_worker_data,initargs=(worker_data,))
+    else:
+        executor = None
+        set_worker_data(worker_data)
+    try:
+        for rung,n_observations in enumerate(rung_observations):
+            tasks   = [(candidates[i],n_observations) for i in survivors]
+            results = list(executor.map(evaluate_candidate,tasks)) if executor is not None else [evaluate_candidate(x) for x in tasks]
+
+            scores  = []
+            failed  = []
+            for candidate_id,result in zip(survivors,results):
+                score = -np.inf
+                if result['summary'] is not None:
+                    score = float(objective_function(result['summary']))
+                    score = score if np.isfinite(score) else -np.inf
+                scores.append(score)
+                failed.append(result['error'] is not None)
+                history.append(dict({'candidate':candidate_id,'params':candidates[candidate_id],'rung':rung,
+                                     'checkpoint':price_data.index[n_observations-1],'n_observations':n_observations,
+                                     'score':score,'error':result['error'],'seconds':result['seconds']},
+                                    **(result['summary'] or {})))
+
+            # Failed simulations last, then by score; lexsort is stable, so ties keep the candidates' order
+            ranking   = np.lexsort((-np.array(scores),np.array(failed)))
+            n_keep    = len(survivors) if rung == len(rung_observations) - 1 else max(1,int(math.ceil(len(survivors) / eta)))
+            promoted  = set(survivors[i] for i in ranking[:n_keep])
+            for entry in history[len(history)-len(survivors):]:
+                entry['stopped'] = entry['candidate'] not in promoted and rung < len(rung_observations) - 1
+            survivors = [survivors[i] for i in ranking[:n_keep]]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    history = pd.DataFrame(history)
+    final   = history[history['rung'] == len(rung_observations) - 1]
+    final   = final.assign(failed=final['error'].notna()).sort_values(['failed','score'],ascending=[True,False],kind='stable')
+    best    = final.iloc[0]
+
+    return {'best_params':  best['params'],
+            'best_score':   best['score'],
+            'best_summary': None if best['error'] is not None else {x: best[x] for x in history.columns if x not in
+                                ('candidate','params','rung','checkpoint','n_observations','score','error','seconds','stopped')},
+            'history':      history,
+            'provenance':   {'objective':        objective if isinstance(objective,str) else getattr(objective,'__name__',repr(objective)),
+                             'candidate':        int(best['candidate']),
+                             'n_candidates':     len(candidates),
+                             'n_rungs':          n_rungs,
+                             'eta':              eta,
+                             'checkpoints':      [price_data.index[x-1] for x in rung_observations],
+                             'date_begin':       price_data.index[0],
+                             'date_end':         price_data.index[-1],
+                             'frequency':        frequency,
+                             'simulations':      len(history),
+                             'max_workers':      max_workers,
+                             'started':          started,
+                             'seconds':          (pd.Timestamp.now(tz='UTC') - started).total_seconds()}}
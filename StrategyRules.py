@@ -0,0 +1,296 @@
+import numpy as np
+import pandas as pd
+import math
+import SwapDataset
+import PositionBook
+import ActiveStrategyFramework
+
+##############################################################
+# Declarative strategy rules and a block-evaluating simulation engine
+# A rule-based strategy declares, besides set_liquidity_ranges and dict_components:
+#     triggers()                     {name: predicate}, each predicate(block) returning a boolean array with an element per row
+#                                    of a RuleBlock. A trigger must fire on every row where the strategy could act
+#                                    (firing on more rows is harmless, the callback decides)
+#     on_trigger(observation,fired)  the rebalance logic, called on the rows where triggers fired with the StrategyObservation of
+#                                    the row and the names of the triggers fired. Returns (liquidity_ranges, strategy_info) like
+#                                    check_strategy, which is used when the strategy does not define on_trigger
+# Between two rows where Python runs the positions are fixed, so simulate_rules evaluates the triggers over blocks of rows at
+# once (position amounts and fees included) and only builds a StrategyObservation on the rows where a trigger fires.
+# Strategies without triggers (or that return None) are run through CheckStrategyRules, which fires on every row.
+##############################################################
+
+TRIGGER_BLOCK     = 256
+# Relative margin for predicates on token amounts, which the block computes in floating point
+TRIGGER_TOLERANCE = 1e-9
+# dict_components columns the engine computes for the rows between callbacks; the others are carried from the last callback row
+ROW_COLUMNS       = ['time','price','reset_point','compound_point','reset_reason','token_0_fees','token_1_fees',
+                     'token_0_fees_uncollected','token_1_fees_uncollected','token_0_allocated','token_1_allocated','token_0_total',
+                     'token_1_total','value_position_in_token_0','value_allocated_in_token_0','value_left_over_in_token_0',
+                     'base_position_value_in_token_0','limit_position_value_in_token_0']
+
+
+class RuleBlock:
+    """
+    Consecutive rows during which the positions are fixed, as seen by the trigger predicates:
+        price, tick (current price tick), time (DatetimeIndex)
+        token_0, token_1                                      amounts of each range (n_ranges, n_rows)
+        token_0_fees_uncollected, token_1_fees_uncollected    uncollected fees at each row
+        token_0_left_over, token_1_left_over                  tokens outside the positions
+        liquidity_ranges, strategy_info                       as set on the last callback row
+    """
+    def __init__(self,price,tick,time,token_0,token_1,token_0_fees_uncollected,token_1_fees_uncollected,
+                 token_0_left_over,token_1_left_over,liquidity_ranges,strategy_info):
+
+        self.price                    = price
+        self.tick                     = tick
+        self.time                     = time
+        self.token_0                  = token_0
+        self.token_1                  = token_1
+        self.token_0_fees_uncollected = token_0_fees_uncollected
+        self.token_1_fees_uncollected = token_1_fees_uncollected
+        self.token_0_left_over        = token_0_left_over
+        self.token_1_left_over        = token_1_left_over
+        self.liquidity_ranges         = liquidity_ranges
+        self.strategy_info            = strategy_info
+
+    def __len__(self):
+        return len(self.price)
+
+    def constant(self,value):
+        """
+        A boolean for every row of the block.
+        """
+        return np.full(len(self.price),bool(value))
+
+    def greater(self,left,right):
+        """
+        left > right for amounts computed in floating point, up to TRIGGER_TOLERANCE in favour of firing.
+        """
+        return left > right - TRIGGER_TOLERANCE*np.abs(right)
+
+    def range_value_in_token_0(self,i):
+        return self.token_0[i] + self.token_1[i] / self.price
+
+    def range_value_in_token_1(self,i):
+        return self.token_0[i] * self.price + self.token_1[i]
+
+
+class CheckStrategyRules:
+    """
+    Rules adapter for a strategy with only check_strategy: a single trigger firing on every row, with check_strategy as callback.
+    """
+    def __init__(self,strategy_in):
+        self.strategy_in = strategy_in
+
+    def triggers(self):
+        return {'every_observation': lambda block: block.constant(True)}
+
+    def on_trigger(self,current_strat_obs,fired):
+        return self.strategy_in.check_strategy(current_strat_obs)
+
+    def set_liquidity_ranges(self,current_strat_obs):
+        return self.strategy_in.set_liquidity_ranges(current_strat_obs)
+
+    def dict_components(self,strategy_observation):
+        return self.strategy_in.dict_components(strategy_observation)
+
+
+class TriggeredStrategy:
+    """
+    Strategy passed to StrategyObservation on the rows where triggers fired: check_strategy runs the rules' callback.
+    """
+    def __init__(self,rules,fired):
+        self.rules = rules
+        self.fired = fired
+
+    def check_strategy(self,current_strat_obs):
+        if hasattr(self.rules,'on_trigger'):
+            return self.rules.on_trigger(current_strat_obs,self.fired)
+        return self.rules.check_strategy(current_strat_obs)
+
+    def set_liquidity_ranges(self,current_strat_obs):
+        return self.rules.set_liquidity_ranges(current_strat_obs)
+
+
+def strategy_rules(strategy_in):
+    """
+    The strategy itself if it declares triggers, otherwise CheckStrategyRules around it.
+    """
+    if hasattr(strategy_in,'triggers') and strategy_in.triggers() is not None:
+        return strategy_in
+    return CheckStrategyRules(strategy_in)
+
+
+def evaluate_triggers(triggers,block):
+    """
+    Boolean array (n_triggers, n_rows) of the triggers fired on each row of the block.
+    """
+    if len(triggers) == 0:
+        return np.zeros((0,len(block)),dtype=bool)
+    return np.vstack([np.asarray(predicate(block),dtype=bool).reshape(len(block)) for predicate in triggers.values()])
+
+
+def simulate_rules(price_data,swap_data,strategy_in,
+                   liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1):
+    """
+    Simulates a strategy like simulate_strategy, evaluating its triggers over blocks of rows and running its Python logic only
+    where they fire. Returns a DataFrame with one row of dict_components per observation (see ROW_COLUMNS for the columns
+    computed between callbacks), which can be passed to generate_simulation_series.
+    """
+    ActiveStrategyFramework.validate_simulation_inputs(price_data,swap_data,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1)
+    rules        = strategy_rules(strategy_in)
+    triggers     = rules.triggers()
+    names        = np.array(list(triggers))
+
+    times        = price_data.index
+    prices       = np.asarray(price_data,dtype=float)
+    n_obs        = len(prices)
+    tick_current = np.floor(np.log(10**(decimals_1 - decimals_0)*prices)/math.log(1.0001))
+
+    swap_times   = SwapDataset.swap_times(swap_data)
+    swap_ticks,swap_token_0,swap_virtual,swap_traded = SwapDataset.fee_columns(swap_data)
+    times_ns     = SwapDataset.time_ns(times)
+    # Swaps between consecutive observations, both ends included as in simulate_strategy
+    swap_start   = np.searchsorted(swap_times,times_ns[:-1],side='left')
+    swap_end     = np.searchsorted(swap_times,times_ns[1:], side='right')
+
+    # Swaps of a step are passed to StrategyObservation as views of the swap arrays
+    swap_arrays  = SwapDataset.SwapArrays(swap_times,swap_ticks,swap_token_0,swap_virtual,swap_traded)
+
+    def relevant_swaps(i):
+        start,end = swap_start[i-1],swap_end[i-1]
+        return SwapDataset.SwapArrays(swap_times[start:end],swap_ticks[start:end],swap_token_0[start:end],swap_virtual[start:end],swap_traded[start:end])
+
+    def observe(i,previous,fired):
+        return ActiveStrategyFramework.StrategyObservation(times[i],prices[i],TriggeredStrategy(rules,fired),
+                                                           previous.liquidity_in_0,previous.liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                                                           previous.token_0_left_over,previous.token_1_left_over,
+                                                           previous.token_0_fees_uncollected,previous.token_1_fees_uncollected,
+                                                           previous.liquidity_ranges,previous.strategy_info,relevant_swaps(i))
+
+    observation  = ActiveStrategyFramework.StrategyObservation(times[0],prices[0],rules,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1)
+    static_row   = rules.dict_components(observation)
+    columns      = {}
+    store_row(columns,0,static_row,n_obs)
+    last         = 0
+    block_size   = TRIGGER_BLOCK
+    while last < n_obs - 1:
+        ranges     = observation.liquidity_ranges
+        book       = PositionBook.PositionBook.from_ranges(ranges)
+        fees_0     = observation.token_0_fees_uncollected
+        fees_1     = observation.token_1_fees_uncollected
+        parts      = []
+        fired_row  = None
+        search     = last + 1
+        while search < n_obs and fired_row is None:
+            stop   = min(n_obs,search + block_size)
+            rows_i = slice(search,stop)
+
+            # Fees of each row from the swaps of its step, as in StrategyObservation.accrue_fees
+            first_swap,last_swap = swap_start[search-1],swap_end[stop-2]
+            swaps           = slice(first_swap,last_swap)
+            step_0,step_1   = book.swap_fees(swap_ticks[swaps],swap_token_0[swaps],swap_virtual[swaps],swap_traded[swaps],fee_tier)
+            token_0,token_1 = book.amounts(tick_current[rows_i],decimals_0,decimals_1)
+            cumulative_0 = np.r_[0.0,np.cumsum(step_0)]
+            cumulative_1 = np.r_[0.0,np.cumsum(step_1)]
+            row_fees_0   = cumulative_0[swap_end[search-1:stop-1] - first_swap] - cumulative_0[swap_start[search-1:stop-1] - first_swap]
+            row_fees_1   = cumulative_1[swap_end[search-1:stop-1] - first_swap] - cumulative_1[swap_start[search-1:stop-1] - first_swap]
+            uncollected_0 = fees_0 + np.cumsum(row_fees_0)
+            uncollected_1 = fees_1 + np.cumsum(row_fees_1)
+
+            block  = RuleBlock(prices[rows_i],tick_current[rows_i],times[rows_i],token_0,token_1,uncollected_0,uncollected_1,
+                               observation.token_0_left_over,observation.token_1_left_over,ranges,observation.strategy_info)
+            fired  = evaluate_triggers(triggers,block)
+            n_keep = stop - search
+            if fired.any():
+                first     = int(np.argmax(fired.any(axis=0)))
+                fired_row = search + first
+                fired_now = list(names[fired[:,first]])
+                n_keep    = first
+            parts.append((search,n_keep,block,row_fees_0,row_fees_1))
+            if n_keep > 0:
+                fees_0,fees_1 = uncollected_0[n_keep-1],uncollected_1[n_keep-1]
+            search     = stop
+            block_size = block_size * 2
+        block_size = max(TRIGGER_BLOCK,(n_obs if fired_row is None else fired_row) - last)
+
+        # Rows without a trigger keep the positions, their dict_components are computed over the block
+        for start,n_keep,block,row_fees_0,row_fees_1 in parts:
+            if n_keep > 0:
+                store_block(columns,start,n_keep,block_rows(n_keep,block,row_fees_0,row_fees_1),static_row)
+
+        if fired_row is None:
+            break
+        previous = observation
+        previous.token_0_fees_uncollected,previous.token_1_fees_uncollected = fees_0,fees_1
+        observation = observe(fired_row,previous,fired_now)
+        static_row  = rules.dict_components(observation)
+        store_row(columns,fired_row,static_row,n_obs)
+        last        = fired_row
+
+    results = pd.DataFrame(columns)
+    objects = [x for x in results.columns if results[x].dtype == object]
+    results[objects] = results[objects].infer_objects()
+    return results
+
+
+def store_row(columns,i,row,n_obs):
+    """
+    Stores a dict_components row at position i of the output columns, adding the columns seen for the first time.
+    Float and bool columns are typed arrays, the others (times, text, integers) objects converted at the end.
+    """
+    for name,value in row.items():
+        if name not in columns:
+            if isinstance(value,(bool,np.bool_)):
+                columns[name] = np.zeros(n_obs,dtype=bool)
+            elif isinstance(value,(float,np.floating)):
+                columns[name] = np.full(n_obs,np.nan)
+            else:
+                columns[name] = np.full(n_obs,np.nan,dtype=object)
+        columns[name][i] = value
+
+
+def store_block(columns,start,n_rows,computed,static_row):
+    """
+    Stores the rows of a block: the columns computed over the block, the others as on the last callback row (static_row).
+    """
+    rows = slice(start,start + n_rows)
+    for name in columns:
+        columns[name][rows] = computed[name] if name in computed else static_row.get(name,np.nan)
+
+
+def block_rows(n_rows,block,row_fees_0,row_fees_1):
+    """
+    ROW_COLUMNS of the first n_rows rows of a block where no trigger fired, computed from the block.
+    """
+    keep          = slice(0,n_rows)
+    price         = block.price[keep]
+    token_0       = block.token_0[:,keep]
+    token_1       = block.token_1[:,keep]
+    uncollected_0 = block.token_0_fees_uncollected[keep]
+    uncollected_1 = block.token_1_fees_uncollected[keep]
+    allocated_0   = token_0.sum(axis=0)
+    allocated_1   = token_1.sum(axis=0)
+    total_0       = allocated_0 + block.token_0_left_over + uncollected_0
+    total_1       = allocated_1 + block.token_1_left_over + uncollected_1
+
+    columns = {'time':                       block.time[keep],
+               'price':                      price,
+               'reset_point':                False,
+               'compound_point':             False,
+               'reset_reason':               '',
+               'token_0_fees':               row_fees_0[keep],
+               'token_1_fees':               row_fees_1[keep],
+               'token_0_fees_uncollected':   uncollected_0,
+               'token_1_fees_uncollected':   uncollected_1,
+               'token_0_allocated':          allocated_0,
+               'token_1_allocated':          allocated_1,
+               'token_0_total':              total_0,
+               'token_1_total':              total_1,
+               'value_position_in_token_0':  total_0 + total_1 / price,
+               'value_allocated_in_token_0': allocated_0 + allocated_1 / price,
+               'value_left_over_in_token_0': block.token_0_left_over + block.token_1_left_over / price}
+    if len(block.liquidity_ranges) > 1:
+        columns['base_position_value_in_token_0']  = token_0[0] + token_1[0] / price
+        columns['limit_position_value_in_token_0'] = token_0[1] + token_1[1] / price
+    return columns
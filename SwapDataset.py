@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+import json
+
+##############################################################
+# Memory-mapped swap dataset
+# The simulation-critical swap columns in a fixed binary layout:
+#     8 byte magic, 8 byte little-endian header length, JSON header, then one contiguous 64-byte aligned block per column
+# Opening a dataset maps the file read-only, so any number of processes share the same pages through the OS cache,
+# and every column is a NumPy view: nothing is copied or materialized as a DataFrame.
+##############################################################
+
+MAGIC     = b'UNISWAP1'
+ALIGNMENT = 64
+# Column name and little-endian dtype, times are int64 nanoseconds since the epoch (UTC)
+COLUMNS   = [('time','<i8'),('tick_swap','<i4'),('token_0_in','|b1'),('virtual_liquidity','<f8'),('traded_in','<f8')]
+
+
+def time_ns(times):
+    """
+    int64 nanoseconds since the epoch (UTC) of a DatetimeIndex, array of datetimes or a single time. Naive times are UTC.
+    """
+    if np.ndim(times) == 0:
+        timestamp = pd.Timestamp(times)
+        return (timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp).value
+    times = pd.DatetimeIndex(times)
+    if times.tz is None:
+        times = times.tz_localize('UTC')
+    return times.asi8
+
+
+class SwapArrays:
+    """
+    Swap columns as NumPy arrays sorted by time. The arrays can be memory-mapped (open_swap_dataset) or in memory (from_frame).
+    """
+    def __init__(self,time,tick_swap,token_0_in,virtual_liquidity,traded_in):
+
+        self.time              = time
+        self.tick_swap         = tick_swap
+        self.token_0_in        = token_0_in
+        self.virtual_liquidity = virtual_liquidity
+        self.traded_in         = traded_in
+
+    def __len__(self):
+        return len(self.time)
+
+    @classmethod
+    def from_frame(cls,swap_data):
+        """
+        Converts a swap DataFrame (time index, tick_swap, token_in, virtual_liquidity and traded_in columns) to compact arrays.
+        """
+        return cls(time_ns(swap_data.index),
+                   swap_data['tick_swap'].to_numpy(dtype=np.int32),
+                   (swap_data['token_in'] == 'token0').to_numpy(),
+                   swap_data['virtual_liquidity'].to_numpy(dtype=np.float64),
+                   swap_data['traded_in'].to_numpy(dtype=np.float64))
+
+    def between(self,time_begin,time_end):
+        """
+        View of the swaps with time_begin <= time <= time_end, as DataFrame slicing with times does.
+        """
+        start = np.searchsorted(self.time,time_ns(time_begin),side='left')
+        end   = np.searchsorted(self.time,time_ns(time_end),  side='right')
+        return SwapArrays(self.time[start:end],self.tick_swap[start:end],self.token_0_in[start:end],
+                          self.virtual_liquidity[start:end],self.traded_in[start:end])
+
+    def to_frame(self):
+        """
+        Copies the swaps into a DataFrame with the columns used by the simulations.
+        """
+        return pd.DataFrame({'tick_swap':         self.tick_swap,
+                             'token_in':          np.where(self.token_0_in,'token0','token1'),
+                             'virtual_liquidity': self.virtual_liquidity,
+                             'traded_in':         self.traded_in},
+                            index=pd.DatetimeIndex(pd.to_datetime(self.time,utc=True),name='time_pd'))
+
+
+def fee_columns(swaps):
+    """
+    Tick, token 0 in, virtual liquidity and traded amount of each swap as NumPy arrays, from a swap DataFrame or SwapArrays.
+    """
+    if isinstance(swaps,SwapArrays):
+        return swaps.tick_swap,swaps.token_0_in,swaps.virtual_liquidity,swaps.traded_in
+    return (swaps['tick_swap'].to_numpy(),
+            (swaps['token_in'] == 'token0').to_numpy(),
+            swaps['virtual_liquidity'].to_numpy(dtype=float),
+            swaps['traded_in'].to_numpy(dtype=float))
+
+
+def swap_times(swaps):
+    """
+    Time of each swap in int64 nanoseconds (UTC), from a swap DataFrame or SwapArrays.
+    """
+    if isinstance(swaps,SwapArrays):
+        return swaps.time
+    return time_ns(swaps.index)
+
+
+def write_swap_dataset(swap_data,path):
+    """
+    Writes a swap DataFrame (or SwapArrays) to path in the fixed memory-mappable layout.
+    """
+    arrays = swap_data if isinstance(swap_data,SwapArrays) else SwapArrays.from_frame(swap_data.sort_index(kind='stable'))
+    n_rows = len(arrays)
+
+    # Lay out the column blocks after a header padded to the alignment
+    columns = []
+    offset  = 0
+    for name,dtype in COLUMNS:
+        columns.append({'name':name,'dtype':dtype,'offset':offset})
+        offset += -(-n_rows*np.dtype(dtype).itemsize // ALIGNMENT) * ALIGNMENT
+    header      = json.dumps({'n_rows':n_rows,'columns':columns}).encode()
+    data_start  = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    with open(path,'wb') as output:
+        output.write(MAGIC)
+        output.write(np.uint64(len(header)).astype('<u8').tobytes())
+        output.write(header)
+        for column in columns:
+            output.seek(data_start + column['offset'])
+            output.write(np.ascontiguousarray(getattr(arrays,column['name']),dtype=column['dtype']).tobytes())
+        output.truncate(data_start + offset)
+
+
+def open_swap_dataset(path):
+    """
+    Maps a swap dataset read-only and returns its columns as SwapArrays of NumPy views on the file.
+    """
+    with open(path,'rb') as input:
+        if input.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path+' is not a swap dataset')
+        header_length = int(np.frombuffer(input.read(8),dtype='<u8')[0])
+        header        = json.loads(input.read(header_length))
+    data_start = -(-(len(MAGIC) + 8 + header_length) // ALIGNMENT) * ALIGNMENT
+    n_rows     = header['n_rows']
+
+    if n_rows == 0:
+        return SwapArrays(*[np.empty(0,dtype=column['dtype']) for column in header['columns']])
+
+    arrays = {column['name']: np.memmap(path,dtype=column['dtype'],mode='r',offset=data_start + column['offset'],shape=(n_rows,))
+              for column in header['columns']}
+    return SwapArrays(**arrays)
@@ -5,6 +5,8 @@ Created on Mon Jun 14 18:53:09 2021
 @author: JNP
 """
 
+import numpy as np
+
 
 
 '''liquitidymath'''
@@ -57,6 +59,29 @@ def get_amounts(tick,tickA,tickB,liquidity,decimal0,decimal1):
         amount1=get_amount1(sqrtA,sqrtB,liquidity,decimal1)
         return 0,amount1
 
+'''get_amounts_array function'''
+#Vectorized 'get_amounts' over an array of current ticks, in floating point
+#tickA, tickB and liquidity can be arrays too (one position per element), broadcast against tick
+#The branch for each tick is chosen by comparing ticks, equivalent to comparing the sqrt prices
+def get_amounts_array(tick,tickA,tickB,liquidity,decimal0,decimal1):
+    
+    (tickA,tickB) = (np.minimum(tickA,tickB),np.maximum(tickA,tickB))
+    
+    tick  = np.asarray(tick)
+    sqrt  = np.floor(1.0001**(tick/2)*(2**96))
+    sqrtA = np.floor(1.0001**(tickA/2)*(2**96))
+    sqrtB = np.floor(1.0001**(tickB/2)*(2**96))
+    liquidity = np.asarray(liquidity,dtype=float)
+    
+    below    = tick <= tickA
+    above    = tick >= tickB
+    sqrt_in  = np.clip(sqrt,sqrtA,sqrtB)
+    
+    amount0  = np.where(above,0.0,liquidity*2**96*(sqrtB-np.where(below,sqrtA,sqrt_in))/sqrtB/np.where(below,sqrtA,sqrt_in)/10**decimal0)
+    amount1  = np.where(below,0.0,liquidity*(np.where(above,sqrtB,sqrt_in)-sqrtA)/2**96/10**decimal1)
+    
+    return amount0,amount1
+
 '''get token amounts relation'''
 #Use this formula to calculate amount of t0 based on amount of t1 (required before calculate liquidity)
 #relation = t1/t0      
@@ -117,7 +142,26 @@ def get_liquidity(tick,tickA,tickB,amount0,amount1,decimal0,decimal1):
             return liquidity1
 
 
-        
-
-        
-        
\ No newline at end of file
+'''get_liquidity_array function'''
+#Vectorized 'get_liquidity' over arrays of ticks and amounts (one position per element), in floating point
+#Liquidity is rounded down as in 'get_liquidity'; empty ranges (tickA == tickB) get no liquidity
+def get_liquidity_array(tick,tickA,tickB,amount0,amount1,decimal0,decimal1):
+    
+    (tickA,tickB) = (np.minimum(tickA,tickB),np.maximum(tickA,tickB))
+    
+    sqrt  = np.floor(1.0001**(np.asarray(tick)/2)*(2**96))
+    sqrtA = np.floor(1.0001**(tickA/2)*(2**96))
+    sqrtB = np.floor(1.0001**(tickB/2)*(2**96))
+    
+    below    = sqrt <= sqrtA
+    above    = sqrt >= sqrtB
+    sqrt_in  = np.clip(sqrt,sqrtA,sqrtB)
+    
+    with np.errstate(divide='ignore',invalid='ignore'):
+        liquidity0 = np.asarray(amount0)/((2**96*(sqrtB-np.where(below,sqrtA,sqrt_in))/sqrtB/np.where(below,sqrtA,sqrt_in))/10**decimal0)
+        liquidity1 = np.asarray(amount1)/((np.where(above,sqrtB,sqrt_in)-sqrtA)/2**96/10**decimal1)
+    
+    liquidity = np.where(below,liquidity0,np.where(above,liquidity1,np.minimum(liquidity0,liquidity1)))
+    liquidity = np.where(np.isfinite(liquidity) & (sqrtB > sqrtA),liquidity,0.0)
+    
+    return np.floor(liquidity)
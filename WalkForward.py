@@ -0,0 +1,124 @@
+import pandas as pd
+import os
+import ActiveStrategyFramework
+import SimulationCache
+import ResultsStore
+from concurrent.futures import ProcessPoolExecutor
+
+##############################################################
+# Walk-forward (rolling window) backtests
+# The data is cut in consecutive train/test windows. A strategy is built from the model data of each training window
+# and simulated out of sample on the following test window, and the test windows run in parallel processes.
+# Preprocessing that only looks back (eg. aggregate_price_data for ResetStrategy, AutoRegressiveStrategy.clean_data_for_garch)
+# is done once over the whole range and sliced for every training window, instead of once per window.
+##############################################################
+
+# Simulation inputs of the worker processes, set once per process by set_worker_data
+WORKER_DATA = None
+
+
+def set_worker_data(data):
+    global WORKER_DATA
+    WORKER_DATA = data
+
+
+def walk_forward_windows(index,train,test,step=None,anchored=False):
+    """
+    Train/test windows over a DatetimeIndex: training on [train_begin,train_end), testing on [train_end,test_end]
+    (the test window includes the observation at test_end, so a window of N days is simulated and annualized over N days).
+    train, test and step are anything pd.Timedelta accepts; windows move forward by step (test by default).
+    With anchored=True every training window starts at the beginning of the data (expanding window).
+    Returns a DataFrame with one row per window whose test window ends within the data.
+    """
+    train   = pd.Timedelta(train)
+    test    = pd.Timedelta(test)
+    step    = test if step is None else pd.Timedelta(step)
+    first   = index.min()
+    last    = index.max()
+    windows = []
+    begin   = first
+    while begin + train + test <= last + pd.Timedelta(1,'ns'):
+        windows.append({'train_begin': first if anchored else begin,
+                        'train_end':   begin + train,
+                        'test_begin':  begin + train,
+                        'test_end':    begin + train + test})
+        begin = begin + step
+    return pd.DataFrame(windows,columns=['train_begin','train_end','test_begin','test_end'])
+
+
+def window_slice(data,begin,end):
+    """
+    Rows of time indexed data with begin <= time < end.
+    """
+    return data.loc[begin:end - pd.Timedelta(1,'ns')]
+
+
+def run_window(task):
+    """
+    Builds the strategy of one training window and parameter set and simulates it on the test window.
+    Runs in the worker processes, with the inputs of WORKER_DATA. Returns the out-of-sample metrics (or the error raised).
+    """
+    window_id,window,params_id,params = task
+    data                    = WORKER_DATA
+    try:
+        strategy    = data['make_strategy'](window_slice(data['model_data'],window['train_begin'],window['train_end']),params)
+        price_data  = data['price_data'].loc[window['test_begin']:window['test_end']]
+        simulations = SimulationCache.run_simulation(data['simulate'],price_data,data['swap_data'],strategy,data['liquidity_in_0'],
+                                                     data['liquidity_in_1'],data['fee_tier'],data['decimals_0'],data['decimals_1'],
+                                                     cache=data['cache'],swap_fingerprint=data['swap_fingerprint'])
+        series      = ActiveStrategyFramework.generate_simulation_series(simulations,strategy,data['token_0_usd_data'])
+        metrics     = ActiveStrategyFramework.analyze_strategies(series.assign(simulation=0),frequency=data['frequency']).iloc[0].to_dict()
+        error       = None
+    except Exception as exception:
+        series      = None
+        metrics     = {}
+        error       = repr(exception)
+    result = dict({'window':window_id,'params_id':params_id,'params':params,'error':error},**window,**metrics)
+    return result,(series if data['keep_series'] else None)
+
+
+def run_walk_forward(make_strategy,model_data,price_data,swap_data,windows,liquidity_in_0,liquidity_in_1,fee_tier,decimals_0,decimals_1,
+                     params_list=None,preprocess=None,token_0_usd_data=None,frequency='M',max_workers=None,
+                     simulate=ActiveStrategyFramework.simulate_strategy,keep_series=False,cache=False):
+    """
+    Runs a walk-forward backtest over windows (see walk_forward_windows).
+    make_strategy(train_model_data,params) builds the strategy from the model data of a training window, for each of params_list
+    (a single None by default). preprocess(model_data) is applied once to the whole model data before it is sliced per window,
+    eg. lambda data: AutoRegressiveStrategy.clean_data_for_garch(data) with make_strategy passing clean_model_data=False.
+    Test windows run in max_workers processes; make_strategy, preprocess and simulate must then be picklable (module level functions).
+    With cache (True for SimulationCache.default_cache(), or a SimulationCache.SimulationCache) simulations of inputs seen before
+    are read back instead of run again.
+    Returns a dict with the out-of-sample metrics of every window and parameter set ('windows'), their mean, standard deviation
+    minimum and maximum across windows per parameter set (position in params_list, 'summary'), and the simulation series per (window,params) if keep_series.
+    """
+    max_workers  = os.cpu_count() if max_workers is None else max_workers
+    if len(windows) > 0 and (windows['test_end'] - windows['test_begin']).min() < pd.Timedelta(days=1):
+        raise ValueError('A test window covers less than a day ('+str((windows['test_end'] - windows['test_begin']).min())+
+                         '), where the annualized metrics are undefined: use test windows of a day or more')
+    params_list  = [None] if params_list is None else list(params_list)
+    model_data   = model_data if preprocess is None else preprocess(model_data)
+    worker_data  = {'make_strategy':make_strategy,'simulate':simulate,'model_data':model_data,'price_data':price_data,'swap_data':swap_data,
+                    'liquidity_in_0':liquidity_in_0,'liquidity_in_1':liquidity_in_1,'fee_tier':fee_tier,'decimals_0':decimals_0,
+                    'decimals_1':decimals_1,'token_0_usd_data':token_0_usd_data,'frequency':frequency,'keep_series':keep_series,
+                    'cache':cache,'swap_fingerprint':None if not cache else ResultsStore.data_fingerprint(swap_data)}
+    tasks        = [(window_id,window,params_id,params) for window_id,window in enumerate(windows.to_dict('records'))
+                    for params_id,params in enumerate(params_list)]
+
+    if max_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers,initializer=set_worker_data,initargs=(worker_data,)) as executor:
+            outputs = list(executor.map(run_window,tasks))
+    else:
+        set_worker_data(worker_data)
+        outputs = [run_window(task) for task in tasks]
+
+    results = pd.DataFrame([result for result,series in outputs])
+    metrics = [x for x in results.columns if x not in ('window','params','params_id','error','train_begin','train_end','test_begin','test_end')]
+    summary = results.groupby('params_id')[metrics].agg(['mean','std','min','max']) if len(metrics) > 0 else pd.DataFrame()
+    if len(summary) > 0:
+        summary.insert(0,'params',[params_list[x] for x in summary.index])
+        summary.insert(1,'n_windows',results.groupby('params_id')['error'].apply(lambda x: x.isna().sum()))
+
+    output = {'windows':results,'summary':summary}
+    if keep_series:
+        output['series'] = {(result['window'],result['params_id']): series for result,series in outputs}
+    return output
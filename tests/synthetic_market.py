@@ -0,0 +1,22 @@
+import math
+import numpy as np
+import pandas as pd
+
+
+def synthetic_market(n_minutes,seed=0,volatility=2e-3,swaps_per_minute=1):
+    """
+    Minute prices of a geometric random walk and swaps at random times between them, ticked at the last price
+    (decimals 18/18). Returns the price Series, the swap DataFrame and hourly model data with price returns.
+    """
+    rng     = np.random.default_rng(seed)
+    index   = pd.date_range('2022-01-01',periods=n_minutes,freq='min',tz='UTC')
+    prices  = pd.Series(1000*np.exp(np.cumsum(rng.normal(0,volatility,n_minutes))),index=index,name='quotePrice')
+    n_swaps = swaps_per_minute*n_minutes
+    times   = index[0] + pd.to_timedelta(np.sort(rng.integers(0,(n_minutes-1)*60,n_swaps)),unit='s')
+    swaps   = pd.DataFrame({'tick_swap':         np.floor(np.log(prices.reindex(times,method='ffill').to_numpy())/math.log(1.0001)).astype(int),
+                            'token_in':          np.where(rng.random(n_swaps) < .5,'token0','token1'),
+                            'virtual_liquidity': rng.uniform(1e5,1e6,n_swaps),
+                            'traded_in':         rng.exponential(1.,n_swaps)},index=pd.DatetimeIndex(times,name='time_pd'))
+    model   = pd.DataFrame({'quotePrice':prices.resample('h').last()})
+    model['price_return'] = model['quotePrice'].pct_change()
+    return prices,swaps,model.dropna()
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import ARGarchModel
+
+
+def simulate_ar_garch(n_obs,seed=0,mu=1e-4,phi=0.1,omega=2e-6,alpha=0.08,beta=0.9):
+    rng      = np.random.default_rng(seed)
+    returns  = np.zeros(n_obs)
+    variance = omega/(1 - alpha - beta)
+    resid    = 0.0
+    for t in range(1,n_obs):
+        variance   = omega + alpha*resid**2 + beta*variance
+        resid      = variance**0.5 * rng.standard_normal()
+        returns[t] = mu + phi*returns[t-1] + resid
+    return returns
+
+
+def scaled_window(returns,scale):
+    y        = np.atleast_2d(returns * scale)
+    mu,phi   = ARGarchModel.ols_ar_1(y)
+    backcast = ARGarchModel.compute_backcast(y[:,1:] - mu[:,None] - phi[:,None]*y[:,:-1])
+    return y,backcast
+
+
+def test_gradient_matches_finite_differences():
+    y,backcast = scaled_window(simulate_ar_garch(500),100.0)
+    params     = np.array([[0.01,0.05,0.02,0.1,0.85]])
+    _,gradient = ARGarchModel.ar_garch_log_likelihood(params,y,backcast,return_gradient=True)
+
+    for j in range(ARGarchModel.N_PARAMS):
+        step        = 1e-6 * max(1.0,abs(params[0,j]))
+        up,down     = params.copy(),params.copy()
+        up[0,j]    += step
+        down[0,j]  -= step
+        numerical   = (ARGarchModel.ar_garch_log_likelihood(up,y,backcast) - ARGarchModel.ar_garch_log_likelihood(down,y,backcast))/(2*step)
+        assert gradient[0,j] == pytest.approx(numerical[0],rel=1e-5,abs=1e-6)
+
+
+def test_batch_fit_matches_single_fits():
+    windows = np.vstack([simulate_ar_garch(400,seed=x) for x in range(3)])
+    batch   = ARGarchModel.forecast_ar_garch_batch(ARGarchModel.fit_ar_garch_batch(windows))
+    for i in range(len(windows)):
+        single = ARGarchModel.forecast_ar_garch(windows[i])
+        assert batch['sd_forecast'][i]     == pytest.approx(single['sd_forecast'],rel=1e-6)
+        assert batch['return_forecast'][i] == pytest.approx(single['return_forecast'],rel=1e-6,abs=1e-12)
+
+
+def test_log_likelihood_matches_arch():
+    arch    = pytest.importorskip('arch')
+    returns = simulate_ar_garch(1500,seed=1)
+    model   = arch.univariate.ARX(returns,lags=1,rescale=True)
+    model.volatility = arch.univariate.GARCH(p=1,q=1)
+    result  = model.fit(disp='off')
+
+    y,backcast     = scaled_window(returns,result.scale)
+    log_likelihood = ARGarchModel.ar_garch_log_likelihood(result.params.to_numpy()[None,:],y,backcast)
+    assert log_likelihood[0] == pytest.approx(result.loglikelihood,rel=1e-8)
+
+    fit = ARGarchModel.fit_ar_garch_batch(returns)
+    assert fit['scale'][0] == result.scale
+    assert fit['log_likelihood'][0] >= result.loglikelihood - 1e-4
+
+
+@pytest.mark.parametrize('seed',[1,2,3])
+def test_forecast_matches_arch(seed):
+    pytest.importorskip('arch')
+    comparison = ARGarchModel.compare_with_arch(simulate_ar_garch(1000,seed=seed))
+    assert comparison['agree'], comparison
@@ -0,0 +1,18 @@
+import types
+import pytest
+import AutoRegressiveStrategy
+
+
+def observation(limit_token_1):
+    base  = {'token_0':1.0,'token_1':1000.0}
+    limit = {'token_0':0.0,'token_1':limit_token_1}
+    return types.SimpleNamespace(price=1000.0,liquidity_ranges=[base,limit])
+
+
+@pytest.mark.parametrize('placed_token_1,limit_token_1,possible',[(30.0,100.0,False),(50.0,100.0,True),(50.0,10000.0,True)])
+def test_compound_threshold_counts_the_base_range_for_every_range(monkeypatch,placed_token_1,limit_token_1,possible):
+    # Compounds when the placed tokens add more than 1% to the base range's assets (2000 in token 1) times the number of ranges,
+    # whatever the limit range holds
+    strategy = AutoRegressiveStrategy.AutoRegressiveStrategy.__new__(AutoRegressiveStrategy.AutoRegressiveStrategy)
+    monkeypatch.setattr(strategy,'place_unused_tokens',lambda current_strat_obs: ([0.0,0.0],[placed_token_1,0.0]))
+    assert strategy.check_compound_possible(observation(limit_token_1)) == possible
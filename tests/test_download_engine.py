@@ -0,0 +1,174 @@
+import json
+import re
+import pytest
+import DownloadEngine
+import GetPoolData
+
+
+class StubResponse:
+    def __init__(self,status_code=200,body=None,headers=None):
+        self.status_code = status_code
+        self.content     = body if isinstance(body,bytes) else json.dumps(body).encode()
+        self.headers     = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class StubSession:
+    """
+    Stands in for requests.Session: answers each post with handler(url,payload), recording the payloads.
+    """
+    def __init__(self,handler):
+        self.handler  = handler
+        self.payloads = []
+
+    def post(self,url,json=None,headers=None,timeout=None):
+        self.payloads.append(json)
+        return self.handler(url,json)
+
+
+def stub_client(handler):
+    client         = DownloadEngine.RequestClient(max_workers=1)
+    client.session = StubSession(handler)
+    return client
+
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(DownloadEngine,'ENDPOINTS',{})
+    monkeypatch.setattr(DownloadEngine,'backoff_delay',lambda attempt: 0.0)
+
+
+def fake_univ2_swaps(n_swaps,timestamp_begin=1_640_995_200,step=97):
+    # Ids are not in time order, as in the subgraph
+    return [{'id':'0x%04x' % ((i*7919) % 10007),'timestamp':str(timestamp_begin + i*step),
+             'amount0In':'1.0','amount1In':'0','amount0Out':'0','amount1Out':'2.0','amountUSD':'2.0'}
+            for i in range(n_swaps)]
+
+
+def univ2_subgraph(swaps):
+    """
+    Handler answering generate_swap_univ2_payload queries: timestamp filter, id_gt pagination, first rows ordered by id.
+    """
+    def handler(url,payload):
+        query    = payload['query']
+        begin    = int(re.search(r'timestamp_gte:"(\d+)"',query).group(1))
+        end      = int(re.search(r'timestamp_lte:"(\d+)"',query).group(1))
+        first    = int(re.search(r'first: (\d+)',query).group(1))
+        after    = payload['variables']['paginateId']
+        matching = sorted((x for x in swaps if begin <= int(x['timestamp']) <= end and x['id'] > after),key=lambda x: x['id'])
+        return StubResponse(body={'data':{'swaps':matching[:first]}})
+    return handler
+
+
+def test_time_shards_cover_range_without_overlap():
+    shards = DownloadEngine.time_shards(100,1099,7)
+    assert shards[0][0] == 100 and shards[-1][1] == 1099
+    assert all(shards[i][1] + 1 == shards[i+1][0] for i in range(len(shards)-1))
+    assert sum(end - begin + 1 for begin,end in shards) == 1000
+    assert DownloadEngine.time_shards(5,7,10) == [(5,5),(6,6),(7,7)]
+    assert DownloadEngine.time_shards(10,9,3) == []
+
+
+def test_date_and_block_shards():
+    assert DownloadEngine.date_shards('2022-01-01','2022-01-10',3) == [('2022-01-01','2022-01-03'),('2022-01-04','2022-01-06'),('2022-01-07','2022-01-10')]
+    assert DownloadEngine.date_shards('2022-01-01 12:00','2022-01-02',1) == [('2022-01-01 12:00','2022-01-02')]
+    assert DownloadEngine.block_shards(10,34,10) == [(10,19),(20,29),(30,34)]
+
+
+def test_merge_shards_drops_boundary_duplicates_in_order():
+    shards = [[{'id':'a'},{'id':'b'}],[{'id':'b','dup':True},{'id':'c'}],[],[{'id':'d'},{'id':'a'}]]
+    merged = DownloadEngine.merge_shards(shards,key=lambda x: x['id'])
+    assert [x['id'] for x in merged] == ['a','b','c','d']
+    assert 'dup' not in merged[1]
+
+
+def test_fetch_adaptive_range_splits_refused_ranges():
+    calls = []
+    def fetch_range(begin,end):
+        calls.append((begin,end))
+        if end - begin + 1 > 3:
+            raise ValueError('too many results')
+        return list(range(begin,end+1))
+
+    rows = DownloadEngine.fetch_adaptive_range(fetch_range,0,9,lambda error: 'too many' in str(error))
+    assert rows == list(range(10))
+    assert calls[0] == (0,9)
+    with pytest.raises(KeyError):
+        DownloadEngine.fetch_adaptive_range(lambda begin,end: {}[begin],0,9,lambda error: False)
+
+
+def test_paginate_by_id_through_stub_transport():
+    swaps  = fake_univ2_swaps(250)
+    client = stub_client(univ2_subgraph(swaps))
+    query  = GetPoolData.generate_swap_univ2_payload('0xpair','2022-01-01','2022-02-01','100')
+    rows   = DownloadEngine.paginate_by_id(lambda paginate_id: client.post_json('stub://v2',{'query':query,'variables':{'paginateId':paginate_id}})['data']['swaps'])
+
+    assert sorted(x['id'] for x in rows) == sorted(x['id'] for x in swaps)
+    # Three full pages and the empty page that ends the pagination
+    assert len(client.session.payloads) == 4
+
+
+def test_retries_throttling_and_resumable_pagination():
+    responses = [StubResponse(429,{},{'Retry-After':'0'}),StubResponse(503,{}),StubResponse(body={'data':{'swaps':[{'id':'1'}]}})]
+    client    = stub_client(lambda url,payload: responses.pop(0))
+    assert client.post_json('stub://retry',{})['data']['swaps'] == [{'id':'1'}]
+    assert DownloadEngine.ENDPOINTS['stub://retry'][1].throttled == 1
+
+    pages  = {'':[{'id':'1'},{'id':'2'}],'2':None}
+    def handler(url,payload):
+        page = pages[payload['variables']['paginateId']]
+        return StubResponse(400,{}) if page is None else StubResponse(body={'data':{'swaps':page}})
+    client = stub_client(handler)
+    with pytest.raises(DownloadEngine.PaginationError) as error:
+        DownloadEngine.paginate_by_id(lambda paginate_id: client.post_json('stub://page',{'variables':{'paginateId':paginate_id}})['data']['swaps'])
+    assert error.value.cursor == '2'
+    assert [x['id'] for x in error.value.rows] == ['1','2']
+
+
+def test_graphql_errors_are_raised_after_retries():
+    client = stub_client(lambda url,payload: StubResponse(body={'errors':[{'message':'bad query'}]}))
+    with pytest.raises(DownloadEngine.GraphQLError,match='bad query'):
+        client.post_json('stub://graphql',{})
+    assert len(client.session.payloads) == DownloadEngine.MAX_GRAPHQL_RETRIES + 1
+
+
+@pytest.mark.parametrize('n_shards',[2,5])
+def test_sharded_download_matches_single_shard(tmp_path,monkeypatch,n_shards):
+    pytest.importorskip('pyarrow')
+    monkeypatch.chdir(tmp_path)
+    swaps   = fake_univ2_swaps(2500)
+    session = StubSession(univ2_subgraph(swaps))
+    monkeypatch.setattr(DownloadEngine,'make_session',lambda max_workers=1: session)
+
+    single  = GetPoolData.download_swap_univ2_subgraph('0xpair','single','2022-01-01','2022-01-05',True,False)
+    sharded = GetPoolData.download_swap_univ2_subgraph('0xpair','sharded','2022-01-01','2022-01-05',True,False,n_shards=n_shards,max_workers=3)
+
+    assert len(single) == len(swaps)
+    assert sorted(sharded['id']) == sorted(single['id'])
+    assert sharded['id'].is_unique
+
+
+def test_rate_recovers_below_the_throttled_rate():
+    limiter = DownloadEngine.TokenBucket(DownloadEngine.LIMITED_RATE,DownloadEngine.MAX_RATE)
+    for _ in range(40):
+        limiter.on_success()
+    throttled = limiter.rate
+    limiter.on_throttle()
+    assert limiter.rate == pytest.approx(throttled/2)
+    for _ in range(1000):
+        limiter.on_success()
+    assert limiter.rate == pytest.approx(throttled*DownloadEngine.RECOVERY_CAP)
+
+
+def test_non_json_body_is_retried():
+    responses = [StubResponse(body=b'<html>Bad gateway</html>'),StubResponse(body={'data':{'swaps':[]}})]
+    client    = stub_client(lambda url,payload: responses.pop(0))
+    assert client.post_json('stub://html',{}) == {'data':{'swaps':[]}}
+    assert DownloadEngine.ENDPOINTS['stub://html'][1].retries == 1
+
+    client    = stub_client(lambda url,payload: StubResponse(body=b'not json'))
+    client.max_retries = 2
+    with pytest.raises(DownloadEngine.RequestFailed,match='not JSON'):
+        client.post_json('stub://html',{})
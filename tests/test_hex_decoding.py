@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import GetPoolData
+
+INT64_VALUES = [0,1,-1,2**63 - 1,-2**63,2**32,-2**32 - 7]
+# Beyond int64, including values whose two's complement carries across 64 bit limbs
+LARGE_VALUES = [2**255 - 1,-2**255,2**63,-2**63 - 1,-2**64,2**64,-2**128,2**96 + 12345,-(2**160 - 1)]
+
+
+def word(value):
+    return '0x%064x' % (value % 2**256)
+
+
+def test_signed_words_match_signed_int():
+    values   = INT64_VALUES + LARGE_VALUES
+    words    = [word(x) for x in values]
+    expected = [GetPoolData.signed_int(x) for x in words]
+    assert expected == values
+
+    assert GetPoolData.decode_hex_words(words,dtype='object').tolist() == expected
+    np.testing.assert_allclose(GetPoolData.decode_hex_words(words,dtype='float64'),[float(x) for x in expected],rtol=1e-15,atol=0)
+    assert GetPoolData.decode_hex_words(words[:len(INT64_VALUES)]).tolist() == INT64_VALUES
+    assert GetPoolData.decode_hex_words(words[:len(INT64_VALUES)]).dtype == np.int64
+
+
+def test_unsigned_words():
+    words = [word(2**256 - 1),word(2**255),word(2**63),word(5)]
+    assert GetPoolData.decode_hex_words(words,dtype='object',signed=False).tolist() == [2**256 - 1,2**255,2**63,5]
+    np.testing.assert_allclose(GetPoolData.decode_hex_words(words,dtype='float64',signed=False),[2.0**256,2.0**255,2.0**63,5.0],rtol=1e-15)
+    assert GetPoolData.decode_hex_words([word(2**63 - 1)],signed=False).tolist() == [2**63 - 1]
+    with pytest.raises(OverflowError):
+        GetPoolData.decode_hex_words([word(2**63)],signed=False)
+
+
+@pytest.mark.parametrize('value',[2**63,-2**63 - 1,2**255 - 1,-2**255,-2**64])
+def test_int64_overflow_is_raised(value):
+    with pytest.raises(OverflowError):
+        GetPoolData.decode_hex_words([word(0),word(value)])
+
+
+@pytest.mark.parametrize('bad_word',['0x1234',word(1)[2:],word(1) + '0','0X' + word(1)[2:],word(1)[:-1] + 'g',''])
+def test_malformed_words_are_rejected(bad_word):
+    with pytest.raises(ValueError):
+        GetPoolData.decode_hex_words([word(1),bad_word])
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ActiveStrategyFramework
+import MonteCarlo
+import ResetStrategy
+from synthetic_market import synthetic_market
+
+
+def test_historical_path_matches_simulate_reset_strategy():
+    prices,swaps,model = synthetic_market(2*1440)
+    # Without traded amounts the per step fee approximation earns nothing, so the path must follow the backtest exactly
+    swaps       = swaps.assign(traded_in=0.0)
+    steps       = MonteCarlo.historical_steps(prices,swaps)
+    # A single block as long as the history: one path made of the historical steps in order
+    paths       = MonteCarlo.bootstrap_paths(steps,1,len(steps),float(prices.iloc[0]),block_size=len(steps),seed=0)
+    path_prices = pd.Series(paths['price'][0],index=prices.index)
+    np.testing.assert_allclose(path_prices,prices,rtol=1e-12)
+
+    strategy    = ResetStrategy.ResetStrategy(model.iloc[:24],0.5,0.9,0.1)
+    results     = MonteCarlo.simulate_reset_paths(paths,strategy,1.0,1000.0,0.0005,18,18,keep_values=True)
+    backtest    = ActiveStrategyFramework.generate_simulation_series(
+                      ResetStrategy.simulate_reset_strategy(path_prices,swaps,strategy,1.0,1000.0,0.0005,18,18),strategy)
+
+    assert backtest['reset_point'].sum() > 10
+    assert results['rebalances'][0] == backtest['reset_point'].sum()
+    np.testing.assert_allclose(results['values'][0],backtest['value_position_in_token_0'],rtol=1e-12)
+    assert results['final_value'][0] == pytest.approx(backtest['value_position_in_token_0'].iloc[-1],rel=1e-12)
+    assert results['final_hold_value'][0] == pytest.approx(backtest['value_hold_usd'].iloc[-1],rel=1e-12)
+    assert results['cum_fees'][0] == 0.0
+
+
+def test_summarize_paths_tail_risk():
+    # Net returns -0.99, -0.98, ..., 0.00 in random order
+    values  = np.random.default_rng(0).permutation(np.arange(-99,1)/100)
+    results = {metric: values for metric in MonteCarlo.PATH_METRICS}
+    summary = MonteCarlo.summarize_paths(results,quantiles=[0.05,0.5])
+
+    tail    = summary['tail']
+    assert tail[('net_return','var_0.05')] == pytest.approx(np.quantile(values,0.05))
+    assert tail[('net_return','var_0.05')] == pytest.approx(-0.9405)
+    # Mean of the 5 (and 1) worst paths
+    assert tail[('net_return','es_0.05')] == pytest.approx(-0.97)
+    assert tail[('net_return','es_0.01')] == pytest.approx(-0.99)
+    assert tail[('impermanent_loss','es_0.05')] == pytest.approx(-0.97)
+
+    distribution = summary['distribution']
+    assert list(distribution.index) == ['mean','std','q0.05','q0.5']
+    assert distribution.loc['mean','net_return'] == pytest.approx(-0.495)
+    assert distribution.loc['q0.5','final_value'] == pytest.approx(-0.495)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ActiveStrategyFramework
+
+COLUMNS = ['price','base_range_lower','base_range_upper']
+
+
+def plot_data(n_rows=100_000,seed=0):
+    rng   = np.random.default_rng(seed)
+    price = 1000*np.exp(np.cumsum(rng.normal(0,1e-3,n_rows)))
+    data  = pd.DataFrame({'time':pd.date_range('2022-01-01',periods=n_rows,freq='min',tz='UTC'),'price':price,
+                          'base_range_lower':price*rng.uniform(0.9,0.99,n_rows),'base_range_upper':price*rng.uniform(1.01,1.1,n_rows)})
+    data.loc[rng.integers(0,n_rows,100),'base_range_lower'] = np.nan
+    return data.set_index('time',drop=False)
+
+
+@pytest.mark.parametrize('max_points',[4000,500,9])
+def test_extremes_and_kept_rows_survive_within_the_budget(max_points):
+    data    = plot_data()
+    keep    = np.zeros(len(data),dtype=bool)
+    keep[np.random.default_rng(1).integers(0,len(data),50)] = True
+    sampled = ActiveStrategyFramework.downsample_plot_data(data,COLUMNS,max_points,keep)
+
+    assert len(sampled) <= max_points + keep.sum()
+    assert sampled.index.is_monotonic_increasing and sampled.index.is_unique
+    assert sampled.index[0] == data.index[0] and sampled.index[-1] == data.index[-1]
+    assert set(data.index[keep]) <= set(sampled.index)
+    for column in COLUMNS:
+        assert sampled[column].min() == data[column].min()
+        assert sampled[column].max() == data[column].max()
+        assert data[column].idxmin() in sampled.index and data[column].idxmax() in sampled.index
+
+
+def test_small_series_are_drawn_whole():
+    data = plot_data(1000)
+    assert ActiveStrategyFramework.downsample_plot_data(data,COLUMNS,4000) is data
+    assert ActiveStrategyFramework.downsample_plot_data(data,COLUMNS,None) is data
+    # Without keep, the rows are the first and last of each bucket and the bucket extremes
+    sampled = ActiveStrategyFramework.downsample_plot_data(data,COLUMNS,80)
+    assert 10 < len(sampled) <= 80
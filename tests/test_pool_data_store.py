@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+import GetPoolData
+import PoolDataStore
+
+pytest.importorskip('pyarrow')
+
+
+def hourly_rows(begin,end,value=0.0):
+    time_pd = pd.date_range(begin,end,freq='h',tz='UTC')
+    return pd.DataFrame({'time_pd':time_pd,'value':value + np.arange(len(time_pd),dtype=float)})
+
+
+@pytest.fixture
+def store(tmp_path):
+    root = str(tmp_path)
+    PoolDataStore.write_table(hourly_rows('2022-01-01','2022-01-03 23:00'),'swap','pool',root=root)
+    return root
+
+
+def stored_times(root,**kwargs):
+    return PoolDataStore.read_table('swap','pool',root=root,**kwargs).index
+
+
+def test_read_table_date_string_includes_whole_end_day(store):
+    assert len(stored_times(store,date_begin='2022-01-02',date_end='2022-01-02')) == 24
+    assert len(stored_times(store,date_begin='2022-01-02',date_end=pd.Timestamp('2022-01-02'))) == 1
+
+
+def test_overwrite_replaces_only_the_dates_written(store):
+    PoolDataStore.write_table(hourly_rows('2022-01-02 06:00','2022-01-02 07:00',value=100.0),'swap','pool',root=store)
+    stored = PoolDataStore.read_table('swap','pool',root=store)
+    assert len(stored) == 24 + 2 + 24
+    assert stored.loc['2022-01-02','value'].tolist() == [100.0,101.0]
+
+    PoolDataStore.write_table(hourly_rows('2022-01-03 00:00','2022-01-03 00:00',value=200.0),'swap','pool',root=store,mode='append')
+    assert len(stored_times(store,date_begin='2022-01-03',date_end='2022-01-03')) == 25
+
+
+def test_delete_dates_whole_days(store):
+    PoolDataStore.delete_dates('swap','pool','2022-01-02','2022-01-02',root=store)
+    times = stored_times(store)
+    assert len(times) == 48
+    assert not ((times >= '2022-01-02') & (times < '2022-01-03')).any()
+
+
+def test_delete_dates_keeps_the_rest_of_edge_days(store):
+    PoolDataStore.delete_dates('swap','pool','2022-01-01 18:00','2022-01-03 05:30',root=store)
+    stored = PoolDataStore.read_table('swap','pool',root=store)
+    times  = stored.index
+    assert len(times) == 18 + 18
+    assert times[17] == pd.Timestamp('2022-01-01 17:00',tz='UTC')
+    assert times[18] == pd.Timestamp('2022-01-03 06:00',tz='UTC')
+    # The kept rows are written back unchanged
+    assert stored['value'].iloc[18] == 2*24 + 6
+
+
+def test_stream_bigquery_replaces_only_the_streamed_range(tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def swaps(begin,end):
+        block_timestamp = pd.date_range(begin,end,freq='h',tz='UTC')
+        return pd.DataFrame({'block_timestamp':block_timestamp,'block_number':np.arange(len(block_timestamp)),
+                             'log_index':0,'amount0':'-1000000','amount1':'2000','sqrtPriceX96':str(2**96),
+                             'liquidity':'1000000000','tick':0})
+
+    class StubBigQuery:
+        def __init__(self,data):
+            self.data = data
+        def query(self,query):
+            return self
+        def result(self,page_size):
+            return self
+        def to_dataframe_iterable(self):
+            return [self.data.iloc[i:i+10].copy() for i in range(0,len(self.data),10)]
+
+    GetPoolData.stream_pool_data_bigquery('0xpool','2022-01-01','2022-01-03 23:00',6,6,'pool',client=StubBigQuery(swaps('2022-01-01','2022-01-03 23:00')))
+    n_rows = GetPoolData.stream_pool_data_bigquery('0xpool','2022-01-02 12:00','2022-01-02 15:00',6,6,'pool',client=StubBigQuery(swaps('2022-01-02 12:00','2022-01-02 15:00')))
+
+    stored = PoolDataStore.read_table('swap_bigquery','pool')
+    assert n_rows == 4
+    assert len(stored) == 72
+    assert stored.index.is_unique
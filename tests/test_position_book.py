@@ -0,0 +1,100 @@
+import copy
+import numpy as np
+import pytest
+import ActiveStrategyFramework
+import PositionBook
+import ResetStrategy
+import StrategyRules
+import UNI_v3_funcs
+from synthetic_market import synthetic_market
+
+
+class BookResetStrategy(ResetStrategy.ResetStrategy):
+    """
+    ResetStrategy holding its base and limit ranges in a PositionBook instead of a list of dicts.
+    """
+    def set_liquidity_ranges(self,current_strat_obs):
+        ranges,strategy_info = super().set_liquidity_ranges(current_strat_obs)
+        return PositionBook.PositionBook.from_ranges(ranges),strategy_info
+
+
+def ladder(n_ranges=5,tick=69000,seed=0):
+    rng   = np.random.default_rng(seed)
+    lower = tick - 10*rng.integers(1,50,n_ranges)
+    upper = tick + 10*rng.integers(1,50,n_ranges)
+    return PositionBook.PositionBook.from_amounts(tick,lower,upper,rng.uniform(0.5,1,n_ranges),rng.uniform(500,1000,n_ranges),18,18,
+                                                 lower_bin_price=1.0001**lower)
+
+
+@pytest.mark.parametrize('simulate',[ActiveStrategyFramework.simulate_strategy,StrategyRules.simulate_rules])
+def test_book_strategy_matches_list_of_ranges(simulate):
+    prices,swaps,model = synthetic_market(1440)
+    series             = []
+    for strategy in [ResetStrategy.ResetStrategy(model,0.5,0.9,0.1),BookResetStrategy(model,0.5,0.9,0.1)]:
+        series.append(ActiveStrategyFramework.generate_simulation_series(simulate(prices,swaps,strategy,1.0,1000.0,0.0005,18,18),strategy))
+    ranges,book = series
+
+    assert ranges['reset_point'].sum() > 5
+    assert book['reset_reason'].tolist() == ranges['reset_reason'].tolist()
+    for column in ['token_0_fees','token_1_fees','token_0_allocated','token_1_allocated','value_position_in_token_0',
+                   'base_position_value_in_token_0','limit_position_value_in_token_0']:
+        np.testing.assert_allclose(book[column],ranges[column],rtol=1e-13,atol=1e-13,err_msg=column)
+
+
+def test_from_amounts_places_the_liquidity_of_each_range():
+    book = ladder()
+    for i,position in enumerate(book):
+        amount_0,amount_1 = book['token_0'][i],book['token_1'][i]
+        liquidity         = UNI_v3_funcs.get_liquidity(69000,position['lower_bin_tick'],position['upper_bin_tick'],amount_0,amount_1,18,18)
+        assert position['position_liquidity'] == pytest.approx(liquidity,rel=1e-9)
+        assert (amount_0,amount_1) == pytest.approx(UNI_v3_funcs.get_amounts(69000,position['lower_bin_tick'],position['upper_bin_tick'],
+                                                                             position['position_liquidity'],18,18),rel=1e-12)
+    assert book['lower_bin_price'][0] == pytest.approx(1.0001**book['lower_bin_tick'][0])
+
+
+@pytest.mark.parametrize('ranges',[[1,3],np.array([False,True,False,True,False])])
+def test_remove_selected_ranges(ranges):
+    book              = ladder()
+    amount_0,amount_1 = book.amounts(69050,18,18)
+    removed           = book.remove(69050,18,18,ranges=ranges)
+
+    assert removed == pytest.approx((amount_0[[1,3]].sum(),amount_1[[1,3]].sum()))
+    assert (book['position_liquidity'][[1,3]] == 0).all() and (book['token_0'][[1,3]] == 0).all()
+    assert (book['position_liquidity'][[0,2,4]] > 0).all()
+    assert book.remove(69050,18,18) == pytest.approx((amount_0[[0,2,4]].sum(),amount_1[[0,2,4]].sum()))
+    assert book.totals() == (0.0,0.0)
+
+
+def test_fees_are_chunked_over_the_swaps(monkeypatch):
+    book    = ladder()
+    rng     = np.random.default_rng(1)
+    swaps   = (rng.integers(68500,69500,1000),rng.random(1000) < 0.5,rng.uniform(1e5,1e6,1000),rng.exponential(1.,1000))
+    swaps[2][::7] = np.nan
+    swap_0,swap_1   = book.swap_fees(*swaps,0.0005)
+    range_0,range_1 = book.range_fees(*swaps,0.0005)
+
+    # Chunks of 7 swaps for 5 ranges, the last one partial
+    monkeypatch.setattr(PositionBook,'FEE_CHUNK',35)
+    assert len(book.swap_chunks(1000)) == 143
+    chunked_swap    = book.swap_fees(*swaps,0.0005)
+    chunked_range   = book.range_fees(*swaps,0.0005)
+
+    np.testing.assert_allclose(chunked_swap,(swap_0,swap_1),rtol=1e-14)
+    np.testing.assert_allclose(chunked_range,(range_0,range_1),rtol=1e-12)
+    np.testing.assert_allclose((range_0.sum(),range_1.sum()),(swap_0.sum(),swap_1.sum()),rtol=1e-12)
+    assert swap_0[::7].sum() == 0 and swap_1[::7].sum() == 0
+
+
+def test_deepcopy_is_independent():
+    notes  = np.empty(5,dtype=object)
+    for i in range(5):
+        notes[i] = [i]
+    ranges = ladder()
+    book   = PositionBook.PositionBook(ranges['lower_bin_tick'],ranges['upper_bin_tick'],ranges['position_liquidity'],note=notes)
+    copied = copy.deepcopy(book)
+    copied['position_liquidity'][0] = 0.0
+    copied['note'][1].append('changed')
+
+    assert book['position_liquidity'][0] > 0
+    assert book['note'][1] == [1]
+    assert copied[2] == book[2]
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+import PoolDataStore
+import QueryCache
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def cache(tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return QueryCache.QueryCache(root=str(tmp_path/'cache'))
+
+
+def make_fetcher(calls,**options):
+    @QueryCache.cached_query('test',['contract_address','date_begin','date_end'],'date_end',**options)
+    def fetch(contract_address,file_name,date_begin,date_end,DOWNLOAD_DATA=True):
+        if not DOWNLOAD_DATA:
+            return PoolDataStore.read_table('prices',file_name).reset_index()
+        calls.append(file_name)
+        data = pd.DataFrame({'time_pd':pd.date_range(date_begin,periods=3,freq='min',tz='UTC'),'price':[1.0,2.0,3.0]})
+        PoolDataStore.write_table(data,'prices',file_name)
+        return data
+    return fetch
+
+
+def test_equivalent_queries_hit_the_cache(cache):
+    calls = []
+    fetch = make_fetcher(calls)
+    first = fetch('0xPAIR','A','2022-01-01','2022-01-02',cache=cache)
+    again = fetch('0xpair','B',pd.Timestamp('2022-01-01',tz='UTC'),'2022-01-02',cache=cache)
+    assert calls == ['A']
+    assert cache.stats()['hits'] == 1
+    pd.testing.assert_frame_equal(first,again)
+
+
+def test_fetchers_writing_the_store_only_cache_when_asked(cache,monkeypatch):
+    monkeypatch.setattr(QueryCache,'DEFAULT_CACHE',cache)
+    calls = []
+    fetch = make_fetcher(calls,opt_in=True)
+    fetch('0xPAIR','A','2022-01-01','2022-01-02')
+    fetch('0xpair','B','2022-01-01','2022-01-02')
+    # Both calls downloaded, so B can be read back from the store
+    assert calls == ['A','B']
+    assert len(fetch('0xpair','B','2022-01-01','2022-01-02',DOWNLOAD_DATA=False)) == 3
+
+    fetch('0xpair','C','2022-01-01','2022-01-02',cache=True)
+    fetch('0xpair','D','2022-01-01','2022-01-02',cache=True)
+    assert calls == ['A','B','C']
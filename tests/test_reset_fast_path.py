@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ActiveStrategyFramework
+import ResetStrategy
+from synthetic_market import synthetic_market
+
+COLUMNS = ['token_0_fees','token_1_fees','token_0_fees_uncollected','token_1_fees_uncollected','token_0_left_over','token_1_left_over',
+           'base_range_lower','base_range_upper','limit_range_lower','limit_range_upper','reset_range_lower','reset_range_upper',
+           'token_0_allocated','token_1_allocated','value_position_in_token_0','base_position_value_in_token_0',
+           'limit_position_value_in_token_0','value_position_usd','cum_fees_usd','value_hold_usd']
+
+
+@pytest.fixture(scope='module')
+def simulations():
+    prices,swaps,model = synthetic_market(2*1440)
+    series = {}
+    for name,simulate in [('strategy',ActiveStrategyFramework.simulate_strategy),('fast',ResetStrategy.simulate_reset_strategy)]:
+        strategy     = ResetStrategy.ResetStrategy(model.iloc[:24],0.5,0.9,0.1)
+        series[name] = ActiveStrategyFramework.generate_simulation_series(simulate(prices,swaps,strategy,1.0,1000.0,0.0005,18,18),strategy)
+    return series
+
+
+def test_fast_path_resets_like_simulate_strategy(simulations):
+    strategy,fast = simulations['strategy'],simulations['fast']
+    reasons       = strategy['reset_reason'].value_counts()
+    # Both kinds of resets happen on this path
+    assert reasons['exited_range'] > 5 and reasons['limit_imbalance'] > 5
+
+    assert fast['reset_point'].tolist() == strategy['reset_point'].tolist()
+    assert fast['reset_reason'].tolist() == strategy['reset_reason'].tolist()
+    pd.testing.assert_index_equal(fast.index,strategy.index)
+
+
+def test_fast_path_fees_and_values_match_simulate_strategy(simulations):
+    strategy,fast = simulations['strategy'],simulations['fast']
+    assert strategy['token_0_fees'].sum() > 0 and strategy['token_1_fees'].sum() > 0
+    for column in COLUMNS:
+        np.testing.assert_allclose(fast[column],strategy[column],rtol=1e-12,atol=1e-12,err_msg=column)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import ResetStrategy
+
+
+def reference_quantile(p,cdf_grid,return_grid):
+    # Linear between the last grid point where the ECDF is below p and the first one where it reaches p
+    upper = next(i for i,level in enumerate(cdf_grid) if level >= p)
+    if upper == 0:
+        return return_grid[0]
+    lower = upper - 1
+    return return_grid[lower] + (return_grid[upper] - return_grid[lower]) * (p - cdf_grid[lower]) / (cdf_grid[upper] - cdf_grid[lower])
+
+
+@pytest.mark.parametrize('seed',range(3))
+def test_inverse_matches_reference_with_ties(seed):
+    rng     = np.random.default_rng(seed)
+    # Rounded returns: many tied returns, including the minimum, and flat steps of the ECDF across grid points
+    returns = np.round(rng.standard_t(3,500)*1e-2,3)
+    returns[:3] = returns.min()
+    cdf_grid,return_grid = ResetStrategy.build_quantile_table(returns)
+    assert cdf_grid[0] == cdf_grid[1] >= 3/500
+
+    probabilities = np.r_[np.linspace(cdf_grid[0],1,2001),np.unique(cdf_grid),0.025,0.975]
+    quantiles     = ResetStrategy.interpolate_quantiles(probabilities,cdf_grid,return_grid)
+
+    assert np.isfinite(quantiles).all()
+    np.testing.assert_allclose(quantiles,[reference_quantile(p,cdf_grid,return_grid) for p in probabilities],rtol=0,atol=1e-15)
+    assert quantiles[0] == returns.min()
+    assert np.all(np.diff(quantiles[:2001]) >= 0)
+
+
+def test_probabilities_outside_the_table_are_rejected():
+    cdf_grid,return_grid = ResetStrategy.build_quantile_table([0.0,0.01,0.02,0.03])
+    with pytest.raises(ValueError,match='between'):
+        ResetStrategy.interpolate_quantiles([0.1],cdf_grid,return_grid)
+    assert ResetStrategy.interpolate_quantiles(1.0,cdf_grid,return_grid) == pytest.approx(0.03)
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ActiveStrategyFramework
+import PoolDataStore
+import ResolutionPyramid
+
+pytest.importorskip('pyarrow')
+
+
+def raw_prices(seed=0):
+    # Sparse trades over three days, none in the first minutes of the second and third days
+    rng     = np.random.default_rng(seed)
+    times   = pd.Timestamp('2022-01-02',tz='UTC') + pd.to_timedelta(np.sort(rng.uniform(0,3*86400,3000)),unit='s')
+    times   = times[(times.floor('D') == times) | ((times - times.floor('D')) >= pd.Timedelta('3min'))]
+    data    = pd.DataFrame({'quotePrice':1000*np.exp(np.cumsum(rng.normal(0,1e-3,len(times)))),
+                            'amount0_adj':rng.normal(0,1,len(times)),
+                            'amount1_adj':rng.normal(0,1000,len(times)),
+                            'virtual_liquidity_adj':rng.uniform(1e5,2e5,len(times))},index=pd.Index(times,name='time_pd'))
+    return data
+
+
+def build(root,pool,raw,kind,splits):
+    pyramid = ResolutionPyramid.Pyramid('raw',pool,kind,root=root)
+    begin   = None
+    for end in splits + [None]:
+        part  = raw.loc[begin:end]
+        part  = part[part.index > begin] if begin is not None else part
+        PoolDataStore.write_table(part,'raw',pool,root=root,mode='append')
+        pyramid.update()
+        begin = end
+    return pyramid
+
+
+@pytest.mark.parametrize('kind',['price','swap'])
+def test_incremental_update_equals_full_rebuild(tmp_path,kind):
+    raw         = raw_prices()
+    full        = build(str(tmp_path),'full',raw,kind,[])
+    # Updates whose last stored minute is on the day before the next trade, and late in a day
+    splits      = [pd.Timestamp('2022-01-02 23:58:30',tz='UTC'),pd.Timestamp('2022-01-03 17:00',tz='UTC'),pd.Timestamp('2022-01-03 23:59:59',tz='UTC')]
+    incremental = build(str(tmp_path),'incremental',raw,kind,splits)
+
+    for frequency in ResolutionPyramid.LEVELS:
+        pd.testing.assert_frame_equal(incremental.read(frequency),full.read(frequency))
+
+
+def test_levels_match_resampling_raw_data(tmp_path):
+    raw      = raw_prices()
+    splits   = [pd.Timestamp('2022-01-02 23:58:30',tz='UTC'),pd.Timestamp('2022-01-03 23:59:59',tz='UTC')]
+    prices   = build(str(tmp_path),'pool',raw,'price',splits)
+    swaps    = build(str(tmp_path),'pool_swaps',raw,'swap',splits)
+
+    for frequency in ['M','H','D']:
+        expected = ActiveStrategyFramework.aggregate_price_data(raw[['quotePrice']],frequency)
+        level    = prices.read(frequency)
+        assert len(level) == len(expected)
+        np.testing.assert_allclose(level['quotePrice'],expected['quotePrice'])
+
+        expected = ActiveStrategyFramework.aggregate_swap_data(raw,frequency)
+        level    = swaps.read(frequency)
+        assert len(level) == len(expected)
+        np.testing.assert_allclose(level[expected.columns],expected,atol=1e-9)
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ActiveStrategyFramework
+import ResetStrategy
+import ResultsStore
+from synthetic_market import synthetic_market
+
+
+@pytest.fixture(scope='module')
+def simulation():
+    prices,swaps,model = synthetic_market(2*1440)
+    strategy           = ResetStrategy.ResetStrategy(model,0.5,0.9,0.1)
+    data               = ActiveStrategyFramework.generate_simulation_series(
+                             ActiveStrategyFramework.simulate_strategy(prices,swaps,strategy,1.0,1000.0,0.0005,18,18),strategy)
+    return strategy,data
+
+
+def summary(net_apr,sharpe_ratio=None):
+    return {'net_apr':net_apr,'sharpe_ratio':sharpe_ratio,'final_value':np.float64(1000.0 + net_apr)}
+
+
+def test_saved_run_round_trips(tmp_path,simulation):
+    strategy,data = simulation
+    store         = ResultsStore.ResultsStore(root=str(tmp_path))
+    analysis      = ActiveStrategyFramework.analyze_strategies(ActiveStrategyFramework.stack_simulations([data]))
+    run_id        = store.save_run(analysis.iloc[0],series=data,strategy=strategy,
+                                   data_fingerprint=ResultsStore.data_fingerprint(data),sweep='sweep')
+
+    run = store.find(sweep='sweep').loc[run_id]
+    assert run['strategy'] == 'ResetStrategy'
+    assert run['code_version'] == ResultsStore.code_version(strategy)
+    assert run['data_fingerprint'] == ResultsStore.data_fingerprint(data)
+    assert run['param_alpha_param'] == 0.5 and run['param_tau_param'] == 0.9 and run['param_limit_parameter'] == 0.1
+    assert run['final_value'] == pytest.approx(data['value_position_usd'].iloc[-1])
+    # Metrics the strategy has no data for (no compound points) are stored as NULL
+    assert pd.isna(run['compounds'])
+
+    stored = store.series(run_id)
+    pd.testing.assert_frame_equal(stored,data,check_freq=False)
+    with pytest.raises(KeyError):
+        store.series(store.save_run(summary(1.0)))
+    store.close()
+
+    # Runs are kept across connections
+    assert ResultsStore.ResultsStore(root=str(tmp_path)).count() == 2
+
+
+def test_series_of_a_batch_share_a_file(tmp_path,simulation):
+    _,data  = simulation
+    store   = ResultsStore.ResultsStore(root=str(tmp_path))
+    parts   = [data.iloc[:100],None,data.iloc[100:250]]
+    run_ids = store.save_runs([{'summary':summary(i),'series':part} for i,part in enumerate(parts)])
+
+    assert len(list((tmp_path/'series').iterdir())) == 1
+    pd.testing.assert_frame_equal(store.series(run_ids[0]),parts[0],check_freq=False)
+    pd.testing.assert_frame_equal(store.series(run_ids[2]),parts[2],check_freq=False)
+    with pytest.raises(KeyError):
+        store.series(run_ids[1])
+
+
+def test_find_filters_by_parameter_ranges(tmp_path):
+    store = ResultsStore.ResultsStore(root=str(tmp_path))
+    grid  = [(alpha,tau,model) for alpha in [0.1,0.3,0.5,0.7] for tau in [0.8,0.9] for model in ['ar','garch']]
+    store.save_runs([{'summary':summary(i),'strategy':'ResetStrategy','parameters':{'alpha':np.float64(alpha),'tau':tau,'model':model}}
+                     for i,(alpha,tau,model) in enumerate(grid)])
+
+    def found(**parameters):
+        runs = store.find(parameters=parameters)
+        if len(runs) == 0:
+            return []
+        return sorted(zip(runs['param_alpha'],runs['param_tau'],runs['param_model']))
+
+    assert found(alpha=(0.3,0.5)) == sorted(x for x in grid if 0.3 <= x[0] <= 0.5)
+    assert found(alpha=(None,0.3),tau=(0.85,None)) == sorted(x for x in grid if x[0] <= 0.3 and x[1] >= 0.85)
+    assert found(alpha=(0.6,None),model='garch') == sorted(x for x in grid if x[0] >= 0.6 and x[2] == 'garch')
+    assert found(tau=0.9,model='ar') == sorted(x for x in grid if x[1] == 0.9 and x[2] == 'ar')
+    assert found(alpha=(0.8,None)) == []
+    assert len(store.find(strategy='ResetStrategy',parameters={'alpha':(0.1,0.1)})) == 4
+    assert len(store.find(strategy='AutoRegressiveStrategy')) == 0
+
+
+def test_top_orders_by_metric(tmp_path):
+    store   = ResultsStore.ResultsStore(root=str(tmp_path))
+    net_apr = np.random.default_rng(0).permutation(20) / 10
+    sharpe  = [np.nan if i % 5 == 0 else x for i,x in enumerate(-net_apr)]
+    run_ids = store.save_runs([{'summary':summary(x,y),'parameters':{'step':i}} for i,(x,y) in enumerate(zip(net_apr,sharpe))])
+    by_id   = dict(zip(run_ids,net_apr))
+
+    top = store.top('net_apr',n=5)
+    assert top['net_apr'].tolist() == sorted(net_apr,reverse=True)[:5]
+    assert [by_id[x] for x in top.index] == top['net_apr'].tolist()
+    assert store.top('net_apr',n=3,ascending=True)['net_apr'].tolist() == sorted(net_apr)[:3]
+    assert store.top('net_apr',n=3,parameters={'step':(10,None)})['param_step'].min() >= 10
+
+    # Runs with a missing (or non finite) metric are left out of its ranking
+    ranked = store.top('sharpe_ratio',n=None)
+    assert len(ranked) == 16
+    assert ranked['sharpe_ratio'].is_monotonic_decreasing
+    with pytest.raises(ValueError,match='Unknown metric'):
+        store.top('apr')
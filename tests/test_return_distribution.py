@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ActiveStrategyFramework
+import ResetStrategy
+import ReturnDistribution
+from synthetic_market import synthetic_market
+
+PROBABILITIES = [0.01,0.025,0.05,0.25,0.5,0.75,0.95,0.975,0.99]
+
+
+def test_sketch_quantiles_match_the_data():
+    returns      = np.random.default_rng(0).standard_t(3,200_000) * 1e-3
+    distribution = ReturnDistribution.OnlineReturnDistribution()
+    for chunk in np.array_split(returns,100):
+        distribution.add_returns(chunk)
+    quantiles    = distribution.quantile(PROBABILITIES)
+
+    # Error in probability: share of the returns below each estimated quantile
+    probability_error = np.searchsorted(np.sort(returns),quantiles) / len(returns) - PROBABILITIES
+    assert np.abs(probability_error).max() < 1e-3
+    np.testing.assert_allclose(quantiles,np.quantile(returns,PROBABILITIES),atol=1e-4)
+    # The centroids stay bounded whatever the number of returns
+    assert len(distribution.centroids()[0]) <= distribution.compression
+
+
+def test_lookback_drops_old_returns():
+    rng          = np.random.default_rng(1)
+    distribution = ReturnDistribution.OnlineReturnDistribution(lookback=240)
+    distribution.add_returns(rng.normal(0,1,2000))
+    # Segments of 30 returns: once lookback and a segment of new returns arrived every old return is gone
+    distribution.add_returns(rng.normal(10,1,240))
+    kept_weight  = distribution.centroids()[1].sum()
+    assert 240 <= kept_weight <= 240 + distribution.segment_size
+    assert distribution.quantile(0.01) < 5
+
+    distribution.add_returns(rng.normal(10,1,distribution.segment_size))
+    assert distribution.quantile(0.001) > 5
+    assert distribution.n_returns == 2270
+
+
+def test_half_life_decays_old_returns():
+    distribution = ReturnDistribution.OnlineReturnDistribution(half_life=100)
+    distribution.add_returns(np.zeros(10_000))
+    distribution.add_returns(np.ones(100))
+    # The last half life of returns weighs as much as everything before it: the weighted mean (share of ones) is a half
+    means,weights = distribution.centroids()
+    assert (means*weights).sum() / weights.sum() == pytest.approx(0.5,abs=1e-9)
+    assert distribution.quantile(0.25) == pytest.approx(0.0,abs=1e-9)
+    assert distribution.quantile(0.75) == pytest.approx(1.0,abs=1e-9)
+
+
+def test_sample_period_spaces_the_returns():
+    index        = pd.date_range('2022-01-01',periods=6*60 + 1,freq='min',tz='UTC')
+    prices       = pd.Series(1000*np.exp(np.cumsum(np.random.default_rng(2).normal(0,1e-3,len(index)))),index=index)
+    distribution = ReturnDistribution.OnlineReturnDistribution(sample_period='1h')
+    for time,price in prices.items():
+        distribution.update(time,price)
+        distribution.update(time,price*2)
+    assert distribution.n_returns == 6
+
+    hourly       = prices.iloc[::60].pct_change().dropna()
+    np.testing.assert_allclose(np.sort(distribution.centroids()[0]),np.sort(hourly))
+
+
+def test_lookback_is_a_number_of_returns():
+    with pytest.raises(TypeError):
+        ReturnDistribution.OnlineReturnDistribution(lookback=pd.Timedelta('10D'))
+
+
+def test_reset_strategy_follows_the_distribution():
+    # Model returns from a calm market over the two days before, then a market four times as volatile
+    _,_,model          = synthetic_market(2*1440,seed=0,volatility=1e-3)
+    model.index        = model.index - pd.Timedelta('2D')
+    prices,swaps,_     = synthetic_market(2*1440,seed=1,volatility=4e-3)
+    distribution       = ReturnDistribution.OnlineReturnDistribution(lookback=48,sample_period='1h')
+    strategy           = ResetStrategy.ResetStrategy(model,0.5,0.9,0.1,return_distribution=distribution)
+    initial_quantiles  = strategy.base_quantiles
+
+    data = ActiveStrategyFramework.generate_simulation_series(
+               ActiveStrategyFramework.simulate_strategy(prices,swaps,strategy,1.0,1000.0,0.0005,18,18),strategy)
+
+    assert data['reset_point'].sum() > 0
+    assert distribution.n_returns == len(model) + 48
+    initial_width = initial_quantiles[1] - initial_quantiles[0]
+    assert strategy.base_quantiles[1] - strategy.base_quantiles[0] > 2*initial_width
+    # Ranges placed at the last reset follow the quantiles of the updated distribution
+    last_reset = data[data['reset_point']].iloc[-1]
+    assert last_reset['base_range_upper'] / last_reset['price'] - 1 == pytest.approx(strategy.base_quantiles[1])
@@ -0,0 +1,91 @@
+import collections
+import inspect
+import os
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import AutoRegressiveStrategy
+import PositionBook
+import ResetStrategy
+import ResultsStore
+import ReturnDistribution
+import SimulationCache
+
+
+def model_data(n_hours=500,seed=0):
+    rng   = np.random.default_rng(seed)
+    index = pd.date_range('2022-01-01',periods=n_hours,freq='h',tz='UTC')
+    data  = pd.DataFrame({'quotePrice':1000*np.exp(np.cumsum(rng.normal(0,1e-2,n_hours)))},index=index)
+    data['price_return'] = data['quotePrice'].pct_change()
+    return data.dropna()
+
+
+def reset_strategy(seed=0):
+    distribution = ReturnDistribution.OnlineReturnDistribution(lookback=200)
+    return ResetStrategy.ResetStrategy(model_data(seed=seed),0.5,0.9,0.1,return_distribution=distribution)
+
+
+class Slotted:
+    __slots__ = ('value','__private')
+
+    def __init__(self,value):
+        self.value     = value
+        self.__private = [value]
+
+
+def test_state_fingerprint_is_stable_across_processes():
+    script = ('import sys; sys.path.insert(0,"tests"); import test_simulation_cache, SimulationCache; '
+              'print(SimulationCache.state_fingerprint(test_simulation_cache.reset_strategy()))')
+    root   = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable,'-c',script],cwd=root,capture_output=True,text=True,check=True).stdout.split()[-1]
+    assert output == SimulationCache.state_fingerprint(reset_strategy())
+
+
+def test_state_fingerprint_hashes_container_and_slot_contents():
+    fingerprint = SimulationCache.state_fingerprint
+    assert fingerprint(reset_strategy(seed=0)) != fingerprint(reset_strategy(seed=1))
+    assert fingerprint(collections.deque([1,2])) != fingerprint(collections.deque([1,3]))
+    assert fingerprint({1,2,3}) == fingerprint({3,2,1})
+    assert fingerprint(Slotted(1)) == fingerprint(Slotted(1))
+    assert fingerprint(Slotted(1)) != fingerprint(Slotted(2))
+    with pytest.raises(SimulationCache.UncacheableState):
+        fingerprint({'rule':lambda x: x})
+    with pytest.raises(SimulationCache.UncacheableState):
+        fingerprint([iter([1,2])])
+
+
+def test_uncacheable_strategies_are_simulated_without_cache(tmp_path):
+    cache    = SimulationCache.SimulationCache(root=str(tmp_path))
+    strategy = reset_strategy()
+    strategy.callback = lambda x: x
+    calls    = []
+
+    def simulate(*args):
+        calls.append(args)
+        return pd.DataFrame({'price':[1.0]})
+
+    for _ in range(2):
+        data = SimulationCache.cached_simulation(simulate,model_data(),None,strategy,1.0,1.0,0.003,18,6,cache=cache,swap_fingerprint='')
+    assert len(calls) == 2
+    assert cache.counts['uncacheable'] == 2
+    assert data['price'].tolist() == [1.0]
+
+
+def test_code_version_covers_imported_and_state_modules():
+    modules = ResultsStore.project_modules([inspect.getmodule(AutoRegressiveStrategy.AutoRegressiveStrategy)])
+    assert 'ARGarchModel' in [x.__name__ for x in modules]
+
+    strategy = reset_strategy()
+    assert ReturnDistribution in ResultsStore.state_modules(strategy)
+    assert ResultsStore.code_version(strategy) != ResultsStore.code_version(ResetStrategy.ResetStrategy)
+    assert ResultsStore.code_version(ResetStrategy.ResetStrategy(model_data(),0.5,0.9,0.1)) == ResultsStore.code_version(ResetStrategy.ResetStrategy)
+
+
+def test_code_version_covers_position_book(tmp_path,monkeypatch):
+    version = ResultsStore.code_version(ResetStrategy.ResetStrategy)
+    source  = tmp_path/'PositionBook.py'
+    source.write_text(open(inspect.getsourcefile(PositionBook)).read() + '\n# edited\n')
+    monkeypatch.setattr(inspect,'getsourcefile',lambda module,original=inspect.getsourcefile: str(source) if module is PositionBook else original(module))
+    assert ResultsStore.code_version(ResetStrategy.ResetStrategy) != version
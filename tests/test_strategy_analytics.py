@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ActiveStrategyFramework
+import ResetStrategy
+from synthetic_market import synthetic_market
+
+
+@pytest.fixture(scope='module')
+def simulations():
+    simulations = {}
+    for seed,(alpha,tau,limit) in enumerate([(0.5,0.9,0.1),(0.3,0.8,0.05),(0.7,0.95,0.2)]):
+        prices,swaps,model = synthetic_market((seed + 1)*1440,seed=seed)
+        strategy           = ResetStrategy.ResetStrategy(model,alpha,tau,limit)
+        data               = ActiveStrategyFramework.generate_simulation_series(
+                                 ActiveStrategyFramework.simulate_strategy(prices,swaps,strategy,1.0,1000.0,0.0005,18,18),strategy)
+        # analyze_strategy needs compound points, which a ResetStrategy doesn't have
+        simulations['run_'+str(seed)] = data.assign(compound_point=np.arange(len(data)) % (50 + seed) == 0)
+    return simulations
+
+
+@pytest.mark.parametrize('frequency',['M','H'])
+def test_analyze_strategies_matches_analyze_strategy(simulations,frequency):
+    summary = ActiveStrategyFramework.analyze_strategies(ActiveStrategyFramework.stack_simulations(simulations,id_column='run'),
+                                                         frequency=frequency,id_column='run')
+    assert list(summary.index) == list(simulations)
+    for run,data in simulations.items():
+        expected = ActiveStrategyFramework.analyze_strategy(data,frequency=frequency)
+        assert list(summary.columns) == list(expected)
+        assert expected['rebalances'] > 0
+        for metric,value in expected.items():
+            assert summary.loc[run,metric] == pytest.approx(value,rel=1e-12),metric
+
+
+def test_analyze_strategies_without_compound_or_base_columns(simulations):
+    data    = simulations['run_0'].drop(columns=['compound_point','base_position_value_in_token_0','base_range_upper'])
+    summary = ActiveStrategyFramework.analyze_strategies(ActiveStrategyFramework.stack_simulations([data])).iloc[0]
+    assert np.isnan(summary['compounds']) and np.isnan(summary['mean_base_position']) and np.isnan(summary['median_base_width'])
+    assert summary['net_apr'] == pytest.approx(ActiveStrategyFramework.analyze_strategy(simulations['run_0'])['net_apr'],rel=1e-12)
+
+
+def test_rolling_strategy_metrics_match_a_row_by_row_window(simulations):
+    window  = pd.Timedelta('6h')
+    results = ActiveStrategyFramework.stack_simulations(simulations)
+    rolling = ActiveStrategyFramework.rolling_strategy_metrics(results,window=window)
+    assert len(rolling) == len(results)
+    assert (rolling['simulation'].to_numpy() == results['simulation'].to_numpy()).all()
+
+    for run,data in simulations.items():
+        metrics   = rolling[rolling['simulation'] == run]
+        times     = pd.to_datetime(data['time'],utc=True).dt.tz_localize(None).to_numpy()
+        values    = data['value_position_usd'].to_numpy()
+        fees      = data['cum_fees_usd'].to_numpy()
+        days      = window / pd.Timedelta(days=1)
+        # Last row at or before time - window (the start of the trailing window) and first row inside the window
+        first     = np.searchsorted(times,times - window.to_timedelta64(),side='right')
+        start     = first - 1
+        has_start = start >= 0
+
+        net_apr   = np.where(has_start,values/values[start] - 1,np.nan) * 365 / days
+        fee_apr   = np.where(has_start,(fees - fees[start])/values[start],np.nan) * 365 / days
+        drawdown  = 1 - values/np.array([values[i:j + 1].max() for j,i in enumerate(first)])
+
+        assert np.isnan(metrics['rolling_net_apr'].iloc[0]) and has_start.sum() > 0
+        np.testing.assert_allclose(metrics['rolling_net_apr'],net_apr,rtol=1e-12)
+        np.testing.assert_allclose(metrics['rolling_fee_apr'],fee_apr,rtol=1e-12,atol=1e-15)
+        np.testing.assert_allclose(metrics['rolling_drawdown'],drawdown,rtol=1e-12,atol=1e-15)
+        np.testing.assert_allclose(metrics['impermanent_loss'],(values - data['value_hold_usd'])/data['value_hold_usd'],rtol=1e-12)
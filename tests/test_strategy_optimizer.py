@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+import StrategyOptimizer
+
+
+def price_data(days):
+    index = pd.date_range('2022-01-01',periods=days*1440 + 1,freq='min',tz='UTC')
+    return pd.DataFrame({'quotePrice':1000.0},index=index)
+
+
+def canned_results(monkeypatch,outcomes):
+    # outcomes maps a candidate's first parameter to its score, None for an undefined score or an exception to raise
+    def evaluate_candidate(task):
+        outcome = outcomes[task[0][0]]
+        if isinstance(outcome,Exception):
+            return {'summary':None,'error':repr(outcome),'seconds':0.0}
+        return {'summary':{'net_apr':np.nan if outcome is None else outcome},'error':None,'seconds':0.0}
+    monkeypatch.setattr(StrategyOptimizer,'evaluate_candidate',evaluate_candidate)
+
+
+def optimize(candidates,days=9,n_rungs=3):
+    return StrategyOptimizer.successive_halving(None,candidates,price_data(days),None,1.0,1.0,0.003,18,6,
+                                                objective='net_apr',n_rungs=n_rungs,eta=3,max_workers=1)
+
+
+def test_failed_simulations_rank_below_undefined_scores(monkeypatch):
+    canned_results(monkeypatch,{0:ZeroDivisionError('float division by zero'),1:None,2:ZeroDivisionError('float division by zero')})
+    result = optimize([(0,),(1,),(2,)],days=3,n_rungs=2)
+    assert result['best_params'] == (1,)
+    assert result['history'].loc[result['history']['rung'] == 0,'stopped'].tolist() == [True,False,True]
+
+
+def test_best_scores_are_promoted(monkeypatch):
+    outcomes = {i: float(i % 4) for i in range(9)}
+    outcomes[3] = RuntimeError('failed')
+    canned_results(monkeypatch,outcomes)
+    result   = optimize([(i,) for i in range(9)])
+    assert result['best_params'] == (7,)
+    assert result['best_score'] == 3.0
+    assert sorted(result['history'].loc[result['history']['rung'] == 1,'candidate']) == [2,6,7]
+
+
+def test_checkpoints_shorter_than_a_day_are_rejected():
+    with pytest.raises(ValueError,match='less than a day'):
+        optimize([(0,),(1,)],days=3)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ActiveStrategyFramework
+import AutoRegressiveStrategy
+import ResetStrategy
+import ReturnDistribution
+import StrategyRules
+from synthetic_market import synthetic_market
+
+COLUMNS = ['token_0_fees','token_1_fees','token_0_fees_uncollected','token_1_fees_uncollected','token_0_left_over','token_1_left_over',
+           'token_0_allocated','token_1_allocated','value_position_in_token_0','base_position_value_in_token_0',
+           'limit_position_value_in_token_0','cum_fees_usd','value_hold_usd']
+
+
+def simulate_both(make_strategy,prices,swaps,rules=lambda strategy: strategy):
+    """
+    Series of simulate_strategy and simulate_rules, each with a new strategy from make_strategy() (passed through rules for simulate_rules).
+    """
+    series = []
+    for simulate,wrap in [(ActiveStrategyFramework.simulate_strategy,lambda strategy: strategy),(StrategyRules.simulate_rules,rules)]:
+        strategy = wrap(make_strategy())
+        series.append(ActiveStrategyFramework.generate_simulation_series(simulate(prices,swaps,strategy,1.0,1000.0,0.0005,18,18),strategy))
+    return series
+
+
+def assert_same_simulation(strategy,rules):
+    assert rules['reset_point'].tolist() == strategy['reset_point'].tolist()
+    assert rules['reset_reason'].tolist() == strategy['reset_reason'].tolist()
+    for column in COLUMNS:
+        np.testing.assert_allclose(rules[column],strategy[column],rtol=1e-12,atol=1e-12,err_msg=column)
+
+
+@pytest.fixture(scope='module')
+def reset_market():
+    return synthetic_market(2*1440)
+
+
+def test_reset_strategy_triggers_fire_on_every_reset(reset_market):
+    prices,swaps,model = reset_market
+    strategy,rules     = simulate_both(lambda: ResetStrategy.ResetStrategy(model.iloc[:24],0.5,0.9,0.1),prices,swaps)
+    reasons            = strategy['reset_reason'].value_counts()
+    assert reasons['exited_range'] > 5 and reasons['limit_imbalance'] > 5
+    assert_same_simulation(strategy,rules)
+
+
+def test_autoregressive_strategy_triggers_fire_on_every_rebalance():
+    prices,swaps,_ = synthetic_market(14*1440)
+    test_prices    = prices.iloc[-1440:]
+    make_strategy  = lambda: AutoRegressiveStrategy.AutoRegressiveStrategy(pd.DataFrame({'quotePrice':prices}),0.02,0.6,0.95,
+                                                                           tokens_outside_reset=0.01,data_frequency='H',days_ar_model=10,
+                                                                           garch_estimator='internal')
+    strategy,rules = simulate_both(make_strategy,test_prices,swaps.loc[test_prices.index[0]:])
+    reasons        = strategy['reset_reason'].value_counts()
+    # Exits, hourly volatility checks, compounds and resets with too many tokens outside the position
+    assert all(reasons[x] > 0 for x in ['exited_range','vol_rebalance','compound','tokens_outside_large'])
+    assert rules['compound_point'].tolist() == strategy['compound_point'].tolist()
+    assert_same_simulation(strategy,rules)
+
+
+@pytest.mark.parametrize('adapter',['wrapped','online_distribution'])
+def test_strategies_without_triggers_run_on_every_observation(reset_market,adapter):
+    prices,swaps,model = reset_market
+    prices,swaps       = prices.iloc[:720],swaps.loc[:prices.index[719]]
+    rules              = lambda strategy: strategy
+    if adapter == 'wrapped':
+        make_strategy = lambda: ResetStrategy.ResetStrategy(model.iloc[:24],0.5,0.9,0.1)
+        rules         = StrategyRules.CheckStrategyRules
+    else:
+        # An online return distribution has no triggers, simulate_rules wraps the strategy in CheckStrategyRules
+        make_strategy = lambda: ResetStrategy.ResetStrategy(model.iloc[:24],0.5,0.9,0.1,
+                                                            return_distribution=ReturnDistribution.OnlineReturnDistribution(lookback=200))
+        assert isinstance(StrategyRules.strategy_rules(make_strategy()),StrategyRules.CheckStrategyRules)
+
+    strategy,rules = simulate_both(make_strategy,prices,swaps,rules)
+    assert strategy['reset_point'].sum() > 0
+    assert_same_simulation(strategy,rules)
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+import ActiveStrategyFramework
+import ResetStrategy
+import SwapDataset
+from synthetic_market import synthetic_market
+
+COLUMNS = ['reset_point','token_0_fees','token_1_fees','value_position_in_token_0','limit_position_value_in_token_0']
+
+
+@pytest.fixture(scope='module')
+def market():
+    return synthetic_market(1440)
+
+
+def test_layout_round_trip(tmp_path,market):
+    _,swaps,_ = market
+    swaps     = swaps.assign(virtual_liquidity=swaps['virtual_liquidity'].where(np.arange(len(swaps)) % 11 > 0))
+    path      = str(tmp_path/'swaps.bin')
+    SwapDataset.write_swap_dataset(swaps,path)
+    arrays    = SwapDataset.open_swap_dataset(path)
+
+    # Columns are read-only views on the file, each starting on an aligned offset
+    assert isinstance(arrays.time,np.memmap) and not arrays.time.flags.writeable
+    assert all(getattr(arrays,name).offset % SwapDataset.ALIGNMENT == 0 for name,_ in SwapDataset.COLUMNS)
+    assert all(getattr(arrays,name).dtype == np.dtype(dtype) for name,dtype in SwapDataset.COLUMNS)
+    pd.testing.assert_frame_equal(arrays.to_frame(),swaps,check_dtype=False)
+
+    begin,end = swaps.index[100],swaps.index[200]
+    pd.testing.assert_frame_equal(arrays.between(begin,end).to_frame(),swaps.loc[begin:end],check_dtype=False)
+
+    with open(path,'rb') as input:
+        assert input.read(len(SwapDataset.MAGIC)) == SwapDataset.MAGIC
+
+
+def test_empty_and_invalid_files(tmp_path,market):
+    _,swaps,_ = market
+    path      = str(tmp_path/'empty.bin')
+    SwapDataset.write_swap_dataset(swaps.iloc[:0],path)
+    assert len(SwapDataset.open_swap_dataset(path)) == 0
+
+    (tmp_path/'other.bin').write_bytes(b'not a dataset')
+    with pytest.raises(ValueError,match='not a swap dataset'):
+        SwapDataset.open_swap_dataset(str(tmp_path/'other.bin'))
+
+
+@pytest.mark.parametrize('simulate',[ActiveStrategyFramework.simulate_strategy,ResetStrategy.simulate_reset_strategy])
+def test_memmapped_swaps_simulate_like_the_frame(tmp_path,market,simulate):
+    prices,swaps,model = market
+    path               = str(tmp_path/'swaps.bin')
+    SwapDataset.write_swap_dataset(swaps,path)
+
+    series = []
+    for swap_data in [swaps,SwapDataset.open_swap_dataset(path)]:
+        strategy = ResetStrategy.ResetStrategy(model,0.5,0.9,0.1)
+        series.append(ActiveStrategyFramework.generate_simulation_series(simulate(prices,swap_data,strategy,1.0,1000.0,0.0005,18,18),strategy))
+    frame,memmapped = series
+
+    assert frame['token_0_fees'].sum() > 0
+    pd.testing.assert_frame_equal(memmapped[COLUMNS],frame[COLUMNS])
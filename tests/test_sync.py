@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import pytest
+import GetPoolData
+import PoolDataStore
+
+pytest.importorskip('pyarrow')
+
+TIMESTAMP_BEGIN = 1_640_995_200   # 2022-01-01
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path,monkeypatch):
+    # PoolDataStore.STORE_ROOT is relative to the working directory
+    monkeypatch.chdir(tmp_path)
+
+
+def fake_swaps(timestamps,first_id=0):
+    return [{'id':'%06d' % (first_id + i),'timestamp':str(x),'amount0':'1','amount1':'-2','amountUSD':'2','tick':'0'}
+            for i,x in enumerate(timestamps)]
+
+
+class FakeSubgraph:
+    """
+    Answers the id-paginated swap query of sync_subgraph_swaps: swaps with timestamp >= since and id > paginate_id, ordered by id.
+    """
+    def __init__(self,swaps,page_size=3,fail_after=None):
+        self.swaps      = swaps
+        self.page_size  = page_size
+        self.fail_after = fail_after
+        self.queries    = []
+
+    def run_query(self,since,paginate_id):
+        if self.fail_after is not None and len(self.queries) == self.fail_after:
+            raise ConnectionError('connection lost')
+        self.queries.append((since,paginate_id))
+        matching = sorted((x for x in self.swaps if int(x['timestamp']) >= since and x['id'] > paginate_id),key=lambda x: x['id'])
+        return matching[:self.page_size]
+
+
+def sync(subgraph,segment_pages=20):
+    return GetPoolData.sync_subgraph_swaps('swap','pool',lambda since: since,subgraph.run_query,GetPoolData.SWAP_V3_TYPES,
+                                           timestamp_begin=TIMESTAMP_BEGIN,segment_pages=segment_pages)
+
+
+def stored_ids():
+    return sorted(PoolDataStore.read_table('swap','pool')['id'])
+
+
+def test_sync_moves_high_water_mark_and_skips_seen_swaps():
+    swaps = fake_swaps(TIMESTAMP_BEGIN + 60*np.array([0,1,2,3,4,5,5]))
+    state = sync(FakeSubgraph(swaps))
+    assert state['timestamp'] == TIMESTAMP_BEGIN + 300
+    assert sorted(state['ids']) == ['000005','000006']
+    assert stored_ids() == [x['id'] for x in swaps]
+
+    # New swaps at the high-water mark and after it: only they are downloaded, from the high-water mark on
+    new_swaps = fake_swaps(TIMESTAMP_BEGIN + 60*np.array([5,6,7]),first_id=7)
+    subgraph  = FakeSubgraph(swaps + new_swaps)
+    state     = sync(subgraph)
+    assert all(since == TIMESTAMP_BEGIN + 300 for since,_ in subgraph.queries)
+    assert stored_ids() == [x['id'] for x in swaps + new_swaps]
+    assert state == {'timestamp':TIMESTAMP_BEGIN + 420,'ids':['000009'],'cursor':None}
+
+    # Nothing new: nothing is stored twice
+    sync(FakeSubgraph(swaps + new_swaps))
+    assert stored_ids() == [x['id'] for x in swaps + new_swaps]
+
+
+def test_first_sync_starts_from_full_download():
+    swaps = fake_swaps(TIMESTAMP_BEGIN + 60*np.arange(5))
+    PoolDataStore.write_table(GetPoolData.normalize_swap_data(pd.DataFrame(swaps),GetPoolData.SWAP_V3_TYPES),'swap','pool')
+    assert GetPoolData.stored_high_water_mark('swap','pool') == (TIMESTAMP_BEGIN + 240,['000004'])
+
+    subgraph = FakeSubgraph(swaps + fake_swaps([TIMESTAMP_BEGIN + 300],first_id=5))
+    sync(subgraph)
+    assert subgraph.queries[0] == (TIMESTAMP_BEGIN + 240,'')
+    assert stored_ids() == ['%06d' % i for i in range(6)]
+
+
+def test_interrupted_sync_resumes_from_cursor():
+    swaps    = fake_swaps(TIMESTAMP_BEGIN + 60*np.arange(10))
+    subgraph = FakeSubgraph(swaps,page_size=2,fail_after=3)
+    with pytest.raises(ConnectionError):
+        sync(subgraph,segment_pages=2)
+    # The first segment (two pages) was stored with its cursor, and the high-water mark did not move
+    state = PoolDataStore.read_sync_state('swap','pool')
+    assert state['timestamp'] is None and state['cursor']['id'] == '000003'
+    assert stored_ids() == ['%06d' % i for i in range(4)]
+
+    subgraph = FakeSubgraph(swaps,page_size=2)
+    state    = sync(subgraph,segment_pages=2)
+    assert subgraph.queries[0] == (TIMESTAMP_BEGIN,'000003')
+    assert stored_ids() == [x['id'] for x in swaps]
+    assert state['timestamp'] == TIMESTAMP_BEGIN + 540
+
+
+def swap_log(block,timestamp):
+    words = [-10**6,2*10**6,2**96,10**18,0]
+    data  = '0x' + ''.join('%064x' % (x % 2**256) for x in words)
+    return {'address':'0xpool','blockNumber':hex(block),'blockHash':'0x%064x' % block,'blockTimestamp':hex(timestamp),
+            'logIndex':'0x0','transactionHash':'0x%064x' % block,'removed':False,'data':data,
+            'topics':[GetPoolData.UNIV3_EVENT_TOPICS['Swap'],'0x%064x' % 1,'0x%064x' % 2]}
+
+
+class FakeNode:
+    """
+    JSON-RPC client answering eth_getLogs with one swap per block, a block every hour from 2022-01-01.
+    """
+    def post_json(self,url,payload):
+        query = payload['params'][0]
+        logs  = []
+        if query['topics'] == [GetPoolData.UNIV3_EVENT_TOPICS['Swap']]:
+            logs = [swap_log(x,TIMESTAMP_BEGIN + 3600*x) for x in range(int(query['fromBlock'],16),int(query['toBlock'],16) + 1)]
+        return {'jsonrpc':'2.0','id':1,'result':logs}
+
+
+def test_partial_block_range_keeps_rest_of_day():
+    GetPoolData.get_pool_data_rpc('0xpool',0,47,6,18,'stub://rpc','pool',block_step=10,max_workers=1,client=FakeNode())
+    # Re-download a block range that ends at 06:00 on the second day
+    swaps  = GetPoolData.get_pool_data_rpc('0xpool',20,30,6,18,'stub://rpc','pool',block_step=10,max_workers=1,client=FakeNode())
+    stored = PoolDataStore.read_table('swap_rpc','pool')
+
+    assert swaps['block_number'].tolist() == list(range(20,31))
+    assert stored['block_number'].tolist() == list(range(48))
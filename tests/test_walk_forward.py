@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import ResetStrategy
+import WalkForward
+from synthetic_market import synthetic_market
+
+
+def make_strategy(model_data,params):
+    return ResetStrategy.ResetStrategy(model_data,0.5,0.9,0.1)
+
+
+def walk_forward(prices,swaps,model,test):
+    windows = WalkForward.walk_forward_windows(prices.index,'2D',test)
+    return WalkForward.run_walk_forward(make_strategy,model,prices,swaps,windows,1.0,1000.0,0.0005,18,18,max_workers=1)
+
+
+def test_one_day_test_windows_are_annualized_over_a_day():
+    prices,swaps,model = synthetic_market(4*1440 + 1)
+    results            = walk_forward(prices,swaps,model,'1D')['windows']
+
+    assert len(results) == 2
+    assert results['error'].isna().all()
+    assert (results['days_strategy'] == 1).all()
+    np.testing.assert_allclose(results['net_apr'],results['net_return']*365)
+    assert np.isfinite(results['sharpe_ratio']).all()
+
+
+def test_test_windows_shorter_than_a_day_are_rejected():
+    prices,swaps,model = synthetic_market(3*1440 + 1)
+    with pytest.raises(ValueError,match='less than a day'):
+        walk_forward(prices,swaps,model,'12h')